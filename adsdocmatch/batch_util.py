@@ -0,0 +1,576 @@
+import os
+import asyncio
+import copy
+import queue
+import threading
+import time
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+
+from adsdocmatch.cache_util import get_hash
+
+
+class RateLimiter():
+    """
+    spaces out the start of calls so that, across all the workers sharing it,
+    no more than `rate` calls per second are started
+    """
+
+    def __init__(self, rate):
+        """
+
+        :param rate: calls per second, zero or negative means no limit
+        """
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self.next_time = 0
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """
+        take the next start time
+
+        :return: seconds the caller has to wait before starting its call
+        """
+        if not self.interval:
+            return 0
+        with self.lock:
+            now = time.monotonic()
+            start_time = max(self.next_time, now)
+            self.next_time = start_time + self.interval
+        return start_time - now
+
+    def wait(self):
+        """
+        block until the caller is allowed to start its call
+
+        :return:
+        """
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def ordered_map(func, items, num_workers, rate_limiter=None, executor_class=ThreadPoolExecutor, max_pending=None):
+    """
+    apply func to each item using a pool of num_workers threads,
+    keeping at most max_pending calls submitted at once,
+    and yield (item, result) in the same order items were given
+
+    :param func:
+    :param items: any iterable, consumed lazily
+    :param num_workers:
+    :param rate_limiter: optional RateLimiter, waited on before each call
+    :param executor_class: ProcessPoolExecutor to run func in worker processes, func and items then have to be picklable
+    :param max_pending: most calls submitted at once, if not specified, twice num_workers
+    :return:
+    """
+    def call(item):
+        if rate_limiter:
+            rate_limiter.wait()
+        return func(item)
+
+    num_workers = max(int(num_workers), 1)
+    max_pending = max(int(max_pending or 2 * num_workers), 1)
+    with executor_class(max_workers=num_workers) as executor:
+        pending = deque()
+        for item in items:
+            # a closure cannot be sent to another process, submit func itself when there is no need for the wrapper
+            pending.append((item, executor.submit(call if rate_limiter else func, item)))
+            if len(pending) >= max_pending:
+                item, future = pending.popleft()
+                yield item, future.result()
+        while pending:
+            item, future = pending.popleft()
+            yield item, future.result()
+
+
+async def ordered_map_async(func, items, max_pending, rate_limiter=None):
+    """
+    asyncio version of ordered_map, func is a coroutine function, at most max_pending
+    calls are awaited at once, and (item, result) are yielded in the same order items were given
+
+    items are read on the default executor, so that an iterable that blocks does not hold up the loop,
+    and the calls still pending when the caller stops early are cancelled
+
+    :param func:
+    :param items: any iterable, consumed lazily
+    :param max_pending:
+    :param rate_limiter: optional RateLimiter, waited on before each call
+    :return:
+    """
+    async def call(item):
+        delay = rate_limiter.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return await func(item)
+
+    done = object()
+    loop = asyncio.get_running_loop()
+    iterator = iter(items)
+    max_pending = max(int(max_pending), 1)
+    pending = deque()
+    try:
+        while True:
+            item = await loop.run_in_executor(None, next, iterator, done)
+            if item is done:
+                break
+            pending.append((item, asyncio.ensure_future(call(item) if rate_limiter else func(item))))
+            if len(pending) >= max_pending:
+                item, task = pending.popleft()
+                yield item, await task
+        while pending:
+            item, task = pending.popleft()
+            yield item, await task
+    finally:
+        for _, task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*[task for _, task in pending], return_exceptions=True)
+
+
+def threaded_stage(func, items, queue_size):
+    """
+    apply func to each item on a background thread, handing (item, result) over
+    through a queue of at most queue_size entries, so that this stage runs ahead of
+    the caller, but never by more than queue_size items
+
+    an exception raised by func or by items is raised again in the caller, and
+    when the caller stops early the background thread stops as well
+
+    :param func:
+    :param items: any iterable, consumed lazily on the background thread
+    :param queue_size:
+    :return:
+    """
+    done = object()
+    stage_queue = queue.Queue(maxsize=max(int(queue_size), 1))
+    stop = threading.Event()
+
+    def put(entry):
+        # do not block forever if the caller is gone
+        while not stop.is_set():
+            try:
+                stage_queue.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def run():
+        try:
+            for item in items:
+                if not put((item, func(item), None)):
+                    return
+        except BaseException as e:
+            put((None, None, e))
+            return
+        put((done, None, None))
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, result, error = stage_queue.get()
+            if error is not None:
+                raise error
+            if item is done:
+                break
+            yield item, result
+    finally:
+        stop.set()
+        thread.join()
+
+
+class Prefetcher():
+    """
+    reads the metadata files of upcoming records on a pool of threads, at most window records ahead
+    of the consumer, so that the latency of reading from network storage overlaps the work on earlier records
+
+    a hit is a file that was already read when the consumer got to it, a miss one it had to wait for
+    """
+
+    def __init__(self, window, num_threads=4, readahead=False):
+        """
+
+        :param window: most records read ahead
+        :param num_threads:
+        :param readahead: if True, hint the kernel to read the whole file ahead, where posix_fadvise is available
+        """
+        self.window = max(int(window), 1)
+        self.num_threads = max(int(num_threads), 1)
+        self.readahead = readahead and hasattr(os, 'posix_fadvise')
+        self.num_hits = 0
+        self.num_misses = 0
+        self.wait_sec = 0.0
+        self.lock = threading.Lock()
+
+    def read_file(self, filename):
+        """
+
+        :param filename:
+        :return: contents of the file
+        """
+        with open(filename, 'rb') as fp:
+            if self.readahead:
+                os.posix_fadvise(fp.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+            return fp.read()
+
+    def prefetch(self, records):
+        """
+        yield the records in the same order, with the contents of the file in place of the metadata
+        for the records that are files to be read, a file that could not be read is left for the
+        consumer to open, and to report the error
+
+        :param records: iterable of (filename, metadata), metadata is None if the file is to be read
+        :return:
+        """
+        with ThreadPoolExecutor(max_workers=self.num_threads) as executor:
+            pending = deque()
+            for record in records:
+                future = executor.submit(self.read_file, record[0]) if record[1] is None else None
+                pending.append((record, future))
+                if len(pending) > self.window:
+                    yield self.get_record(*pending.popleft())
+            while pending:
+                yield self.get_record(*pending.popleft())
+
+    def get_record(self, record, future):
+        """
+
+        :param record:
+        :param future: file being read, or None if the record had nothing to read
+        :return:
+        """
+        if future is None:
+            return record
+        is_hit = future.done()
+        start_time = time.monotonic()
+        try:
+            contents = future.result()
+        except Exception:
+            contents = None
+        with self.lock:
+            if is_hit:
+                self.num_hits += 1
+            else:
+                self.num_misses += 1
+                self.wait_sec += time.monotonic() - start_time
+        return record[0], contents
+
+    def get_stats(self):
+        """
+
+        :return: number of files read ahead in time, and not, and the seconds spent waiting for the latter
+        """
+        with self.lock:
+            return {'hits': self.num_hits, 'misses': self.num_misses, 'wait_sec': round(self.wait_sec, 3)}
+
+
+class ConcurrencyController():
+    """
+    additive increase/multiplicative decrease (AIMD) limit on the number of oracle
+    requests in flight, shared by all the workers of a batch run
+
+    the limit goes up by one after a full window of healthy responses (status 200 and
+    latency under the threshold), and is cut by decrease_factor, across all the workers,
+    when the oracle service answers with a gateway error
+    """
+
+    GATEWAY_ERRORS = [502, 504]
+
+    def __init__(self, initial, minimum, maximum, latency_threshold, decrease_factor=0.5):
+        """
+
+        :param initial: number of requests allowed in flight at the start
+        :param minimum:
+        :param maximum:
+        :param latency_threshold: seconds, responses slower than this do not count as healthy
+        :param decrease_factor:
+        """
+        self.minimum = max(int(minimum), 1)
+        self.maximum = max(int(maximum), self.minimum)
+        self.limit = float(min(max(int(initial), self.minimum), self.maximum))
+        self.latency_threshold = latency_threshold
+        self.decrease_factor = decrease_factor
+        self.in_flight = 0
+        self.healthy = 0
+        self.last_decrease = None
+        self.num_responses = 0
+        self.num_errors = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """
+        block until there is room for one more request in flight
+
+        :return:
+        """
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self):
+        """
+
+        :return:
+        """
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def record(self, status_code, latency):
+        """
+        adjust the limit from the outcome of one request
+
+        :param status_code: http status code, or None if the request raised an exception
+        :param latency: seconds the request took
+        :return:
+        """
+        with self.condition:
+            self.num_responses += 1
+            if status_code in self.GATEWAY_ERRORS or status_code is None:
+                self.num_errors += 1
+                self.healthy = 0
+                # requests that were already in flight when the first error came back
+                # report the same overload, so decrease only once per latency period
+                now = time.monotonic()
+                if self.last_decrease is None or now - self.last_decrease > self.latency_threshold:
+                    self.limit = max(self.minimum, self.limit * self.decrease_factor)
+                    self.last_decrease = now
+            elif status_code == 200 and latency <= self.latency_threshold:
+                self.healthy += 1
+                if self.healthy >= int(self.limit):
+                    self.limit = min(self.maximum, self.limit + 1)
+                    self.healthy = 0
+                    self.condition.notify_all()
+            else:
+                self.healthy = 0
+
+    def get_stats(self):
+        """
+
+        :return: current limit, number of responses recorded and how many of them were errors
+        """
+        with self.condition:
+            return {'limit': int(self.limit), 'responses': self.num_responses, 'errors': self.num_errors}
+
+
+class RequestDeduplicator():
+    """
+    sends identical requests of a batch run only once, duplicates get a copy of the result of the first one,
+    waiting for it if it is still in flight
+
+    a request is identified by the bibcode and a hash of the payload, so that a record listed twice is matched once,
+    while a record replaced with new metadata is matched again, the results of the last maxsize requests are kept,
+    and failed results are not kept, so that a later duplicate gets another chance
+    """
+
+    def __init__(self, maxsize=100000):
+        """
+
+        :param maxsize: number of results kept
+        """
+        self.maxsize = max(int(maxsize), 1)
+        self.entries = OrderedDict()
+        self.num_requests = 0
+        self.num_saved = 0
+        self.lock = threading.Lock()
+
+    def get_key(self, payload):
+        """
+
+        :param payload: body sent to oracle
+        :return:
+        """
+        return payload.get('bibcode'), get_hash(payload)
+
+    def get_entry(self, payload):
+        """
+
+        :param payload: body sent to oracle
+        :return: key, future of the result, and True if the caller is the first with this payload and has to send it
+        """
+        key = self.get_key(payload)
+        with self.lock:
+            self.num_requests += 1
+            entry = self.entries.get(key)
+            is_first = entry is None
+            if is_first:
+                entry = Future()
+                self.entries[key] = entry
+                if len(self.entries) > self.maxsize:
+                    self.entries.popitem(last=False)
+            else:
+                self.num_saved += 1
+                self.entries.move_to_end(key)
+        return key, entry, is_first
+
+    def set_result(self, key, entry, result):
+        """
+
+        :param key:
+        :param entry:
+        :param result: returned by the first caller
+        :return:
+        """
+        entry.set_result(result)
+        if result and result[0].get('status_flaw', None):
+            self.discard(key, entry)
+
+    def set_exception(self, key, entry, exception):
+        """
+
+        :param key:
+        :param entry:
+        :param exception: raised by the first caller
+        :return:
+        """
+        entry.set_exception(exception)
+        self.discard(key, entry)
+
+    def call(self, payload, func):
+        """
+
+        :param payload: body sent to oracle
+        :param func: sends the request, called without arguments only if this payload was not seen before
+        :return: copy of the result of func, duplicates are free to change it
+        """
+        key, entry, is_first = self.get_entry(payload)
+        if is_first:
+            try:
+                self.set_result(key, entry, func())
+            except BaseException as e:
+                self.set_exception(key, entry, e)
+                raise
+        return copy.deepcopy(entry.result())
+
+    async def call_async(self, payload, func):
+        """
+        asyncio version of call, func returns a coroutine
+
+        :param payload: body sent to oracle
+        :param func:
+        :return:
+        """
+        key, entry, is_first = self.get_entry(payload)
+        if is_first:
+            try:
+                self.set_result(key, entry, await func())
+            except BaseException as e:
+                self.set_exception(key, entry, e)
+                raise
+        return copy.deepcopy(await asyncio.wrap_future(entry))
+
+    def discard(self, key, entry):
+        """
+
+        :param key:
+        :param entry:
+        :return:
+        """
+        with self.lock:
+            if self.entries.get(key) is entry:
+                del self.entries[key]
+
+    def get_stats(self):
+        """
+
+        :return: number of requests, and how many of them were not sent since they were duplicates
+        """
+        with self.lock:
+            return {'requests': self.num_requests, 'saved': self.num_saved}
+
+
+class MatchJournal():
+    """
+    durable record of the input filenames a batch run has finished, one line per filename
+    with its outcome, kept next to the result file, so that an interrupted run can resume
+    from where it stopped instead of reprocessing, and appending duplicate rows for, every record
+    """
+
+    EXTENSION = '.journal'
+
+    def __init__(self, result_filename):
+        """
+
+        :param result_filename: the journal is this filename with the extension .journal
+        """
+        self.filename = result_filename + self.EXTENSION
+        self.fp = None
+
+    def get_completed(self):
+        """
+
+        :return: dict of filename to outcome for the records completed so far
+        """
+        completed = {}
+        try:
+            with open(self.filename, 'r') as fp:
+                for line in fp:
+                    columns = line.rstrip('\r\n').split('\t')
+                    # a line cut short by a crash does not count as completed
+                    if len(columns) == 2:
+                        completed[columns[0]] = columns[1]
+        except FileNotFoundError:
+            pass
+        return completed
+
+    def open(self, resume=False):
+        """
+
+        :param resume: if True keep the existing entries, otherwise start a new journal
+        :return: dict of filename to outcome for the records to skip
+        """
+        completed = {}
+        if resume:
+            completed = self.get_completed()
+            self.truncate_partial_line()
+        self.fp = open(self.filename, 'a' if resume else 'w')
+        return completed
+
+    def truncate_partial_line(self):
+        """
+        drop the last line if the process was killed while writing it
+
+        :return:
+        """
+        try:
+            with open(self.filename, 'rb+') as fp:
+                contents = fp.read()
+                if contents and not contents.endswith(b'\n'):
+                    fp.truncate(contents.rfind(b'\n') + 1)
+        except FileNotFoundError:
+            pass
+
+    def add(self, filename, outcome):
+        """
+        called once the results of filename are written, flushed right away so that
+        the entry survives the process being killed
+
+        :param filename:
+        :param outcome:
+        :return:
+        """
+        self.add_many([(filename, outcome)])
+
+    def add_many(self, entries):
+        """
+        same as add, for the records written out together
+
+        :param entries: list of (filename, outcome)
+        :return:
+        """
+        self.fp.write(''.join(['%s\t%s\n' % (filename, outcome) for filename, outcome in entries]))
+        self.fp.flush()
+
+    def close(self):
+        """
+
+        :return:
+        """
+        if self.fp:
+            self.fp.flush()
+            os.fsync(self.fp.fileno())
+            self.fp.close()
+            self.fp = None
@@ -0,0 +1,171 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+def get_hash(value):
+    """
+    hash of a json serializable value, independent of the order of the keys
+
+    :param value:
+    :return:
+    """
+    return hashlib.sha1(json.dumps(value, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class LRUCache():
+    """
+    in memory cache of the last maxsize values set, shared by the threads of a process
+    """
+
+    def __init__(self, maxsize):
+        """
+
+        :param maxsize: zero means nothing is cached
+        """
+        self.maxsize = int(maxsize)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0}
+
+    def get(self, key):
+        """
+
+        :param key:
+        :return: cached value, or None if not cached
+        """
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.stats['misses'] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return value
+
+    def set(self, key, value):
+        """
+
+        :param key:
+        :param value:
+        :return:
+        """
+        if self.maxsize <= 0:
+            return
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def get_stats(self):
+        """
+
+        :return: hits and misses since the cache was created, the hit rate, and the number of entries
+        """
+        with self.lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return dict(self.stats, hit_rate=round(float(self.stats['hits']) / lookups, 3) if lookups else 0.0, entries=len(self.entries))
+
+
+class SQLiteCache():
+    """
+    local persistent key/value cache of strings in a sqlite file, shared by the threads of a process
+
+    entries expire ttl_sec seconds after they were written, and once there are more than max_entries,
+    the least recently used ones are evicted
+    """
+
+    def __init__(self, filename, ttl_sec=0, max_entries=0):
+        """
+
+        :param filename: sqlite file, created if it does not exist
+        :param ttl_sec: zero means entries do not expire
+        :param max_entries: zero means no limit
+        """
+        self.filename = filename
+        self.ttl_sec = float(ttl_sec)
+        self.max_entries = int(max_entries)
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'writes': 0, 'evictions': 0}
+
+        directory = os.path.dirname(os.path.abspath(filename))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.connection = sqlite3.connect(filename, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, created REAL, accessed REAL)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)')
+        self.num_entries = self.connection.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+
+    def get(self, key):
+        """
+
+        :param key:
+        :return: cached value, or None if not cached or expired
+        """
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute('SELECT value, created FROM cache WHERE key = ?', (key,)).fetchone()
+            if row and (not self.ttl_sec or now - row[1] <= self.ttl_sec):
+                self.connection.execute('UPDATE cache SET accessed = ? WHERE key = ?', (now, key))
+                self.stats['hits'] += 1
+                return row[0]
+            if row:
+                self.connection.execute('DELETE FROM cache WHERE key = ?', (key,))
+                self.num_entries -= 1
+            self.stats['misses'] += 1
+            return None
+
+    def set(self, key, value):
+        """
+
+        :param key:
+        :param value:
+        :return:
+        """
+        now = time.time()
+        with self.lock:
+            cursor = self.connection.execute('UPDATE cache SET value = ?, created = ?, accessed = ? WHERE key = ?', (value, now, now, key))
+            if cursor.rowcount == 0:
+                self.connection.execute('INSERT INTO cache (key, value, created, accessed) VALUES (?, ?, ?, ?)', (key, value, now, now))
+                self.num_entries += 1
+            self.stats['writes'] += 1
+            if self.max_entries and self.num_entries > self.max_entries:
+                self.evict(self.num_entries - self.max_entries)
+
+    def evict(self, count):
+        """
+        remove the expired entries, and then the least recently used ones if there are still too many,
+        called with the lock held
+
+        :param count: number of entries to remove
+        :return:
+        """
+        removed = 0
+        if self.ttl_sec:
+            removed += self.connection.execute('DELETE FROM cache WHERE created < ?', (time.time() - self.ttl_sec,)).rowcount
+        if removed < count:
+            removed += self.connection.execute('DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed LIMIT ?)', (count - removed,)).rowcount
+        self.num_entries -= removed
+        self.stats['evictions'] += removed
+
+    def get_stats(self):
+        """
+
+        :return: hits, misses, writes, and evictions since the cache was opened
+        """
+        with self.lock:
+            return dict(self.stats, entries=self.num_entries)
+
+    def close(self):
+        """
+
+        :return:
+        """
+        with self.lock:
+            self.connection.close()
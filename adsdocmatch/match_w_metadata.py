@@ -1,11 +1,25 @@
 import os
+import asyncio
 import time
+import itertools
+import functools
+import hashlib
+import json
+import gzip
+import io
+import tarfile
+import zipfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
 import re
 import csv
 
-from adsdocmatch.pub_parser import get_pub_metadata
-from adsdocmatch.oracle_util import OracleUtil
+from adsdocmatch.pub_parser import get_pub_record, get_pub_bibcode, PubMetadata
+from adsdocmatch.oracle_async import AsyncOracleUtil, get_oracle_util
 from adsdocmatch.matchable_status import matchable_status
+from adsdocmatch.batch_util import RateLimiter, Prefetcher, ConcurrencyController, RequestDeduplicator, MatchJournal, ordered_map, ordered_map_async, threaded_stage
+from adsdocmatch.result_sink import ResultSink
+from adsdocmatch.cache_util import SQLiteCache
 from adsputils import setup_logging, load_config
 
 proj_home = os.path.realpath(os.path.join(os.path.dirname(__file__), "../"))
@@ -29,23 +43,133 @@ class MatchMetadata():
 
     process_pub_bibstem = {}
 
-    ORACLE_UTIL = OracleUtil()
+    ORACLE_UTIL = get_oracle_util()
 
-    def get_input_filenames(self, filename):
+    _metadata_cache = None
+    _metadata_cache_pid = None
+    _metadata_cache_lock = threading.Lock()
+
+    @property
+    def metadata_cache(self):
+        """
+        local cache of the parsed metadata files, opened on first use in each process, since the parsing processes
+        cannot share the connection of the parent, None if DOCMATCHPIPELINE_METADATA_CACHE_FILENAME is not set
+
+        :return:
+        """
+        if not config.get('DOCMATCHPIPELINE_METADATA_CACHE_FILENAME', ''):
+            return None
+        if self._metadata_cache_pid != os.getpid():
+            with self._metadata_cache_lock:
+                if self._metadata_cache_pid != os.getpid():
+                    self._metadata_cache = SQLiteCache(config['DOCMATCHPIPELINE_METADATA_CACHE_FILENAME'],
+                                                       max_entries=int(config.get('DOCMATCHPIPELINE_METADATA_CACHE_MAX_ENTRIES', 0)))
+                    self._metadata_cache_pid = os.getpid()
+        return self._metadata_cache
+
+    def iter_input_filenames(self, filename):
         """
-        read input file and return list of arXiv metadata full filenames
+        read input file and yield the arXiv metadata full filenames one at a time as they are read,
+        so that the input list is never held in memory
 
         :param filename:
         :return:
         """
-        filenames = []
         try:
             with open(filename, 'r') as fp:
-                for filename in fp.readlines():
-                    filenames.append(filename.rstrip('\r\n'))
+                for line in fp:
+                    yield line.rstrip('\r\n')
         except Exception as e:
             logger.error('Unable to open/read input file', e)
-        return filenames
+
+    def iter_input_records(self, input_filename):
+        """
+        yield (name, metadata) for each record of a batch run, name is logged to the result, rerun, and journal files
+
+        the input is either the list of metadata filenames, then metadata is None and the file is read when the record is
+        prepared, or a JSON Lines file (.jsonl, or gzipped .jsonl.gz) of records, one object per line, with the fields
+        returned by get_pub_metadata, and optionally the filename to name the record with, or an archive (.tar, .tar.gz,
+        .tgz, or .zip) of metadata files, then metadata is the bytes of the file, and the record is named after the member
+
+        :param input_filename:
+        :return:
+        """
+        if input_filename.endswith(('.jsonl', '.jsonl.gz')):
+            return self.iter_jsonl_records(input_filename)
+        if input_filename.endswith(('.tar', '.tar.gz', '.tgz')):
+            return self.iter_tar_records(input_filename)
+        if input_filename.endswith('.zip'):
+            return self.iter_zip_records(input_filename)
+        return ((filename, None) for filename in self.iter_input_filenames(input_filename))
+
+    def iter_jsonl_records(self, input_filename):
+        """
+        read the records of a JSON Lines file one line at a time, records without a filename are named
+        after the input file and their line number, lines that cannot be read are logged and skipped
+
+        :param input_filename:
+        :return:
+        """
+        try:
+            with (gzip.open if input_filename.endswith('.gz') else open)(input_filename, 'rt', encoding='utf-8') as fp:
+                for line_number, line in enumerate(fp, 1):
+                    if not line.strip():
+                        continue
+                    name = '%s:%d' % (input_filename, line_number)
+                    try:
+                        record = json.loads(line)
+                        name = record.get('filename') or name
+                        metadata = PubMetadata(name, **{key: record[key] for key in PubMetadata.FIELDS if record.get(key)})
+                    except Exception as e:
+                        logger.error('Unable to read record %s: %s' % (name, e))
+                        continue
+                    yield name, metadata
+        except Exception as e:
+            logger.error('Unable to open/read input file %s: %s' % (input_filename, e))
+
+    def iter_tar_records(self, input_filename):
+        """
+        read the metadata files of a tar archive, compressed or not, as a stream, without extracting them to disk
+
+        :param input_filename:
+        :return:
+        """
+        try:
+            with tarfile.open(input_filename, 'r|*') as archive:
+                for member in archive:
+                    if member.isfile():
+                        yield member.name, archive.extractfile(member).read()
+        except Exception as e:
+            logger.error('Unable to open/read input file %s: %s' % (input_filename, e))
+
+    def iter_zip_records(self, input_filename):
+        """
+        read the metadata files of a zip archive one at a time, without extracting them to disk
+
+        :param input_filename:
+        :return:
+        """
+        try:
+            with zipfile.ZipFile(input_filename) as archive:
+                for member in archive.infolist():
+                    if not member.is_dir():
+                        yield member.filename, archive.read(member)
+        except Exception as e:
+            logger.error('Unable to open/read input file %s: %s' % (input_filename, e))
+
+    def get_input_filename(self, path):
+        """
+        the input of a batch run is the bundle of records, or the archive of metadata files, of the day if there is one,
+        otherwise the list of metadata filenames
+
+        :param path:
+        :return:
+        """
+        for config_key in ['DOCMATCHPIPELINE_INPUT_RECORDS_FILENAME', 'DOCMATCHPIPELINE_INPUT_ARCHIVE_FILENAME']:
+            bundle_filename = config.get(config_key, '')
+            if bundle_filename and os.path.isfile("%s%s" % (path, bundle_filename)):
+                return "%s%s" % (path, bundle_filename)
+        return "%s%s" % (path, config.get('DOCMATCHPIPELINE_INPUT_FILENAME', 'default'))
 
     def process_results(self, results, separator):
         """
@@ -83,60 +207,227 @@ class MatchMetadata():
             self.process_pub_bibstem[bibstem] = 1 if status == True else (0 if status == False else -1)
         return self.process_pub_bibstem[bibstem]
 
-    def write_results(self, result_filename, matches, metadata_filename, rerun_filename):
+    def get_exception_results(self, exception, prepared):
         """
 
-        :param result_filename:
-        :param matches:
-        :param metadata_filename:
-        :param rerun_filename:
+        :param exception:
+        :param prepared: dict returned by prepare_match_to_arXiv or prepare_match_to_pub
         :return:
         """
-        csv_file = result_filename
-        if os.path.exists(csv_file):
-            fp = open(csv_file, 'a')
-        else:
-            fp = open(csv_file, 'w')
-            # new file, write header line
-            fp.write('source bibcode (link),verified bibcode,matched bibcode (link),label,confidence,matched scores,comment\n')
+        logger.error('Exception: %s'%exception)
+        return [{'source_bibcode': 'no bibcode', 'comment' : 'Exception: %s in metadata file: %s'%(exception, prepared['filename']), 'status_flaw' : prepared['exception_flaw']}]
 
-        hyperlink_format = '"=HYPERLINK(""https://ui.adsabs.harvard.edu/abs/%s/abstract"",""%s"")"'
-        double_quote = '"%s"'
-
-        for match in matches:
-            match_parts = match.split('\t')
-            if len(match_parts) == 6:
-                source_bibcode = match_parts[0]
-                matched_bibcode = match_parts[1]
-                fp.write('%s,,%s,%s,%s,%s,%s\n' % (
-                    hyperlink_format % (source_bibcode, source_bibcode),
-                    hyperlink_format % (matched_bibcode, matched_bibcode),
-                    match_parts[2],
-                    match_parts[3],
-                    double_quote % match_parts[4],
-                    double_quote % match_parts[5],
-                ))
+    def send_prepared_match(self, prepared, deduplicator=None):
+        """
+        second half of match_to_arXiv and match_to_pub, send the prepared metadata to oracle,
+        unless the results were already decided while preparing
+
+        :param prepared: dict returned by prepare_match_to_arXiv or prepare_match_to_pub
+        :param deduplicator: optional RequestDeduplicator, to send identical payloads only once
+        :return:
+        """
+        if 'metadata' not in prepared:
+            return prepared.get('results')
+        try:
+            # payload is passed only when built by prepare_match_payload
+            kwargs = {'payload': prepared['payload']} if 'payload' in prepared else {}
+            def get_matches():
+                return self.ORACLE_UTIL.get_matches(prepared['metadata'], prepared['doctype'], prepared['must_match'], prepared['match_doctype'], **kwargs)
+            if deduplicator and 'payload' in prepared:
+                oracle_matches = deduplicator.call(prepared['payload'], get_matches)
             else:
-                # it is an error write it out
-                fp.write("%s\n" % match_parts)
-                # only log rerun if it failed to be processed from oracle side
-                if 'status_flaw' in ' '.join(match_parts):
-                    self.log_failed_match(metadata_filename, rerun_filename)
-        fp.close()
+                oracle_matches = get_matches()
+            return self.add_metadata_comment(oracle_matches, prepared['comments'])
+        except Exception as e:
+            return self.get_exception_results(e, prepared)
 
-    def log_failed_match(self, metadata_filename, rerun_filename):
+    async def send_prepared_match_async(self, prepared, session, deduplicator=None):
         """
+        asyncio version of send_prepared_match, when ORACLE_UTIL is an AsyncOracleUtil
 
-        :param metadata_filename: log this to be processed in later time
-        :param rerun_filename:
+        :param prepared: dict returned by prepare_match_to_arXiv or prepare_match_to_pub
+        :param session: aiohttp ClientSession to send the request on
+        :param deduplicator: optional RequestDeduplicator, to send identical payloads only once
+        :return:
+        """
+        if 'metadata' not in prepared:
+            return prepared.get('results')
+        try:
+            # payload is passed only when built by prepare_match_payload
+            kwargs = {'payload': prepared['payload']} if 'payload' in prepared else {}
+            def get_matches():
+                return self.ORACLE_UTIL.get_matches_async(prepared['metadata'], prepared['doctype'], prepared['must_match'], prepared['match_doctype'], session=session, **kwargs)
+            if deduplicator and 'payload' in prepared:
+                oracle_matches = await deduplicator.call_async(prepared['payload'], get_matches)
+            else:
+                oracle_matches = await get_matches()
+            return self.add_metadata_comment(oracle_matches, prepared['comments'])
+        except Exception as e:
+            return self.get_exception_results(e, prepared)
+
+    async def send_prepared_matches_async(self, prepared_records, result_sink, max_pending, rate_limiter=None, deduplicator=None):
+        """
+        send the prepared records on one session, with at most max_pending requests in flight,
+        and write their results in order
+
+        :param prepared_records: iterable of (record, prepared)
+        :param result_sink:
+        :param max_pending:
+        :param rate_limiter:
+        :param deduplicator:
+        :return: number of records written
+        """
+        count = 0
+        async with self.ORACLE_UTIL.open_session() as session:
+            async def send_prepared_match(filename_prepared):
+                return await self.send_prepared_match_async(filename_prepared[1], session, deduplicator)
+            async for (_, prepared), results in ordered_map_async(send_prepared_match, prepared_records, max_pending, rate_limiter):
+                result_sink.write(prepared['filename'], results, self.get_match_outcome(results))
+                count += 1
+        return count
+
+    def prepare_match_payload(self, prepare_match, filename, metadata=None):
+        """
+        the cpu bound part of a match: parse the metadata file, and build the body sent to oracle,
+        run on a process of its own in batch runs when DOCMATCHPIPELINE_MATCH_PARSE_PROCESSES is set
+
+        :param prepare_match: either prepare_match_to_pub or prepare_match_to_arXiv
+        :param filename:
+        :param metadata: record already read, or the bytes of the metadata file, if not given the file is read
+        :return: dict returned by prepare_match, with the payload if it could be built
+        """
+        prepared = prepare_match(filename, metadata)
+        if 'metadata' in prepared:
+            try:
+                prepared['payload'] = self.make_match_payload(prepared)
+            except KeyError:
+                # leave it to get_matches to report the missing field
+                pass
+        return prepared
+
+    def prepare_input_record(self, prepare_match, record):
+        """
+
+        :param prepare_match: either prepare_match_to_pub or prepare_match_to_arXiv
+        :param record: (name, metadata) yielded by iter_input_records
+        :return:
+        """
+        return self.prepare_match_payload(prepare_match, *record)
+
+    def make_match_payload(self, prepared):
+        """
+        build the body sent to oracle, taking the normalized authors and the dois from the metadata cache
+        if the record went through it, they only depend on the contents of the file, on the kind of match,
+        and on the number of authors sent
+
+        :param prepared: dict returned by prepare_match_to_arXiv or prepare_match_to_pub
+        :return:
+        """
+        metadata = prepared['metadata']
+        content_hash = getattr(metadata, 'content_hash', None)
+        cache_key = None
+        derived = None
+        if content_hash and self.metadata_cache:
+            cache_key = 'payload:%s:%d:%s' % (prepared['doctype'], self.ORACLE_UTIL.max_authors, content_hash)
+            cached = self.metadata_cache.get(cache_key)
+            if cached:
+                derived = json.loads(cached)
+        payload = self.ORACLE_UTIL.make_match_payload(metadata, prepared['doctype'], prepared['must_match'], prepared['match_doctype'], derived)
+        if cache_key and not derived:
+            self.metadata_cache.set(cache_key, json.dumps({key: payload[key] for key in ['author', 'author_count', 'doi'] if key in payload}))
+        return payload
+
+    def open_metadata(self, filename, contents=None):
+        """
+
+        :param filename:
+        :param contents: bytes of the metadata file when it was read from an archive, then filename is the member name
+        :return: metadata file opened in binary mode
+        """
+        if contents is not None:
+            return io.BytesIO(contents)
+        return open(filename, 'rb')
+
+    def read_metadata(self, filename, metadata=None):
+        """
+
+        :param filename:
+        :param metadata: record already parsed, ie by pub_parser.get_pub_record, or the bytes of the metadata file
         :return:
         """
-        if os.path.exists(rerun_filename):
-            fp = open(rerun_filename, 'a')
+        if metadata is not None and not isinstance(metadata, bytes):
+            return metadata
+        with self.open_metadata(filename, metadata) as fp:
+            return self.parse_metadata(fp, filename)
+
+    def parse_metadata(self, fp, filename):
+        """
+        parse the metadata file, unless it is found in the metadata cache
+
+        :param fp: metadata file opened in binary mode
+        :param filename:
+        :return: PubMetadata, with the hash of the file contents when the cache is on
+        """
+        metadata_cache = self.metadata_cache
+        if not metadata_cache:
+            return get_pub_record(fp, filename)
+        contents = fp.read()
+        content_hash = hashlib.sha1(contents).hexdigest()
+        cache_key = 'metadata:%s' % content_hash
+        cached = metadata_cache.get(cache_key)
+        if cached:
+            metadata = PubMetadata(filename, **json.loads(cached))
         else:
-            fp = open(rerun_filename, 'w')
-        fp.write("%s\n"%metadata_filename)
-        fp.close()
+            metadata = get_pub_record(contents, filename)
+            metadata_cache.set(cache_key, json.dumps(metadata.to_dict()))
+        metadata.content_hash = content_hash
+        return metadata
+
+    def read_matchable_metadata(self, filename, contents=None):
+        """
+        read the bibcode from the header of the pub metadata file, and ask journal db about it before parsing the
+        whole file, so that the abstract and the entities are decoded only for the records that are to be matched
+
+        :param filename:
+        :param contents: bytes of the metadata file when it was read from an archive
+        :return: metadata, with only the bibcode if the journal is not to be matched, and the status returned by process_pub_metadata
+        """
+        with self.open_metadata(filename, contents) as fp:
+            bibcode = get_pub_bibcode(fp)
+            if bibcode:
+                metadata = PubMetadata(filename, bibcode=bibcode)
+                status = self.process_pub_metadata(metadata)
+                if status != 1:
+                    return metadata, status
+            fp.seek(0)
+            metadata = self.parse_metadata(fp, filename)
+        if not bibcode:
+            status = self.process_pub_metadata(metadata)
+        return metadata, status
+
+    def prepare_match_to_arXiv(self, filename, metadata=None):
+        """
+        first half of match_to_arXiv, ask journal db if the pub metadata file should be matched, and if so parse it
+
+        :param filename:
+        :param metadata: record returned by pub_parser.get_pub_record, or the bytes of the metadata file, if not given the file is read
+        :return: dict with the arguments for oracle, or with the results if there is nothing to send
+        """
+        prepared = {'filename': filename, 'exception_flaw': 'got exception -- processing stopped -- shall be added to the rerun list.'}
+        try:
+            if metadata is None or isinstance(metadata, bytes):
+                metadata, status = self.read_matchable_metadata(filename, metadata)
+            else:
+                status = self.process_pub_metadata(metadata)
+            if status == 1:
+                prepared.update({'metadata': metadata, 'doctype': 'article', 'must_match': False, 'match_doctype': None, 'comments': ''})
+            elif status == 0:
+                prepared['results'] = [{'source_bibcode': metadata.get('bibcode'), 'comment': 'from JournalDB: do not match.'}]
+            elif status == -1:
+                prepared['results'] = [{'source_bibcode': metadata.get('bibcode'), 'comment': 'from JournalDB: did not recognize the bibcode.', 'status_flaw': 'unrecognizable bibstem -- processing stopped -- shall be added to the rerun list.'}]
+        except Exception as e:
+            prepared['results'] = self.get_exception_results(e, prepared)
+        return prepared
 
     def match_to_arXiv(self, filename):
         """
@@ -146,19 +437,19 @@ class MatchMetadata():
         :param filename:
         :return:
         """
-        try:
-            with open(filename, 'rb') as pub_fp:
-                metadata = get_pub_metadata(pub_fp.read())
-                status = self.process_pub_metadata(metadata)
-                if status == 1:
-                    return self.ORACLE_UTIL.get_matches(metadata, 'article')
-                elif status == 0:
-                    return [{'source_bibcode': metadata.get('bibcode'), 'comment': 'from JournalDB: do not match.'}]
-                elif status == -1:
-                    return [{'source_bibcode': metadata.get('bibcode'), 'comment': 'from JournalDB: did not recognize the bibcode.', 'status_flaw': 'unrecognizable bibstem -- processing stopped -- shall be added to the rerun list.'}]
-        except Exception as e:
-            logger.error('Exception: %s'%e)
-            return [{'source_bibcode': 'no bibcode', 'comment' : 'Exception: %s in metadata file: %s'%(e, filename), 'status_flaw' : 'got exception -- processing stopped -- shall be added to the rerun list.'}]
+        return self.send_prepared_match(self.prepare_match_to_arXiv(filename))
+
+    def single_match_prepared(self, prepared):
+        """
+        send the prepared metadata to oracle and format the results for the output file
+
+        :param prepared: dict returned by prepare_match_to_arXiv or prepare_match_to_pub
+        :return:
+        """
+        results = self.send_prepared_match(prepared)
+        if results:
+            return self.process_results(results, '\t')
+        return None
 
     def single_match_to_arXiv(self, pub_filename):
         """
@@ -167,28 +458,165 @@ class MatchMetadata():
         :param pub_filename:
         :return:
         """
-        results = self.match_to_arXiv(pub_filename)
-        if results:
-            return self.process_results(results, '\t')
+        return self.single_match_prepared(self.prepare_match_to_arXiv(pub_filename))
+
+    def get_concurrency_controller(self, num_workers):
+        """
+        when adaptive concurrency is turned on, the number of workers is the most requests
+        the controller allows in flight, and it starts from the minimum set in config
+
+        :param num_workers:
+        :return:
+        """
+        if str(config.get('DOCMATCHPIPELINE_MATCH_ADAPTIVE', 'False')).lower() == 'true':
+            return ConcurrencyController(initial=int(config.get('DOCMATCHPIPELINE_MATCH_MIN_WORKERS', 1)),
+                                         minimum=int(config.get('DOCMATCHPIPELINE_MATCH_MIN_WORKERS', 1)),
+                                         maximum=num_workers,
+                                         latency_threshold=float(config.get('DOCMATCHPIPELINE_MATCH_LATENCY_SEC', 10)))
+        return None
+
+    def get_prefetcher(self):
+        """
+        prefetcher with the window, number of threads, and readahead set in config, None if turned off
+
+        :return:
+        """
+        window = int(config.get('DOCMATCHPIPELINE_MATCH_PREFETCH', 0))
+        if window > 0:
+            return Prefetcher(window,
+                              num_threads=int(config.get('DOCMATCHPIPELINE_MATCH_PREFETCH_THREADS', 4)),
+                              readahead=str(config.get('DOCMATCHPIPELINE_MATCH_PREFETCH_READAHEAD', 'False')).lower() == 'true')
         return None
 
-    def batch_match_to_arXiv(self, input_filename, result_filename, rerun_filename):
+    def get_match_outcome(self, results):
+        """
+        summarize the results of a single match for the journal
+
+        :param results: list of dicts returned by oracle
+        :return: matched if oracle returned a result, rerun if the record was logged to be rerun, otherwise error
+        """
+        results = results or []
+        if any(result.get('matched_bibcode', None) for result in results):
+            return 'matched'
+        if results and results[0].get('status_flaw', None):
+            return 'rerun'
+        return 'error'
+
+    def get_result_sink(self, result_filename, rerun_filename, journal=None):
+        """
+        result sink with the format, buffer size, and flush interval set in config
+
+        :param result_filename:
+        :param rerun_filename:
+        :param journal:
+        :return:
         """
+        return ResultSink(result_filename, rerun_filename,
+                          result_format=config.get('DOCMATCHPIPELINE_RESULT_FORMAT', 'csv'),
+                          buffer_size=int(config.get('DOCMATCHPIPELINE_RESULT_BUFFER_SIZE', 65536)),
+                          flush_sec=float(config.get('DOCMATCHPIPELINE_RESULT_FLUSH_SEC', 5)),
+                          journal=journal)
 
-        :param input_filename: contains list of filenames
+    def batch_match(self, input_filename, result_filename, rerun_filename, prepare_match, resume=False):
+        """
+        run the batch as a pipeline of stages joined by bounded queues, so that memory stays flat
+        whatever the size of the input file, and parsing the metadata files overlaps the waits on oracle:
+        filenames are read one at a time and checked against the journal, the files are read up to
+        DOCMATCHPIPELINE_MATCH_PREFETCH records ahead, parsed and turned into oracle payloads on a thread of their own, or on DOCMATCHPIPELINE_MATCH_PARSE_PROCESSES processes when set, into a queue
+        of at most DOCMATCHPIPELINE_MATCH_QUEUE_SIZE records, sent to oracle by a pool of workers,
+        with the number of workers and the rate the calls are started at set in config, and the results are
+        written in the same order the filenames are listed in the input file, by a result sink that keeps
+        the output files open for the whole run, when DOCMATCHPIPELINE_MATCH_DEDUP is set, records with
+        identical payloads are sent to oracle only once
+
+        each completed filename is logged to a journal next to the result file, once its results are
+        written out, when resume is set, filenames already in the journal are skipped
+
+        when DOCMATCHPIPELINE_ORACLE_ASYNC is set, the records are sent on one asyncio session instead,
+        with as many requests in flight as there are workers
+
+        :param input_filename: contains list of filenames, or a bundle of records, see iter_input_records
+        :param result_filename: name of result file to write to
+        :param rerun_filename: log filenames that failed to be processed here for later reprocessing
+        :param prepare_match: either prepare_match_to_pub or prepare_match_to_arXiv
+        :param resume: continue an interrupted run
+        :return:
+        """
+        records = self.iter_input_records(input_filename)
+        first_record = next(records, None)
+        if first_record is not None and result_filename:
+            records = itertools.chain([first_record], records)
+            journal = MatchJournal(result_filename)
+            completed = journal.open(resume)
+            if completed:
+                records = (record for record in records if record[0] not in completed)
+                logger.info('Resuming, skipping %d records already processed.' % len(completed))
+            prefetcher = self.get_prefetcher()
+            if prefetcher:
+                records = prefetcher.prefetch(records)
+            num_workers = int(config.get('DOCMATCHPIPELINE_MATCH_WORKERS', 1))
+            queue_size = int(config.get('DOCMATCHPIPELINE_MATCH_QUEUE_SIZE', 100))
+            num_processes = int(config.get('DOCMATCHPIPELINE_MATCH_PARSE_PROCESSES', 0))
+            rate_limiter = RateLimiter(float(config.get('DOCMATCHPIPELINE_MATCH_RATE_PER_SEC', 1)))
+            is_async = isinstance(self.ORACLE_UTIL, AsyncOracleUtil)
+            # the controller blocks the threads of the workers, it does not apply to the asyncio client
+            controller = self.get_concurrency_controller(num_workers) if not is_async else None
+            self.ORACLE_UTIL.concurrency_controller = controller
+            deduplicator = None
+            if str(config.get('DOCMATCHPIPELINE_MATCH_DEDUP', 'False')).lower() == 'true':
+                deduplicator = RequestDeduplicator(int(config.get('DOCMATCHPIPELINE_MATCH_DEDUP_SIZE', 100000)))
+            start_time = time.time()
+            count = 0
+            def send_prepared_match(filename_prepared):
+                return self.send_prepared_match(filename_prepared[1], deduplicator)
+            # the worker process for the author lists too long to be parsed on a thread is forked now,
+            # before the threads of the run are started, with parsing processes, it is not needed
+            if num_processes <= 0 and self.ORACLE_UTIL.author_budget_sec > 0 and self.ORACLE_UTIL.author_thread_max_words > 0:
+                self.ORACLE_UTIL.start_author_executor()
+            try:
+                with self.get_result_sink(result_filename, rerun_filename, journal) as result_sink:
+                    prepare = functools.partial(self.prepare_input_record, prepare_match)
+                    if num_processes > 0:
+                        prepared_records = ordered_map(prepare, records, num_processes, executor_class=ProcessPoolExecutor, max_pending=queue_size)
+                    else:
+                        prepared_records = threaded_stage(prepare, records, queue_size)
+                    if is_async:
+                        count = asyncio.run(self.send_prepared_matches_async(prepared_records, result_sink, num_workers, rate_limiter, deduplicator))
+                    else:
+                        for (_, prepared), results in ordered_map(send_prepared_match, prepared_records, num_workers, rate_limiter):
+                            result_sink.write(prepared['filename'], results, self.get_match_outcome(results))
+                            count += 1
+            finally:
+                self.ORACLE_UTIL.concurrency_controller = None
+                self.ORACLE_UTIL.shutdown_author_executor()
+                journal.close()
+            logger.info('Matched %d records with %d workers and %d parse processes in %.1f seconds.' % (count, num_workers, num_processes, time.time() - start_time))
+            if controller:
+                logger.info('Oracle concurrency at the end of the run: %s' % controller.get_stats())
+            if prefetcher:
+                logger.info('Metadata files read ahead: %s' % prefetcher.get_stats())
+            if deduplicator:
+                dedup_stats = deduplicator.get_stats()
+                logger.info('Oracle calls saved by sending duplicate records once: %d of %d.' % (dedup_stats['saved'], dedup_stats['requests']))
+            logger.info('Oracle calls: %s' % self.ORACLE_UTIL.transport.get_counters())
+            if self.ORACLE_UTIL.match_cache:
+                logger.info('Oracle match cache: %s' % self.ORACLE_UTIL.match_cache.get_stats())
+            # with parsing processes, the payloads were built, and the caches below used, by them and not by this one
+            if num_processes <= 0:
+                logger.info('Author normalization cache: %s' % self.ORACLE_UTIL.author_cache.get_stats())
+            if self._metadata_cache_pid == os.getpid():
+                logger.info('Metadata cache: %s' % self._metadata_cache.get_stats())
+
+    def batch_match_to_arXiv(self, input_filename, result_filename, rerun_filename, resume=False):
+        """
+
+        :param input_filename: contains list of filenames, or a bundle of records, see iter_input_records
         :param result_filename: name of result file to write to
         :param rerun_filename: log filenames that failed to be processed here for later reprocessing
+        :param resume: skip the filenames already processed by an interrupted run
         :return:
         """
-        filenames = self.get_input_filenames(input_filename)
-        if len(filenames) > 0:
-            if result_filename:
-                # one file at a time, parse and score, and then write the result to the file
-                for pub_filename in filenames:
-                    matches = self.single_match_to_arXiv(pub_filename)
-                    self.write_results(result_filename, matches, pub_filename, rerun_filename)
-                    # wait a second before the next attempt
-                    time.sleep(1)
+        self.batch_match(input_filename, result_filename, rerun_filename, self.prepare_match_to_arXiv, resume)
 
     def parse_pub_doi_from_arXiv_record(self, comments, properties):
         """
@@ -205,63 +633,73 @@ class MatchMetadata():
             if doi:
                 return doi.replace('doi:', '')
         return
-    def match_to_pub(self, filename):
+
+    def prepare_match_to_pub(self, filename, metadata=None):
         """
-        read and parse arXiv metadata file
-        return list of bibcodes and scores for the matches in decreasing order
+        first half of match_to_pub, read and parse arXiv metadata file and decide what to match it to
 
         :param filename:
-        :return:
+        :param metadata: record returned by pub_parser.get_pub_record, or the bytes of the metadata file, if not given the file is read
+        :return: dict with the arguments for oracle, or with the results if there is nothing to send
         """
+        prepared = {'filename': filename, 'exception_flaw': 'exception -- processing stopped -- added to the rerun list'}
         try:
-            with open(filename, 'rb') as arxiv_fp:
-                metadata = get_pub_metadata(arxiv_fp.read())
-                if metadata.get("origin", "") == 'ARXIV':
-                    comments = metadata.get('comments', '')
-                    # extract doi to match if available
-                    doi = self.parse_pub_doi_from_arXiv_record(comments, metadata.get('properties', {}))
-                    if doi:
-                        metadata['doi'] = doi
-                    match_doctype = None
-                    title = metadata.get('title')
-                    # check title for erratum
-                    match = self.re_doctype_errata.search(title)
+            metadata = self.read_metadata(filename, metadata)
+            if metadata.get("origin", "") == 'ARXIV':
+                comments = metadata.get('comments', '')
+                # extract doi to match if available
+                doi = self.parse_pub_doi_from_arXiv_record(comments, metadata.get('properties', {}))
+                if doi:
+                    metadata['doi'] = doi
+                match_doctype = None
+                title = metadata.get('title')
+                # check title for erratum
+                match = self.re_doctype_errata.search(title)
+                if match:
+                    match_doctype = ['erratum']
+                else:
+                    match = self.re_doctype_bookreview.search(title)
                     if match:
-                        match_doctype = ['erratum']
+                        match_doctype = ['bookreview']
                     else:
-                        match = self.re_doctype_bookreview.search(title)
+                        # check both comments and title for thesis
+                        match = self.re_doctype_thesis.search("%s %s" % (comments, title))
                         if match:
-                            match_doctype = ['bookreview']
-                        else:
-                            # check both comments and title for thesis
-                            match = self.re_doctype_thesis.search("%s %s" % (comments, title))
-                            if match:
-                                match_doctype = ['phdthesis', 'mastersthesis']
-                    must_match = any(ads_archive_class in arxiv_class for arxiv_class in metadata.get('class', []) for
-                                     ads_archive_class in self.MUST_MATCH)
-                else:
-                    # in this matching, doi is the doi to match
-                    # hence remove it since this is the record's doi
-                    metadata.pop("doi", None)
-                    match_doctype = None
-                    must_match = False
-                    comments = ''
-                oracle_matches = self.ORACLE_UTIL.get_matches(metadata, 'eprint', must_match, match_doctype)
-                # before proceeding see if this arXiv article's class is among the ones that ADS archives the
-                # published version if available
-                # hence, it with high probablity should have been matched, if it was not,
-                # log it to be rerun at some later point, but only if it is still considered
-                # matchable (ie, less than number of months since it was published)
-                # comment out until hear from Alberto to activate it
-                # if must_match and len(oracle_matches) == 1 and oracle_matches[0]['matched_bibcode'] == '.' * 19:
-                #     today = date.today()
-                #     pub_date = metadata['pubdate']
-                #     if ((today.year - pub_date.year) * 12 + today.month - pub_date.month) <= config['DOCMATCHPIPELINE_EPRINT_RERUN_MONTHS']:
-                #         oracle_matches['status_flaw'] = 'shall be added to the rerun list.'
-                return self.add_metadata_comment(oracle_matches, comments)
+                            match_doctype = ['phdthesis', 'mastersthesis']
+                must_match = any(ads_archive_class in arxiv_class for arxiv_class in metadata.get('class', []) for
+                                 ads_archive_class in self.MUST_MATCH)
+            else:
+                # in this matching, doi is the doi to match
+                # hence remove it since this is the record's doi
+                metadata.pop("doi", None)
+                match_doctype = None
+                must_match = False
+                comments = ''
+            prepared.update({'metadata': metadata, 'doctype': 'eprint', 'must_match': must_match, 'match_doctype': match_doctype, 'comments': comments})
         except Exception as e:
-            logger.error('Exception: %s'%e)
-            return [{'source_bibcode': 'no bibcode', 'comment' : 'Exception: %s in metadata file: %s'%(e, filename), 'status_flaw' : 'exception -- processing stopped -- added to the rerun list'}]
+            prepared['results'] = self.get_exception_results(e, prepared)
+        return prepared
+
+    def match_to_pub(self, filename):
+        """
+        read and parse arXiv metadata file
+        return list of bibcodes and scores for the matches in decreasing order
+
+        :param filename:
+        :return:
+        """
+        # before proceeding see if this arXiv article's class is among the ones that ADS archives the
+        # published version if available
+        # hence, it with high probablity should have been matched, if it was not,
+        # log it to be rerun at some later point, but only if it is still considered
+        # matchable (ie, less than number of months since it was published)
+        # comment out until hear from Alberto to activate it
+        # if must_match and len(oracle_matches) == 1 and oracle_matches[0]['matched_bibcode'] == '.' * 19:
+        #     today = date.today()
+        #     pub_date = metadata['pubdate']
+        #     if ((today.year - pub_date.year) * 12 + today.month - pub_date.month) <= config['DOCMATCHPIPELINE_EPRINT_RERUN_MONTHS']:
+        #         oracle_matches['status_flaw'] = 'shall be added to the rerun list.'
+        return self.send_prepared_match(self.prepare_match_to_pub(filename))
 
     def single_match_to_pub(self, filename):
         """
@@ -270,28 +708,18 @@ class MatchMetadata():
         :param filename:
         :return:
         """
-        results = self.match_to_pub(filename)
-        if results:
-            return self.process_results(results, '\t')
-        return None
+        return self.single_match_prepared(self.prepare_match_to_pub(filename))
 
-    def batch_match_to_pub(self, input_filename, result_filename, rerun_filename):
+    def batch_match_to_pub(self, input_filename, result_filename, rerun_filename, resume=False):
         """
 
-        :param input_filename: contains list of filenames
+        :param input_filename: contains list of filenames, or a bundle of records, see iter_input_records
         :param result_filename: name of result file to write to
         :param rerun_filename: log filenames that failed to be processed here for later reprocessing
+        :param resume: skip the filenames already processed by an interrupted run
         :return:
         """
-        filenames = self.get_input_filenames(input_filename)
-        if len(filenames) > 0:
-            if result_filename:
-                # one file at a time, parse and score, and then write the result to the file
-                for filename in filenames:
-                    matches = self.single_match_to_pub(filename)
-                    self.write_results(result_filename, matches, filename, rerun_filename)
-                    # wait a second before the next attempt
-                    time.sleep(1)
+        self.batch_match(input_filename, result_filename, rerun_filename, self.prepare_match_to_pub, resume)
 
     def add_metadata_comment(self, results, comments):
         """
@@ -426,18 +854,19 @@ class MatchMetadata():
             if combined_results:
                 self.write_combined_results(combined_results, output_filename)
 
-    def process_match_to_arXiv(self, path):
+    def process_match_to_arXiv(self, path, resume=False):
         """
 
         :param path:
+        :param resume: continue an interrupted run
         :return:
         """
-        input_filename = "%s%s" % (path, config.get('DOCMATCHPIPELINE_INPUT_FILENAME', 'default'))
+        input_filename = self.get_input_filename(path)
         result_filename = "%s%s" % (path, config.get('DOCMATCHPIPELINE_PUB_RESULT_FILENAME', 'default'))
         # to write filenames into when match failed
         rerun_filename = os.path.abspath(os.path.join(path, config['DOCMATCHPIPELINE_RERUN_FILENAME']))
 
-        self.batch_match_to_arXiv(input_filename, result_filename, rerun_filename)
+        self.batch_match_to_arXiv(input_filename, result_filename, rerun_filename, resume)
 
         # ToDO: once classic is turned off comment the followings lines and
         # return result_filename to be uploaded to google drive instead
@@ -446,18 +875,19 @@ class MatchMetadata():
         self.merge_classic_docmatch_results(classic_matched_filename, result_filename, combined_output_filename)
         return combined_output_filename
 
-    def process_match_to_pub(self, path):
+    def process_match_to_pub(self, path, resume=False):
         """
 
         :param path:
+        :param resume: continue an interrupted run
         :return:
         """
-        input_filename = "%s%s" % (path, config.get('DOCMATCHPIPELINE_INPUT_FILENAME', 'default'))
+        input_filename = self.get_input_filename(path)
         result_filename = "%s%s" % (path, config.get('DOCMATCHPIPELINE_EPRINT_RESULT_FILENAME', 'default'))
         # to write filenames into when match failed
         rerun_filename = os.path.abspath(os.path.join(path, config['DOCMATCHPIPELINE_RERUN_FILENAME']))
 
-        self.batch_match_to_pub(input_filename, result_filename, rerun_filename)
+        self.batch_match_to_pub(input_filename, result_filename, rerun_filename, resume)
 
         # ToDO: once classic is turned off comment the followings lines and
         # return result_filename to be uploaded to google drive instead
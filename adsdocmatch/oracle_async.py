@@ -0,0 +1,220 @@
+import asyncio
+import itertools
+import time
+from contextlib import asynccontextmanager
+
+import aiohttp
+
+# share config with OracleUtil, so that both clients see the same updates (ie, set_local_config_test)
+from adsdocmatch.oracle_util import OracleUtil, OracleRequest, config, logger
+from adsdocmatch.batch_util import ordered_map_async
+
+
+class OracleResponse():
+    """
+    what the steps of OracleUtil read from a response, the text is read before the connection is released
+    """
+
+    def __init__(self, status_code, text):
+        """
+
+        :param status_code:
+        :param text:
+        """
+        self.status_code = status_code
+        self.text = text
+
+
+def get_oracle_util():
+    """
+    the client for the oracle service set in config, AsyncOracleUtil when DOCMATCHPIPELINE_ORACLE_ASYNC is set
+
+    :return:
+    """
+    if str(config.get('DOCMATCHPIPELINE_ORACLE_ASYNC', 'False')).lower() == 'true':
+        return AsyncOracleUtil()
+    return OracleUtil()
+
+
+class AsyncOracleUtil(OracleUtil):
+    """
+    asyncio client for the oracle service, the calls run the same steps as the blocking calls of OracleUtil,
+    with the same retries, timeouts and counters, only the requests are sent, and the waits awaited, on the event loop
+
+    the calls that go over many requests, query, add_to_db, and add_each_to_db, and through them dump_oracledb,
+    update_db_sourced_matches, and load_curated_file, are sent on one session, and batch_match of MatchMetadata
+    sends the matches with get_matches_async, single calls are left to the blocking client
+    """
+
+    @asynccontextmanager
+    async def open_session(self, session=None):
+        """
+        use the session given by the caller, otherwise open one for this call only, with as many
+        connections, and the same auth header, as the blocking transport
+
+        :param session:
+        :return:
+        """
+        if session is not None:
+            yield session
+        else:
+            connector = aiohttp.TCPConnector(limit=self.transport.pool_size)
+            async with aiohttp.ClientSession(connector=connector, headers=self.transport.headers) as new_session:
+                yield new_session
+
+    async def send_request_async(self, request, session):
+        """
+        asyncio version of send_request, with the per endpoint timeouts of the blocking transport,
+        and counted with its calls
+
+        :param request: OracleRequest
+        :param session:
+        :return: response with status_code and text
+        """
+        status_code = None
+        start_time = time.time()
+        try:
+            async with session.request(request.method, url=self.transport.get_url(request.name), headers=request.headers, data=request.data,
+                                       timeout=aiohttp.ClientTimeout(total=self.transport.get_timeout(request.name))) as response:
+                status_code = response.status
+                return OracleResponse(status_code, await response.text())
+        finally:
+            self.transport.record(request.name, status_code, time.time() - start_time)
+
+    async def run_steps_async(self, steps, session=None):
+        """
+        asyncio version of run_steps, the same steps are sent on the session
+
+        :param steps:
+        :param session:
+        :return: the result of the call
+        """
+        async with self.open_session(session) as session:
+            response, error = None, None
+            while True:
+                try:
+                    step = steps.throw(error) if error else steps.send(response)
+                except StopIteration as e:
+                    return e.value
+                response, error = None, None
+                if isinstance(step, OracleRequest):
+                    try:
+                        response = await self.send_request_async(step, session)
+                    except Exception as e:
+                        error = e
+                elif step > 0:
+                    await asyncio.sleep(step)
+
+    async def get_matches_async(self, metadata, doctype, must_match=False, match_doctype=None, payload=None, session=None):
+        """
+        asyncio version of get_matches
+
+        :param metadata:
+        :param doctype:
+        :param must_match:
+        :param match_doctype: list of doctypes, if specified only this type of doctype is matched
+        :param payload: if already built by make_match_payload
+        :param session: aiohttp ClientSession to send the request on
+        :return:
+        """
+        return await self.run_steps_async(self.get_matches_steps(metadata, doctype, must_match, match_doctype, payload), session)
+
+    def add_to_db(self, matches):
+        """
+        blocking wrapper of add_to_db_async
+
+        :param matches:
+        :return:
+        """
+        return asyncio.run(self.add_to_db_async(matches))
+
+    async def add_to_db_async(self, matches, session=None):
+        """
+        asyncio version of add_to_db
+
+        :param matches:
+        :param session:
+        :return:
+        """
+        return await self.run_steps_async(self.add_to_db_steps(matches), session)
+
+    def add_each_to_db(self, matches):
+        """
+        blocking wrapper of add_each_to_db_async
+
+        :param matches:
+        :return:
+        """
+        return asyncio.run(self.add_each_to_db_async(matches))
+
+    async def add_each_to_db_async(self, matches, max_concurrency=None, session=None):
+        """
+        asyncio version of add_each_to_db, with at most max_concurrency requests in flight
+
+        :param matches:
+        :param max_concurrency: if not specified, DOCMATCHPIPELINE_MATCH_WORKERS from config
+        :param session:
+        :return:
+        """
+        if not max_concurrency:
+            max_concurrency = int(config.get('DOCMATCHPIPELINE_MATCH_WORKERS', 1))
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async with self.open_session(session) as session:
+            async def add_one(match):
+                async with semaphore:
+                    return await self.add_to_db_async([match], session)
+            return await asyncio.gather(*[add_one(match) for match in matches], return_exceptions=True)
+
+    async def get_query_page_async(self, start, days=None, session=None):
+        """
+        asyncio version of get_query_page
+
+        :param start: offset of the first match of the page
+        :param days: optinal query filter, how many days of update to include in the query, if none, all are included
+        :param session:
+        :return: number of rows per page, and the matches of this page
+        """
+        return await self.run_steps_async(self.get_query_page_steps(start, days), session)
+
+    def query(self, output_filename, days=None):
+        """
+        blocking wrapper of query_async
+
+        :param output_filename:
+        :param days:
+        :return:
+        """
+        return asyncio.run(self.query_async(output_filename, days))
+
+    async def query_async(self, output_filename, days=None, session=None):
+        """
+        asyncio version of query, with the same part and state files to resume from
+
+        :param output_filename:
+        :param days: optinal query filter, how many days of update to include in the query, if none, all are included
+        :param session:
+        :return:
+        """
+        num_workers = int(config.get('DOCMATCHPIPELINE_ORACLE_QUERY_WORKERS', 1))
+        days = int(days) if days else None
+        fp, state = self.open_query_output(output_filename, days)
+        with fp:
+            async with self.open_session(session) as session:
+                if state is None:
+                    rows, results = await self.get_query_page_async(0, days, session)
+                    state = self.save_first_query_page(fp, output_filename, days, rows, results)
+                if state['rows']:
+                    # past the last page, pages come back empty, the ones already requested are cancelled
+                    starts = itertools.count(state['start'], state['rows'])
+                    pages = ordered_map_async(lambda start: self.get_query_page_async(start, days, session), starts, num_workers)
+                    try:
+                        async for start, (_, results) in pages:
+                            logger.info('[%d, %d]' % (start, start + len(results)))
+                            if not results:
+                                break
+                            self.save_query_page(fp, output_filename + '.state', state, results)
+                    finally:
+                        # cancel the pages still in flight while the session is open
+                        await pages.aclose()
+        return self.close_query_output(output_filename, state)
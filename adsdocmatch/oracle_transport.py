@@ -0,0 +1,119 @@
+import os
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+from adsputils import load_config
+
+proj_home = os.path.realpath(os.path.join(os.path.dirname(__file__), "../"))
+config = load_config(proj_home=proj_home)
+
+
+class OracleTransport():
+    """
+    one pooled requests session for all the calls to the oracle service, so that
+    connections (and their TLS handshakes) are kept alive and reused between calls,
+    with the auth header built once, per endpoint timeouts, and per endpoint counters
+
+    endpoints are referred to by name: docmatch_add, add, query, source_score, confidence, cleanup
+    """
+
+    def __init__(self, base_url=None, token=None, pool_size=None, timeouts=None):
+        """
+
+        :param base_url: if not specified, DOCMATCHPIPELINE_API_ORACLE_SERVICE_URL from config
+        :param token: if not specified, DOCMATCHPIPELINE_API_TOKEN from config
+        :param pool_size: most connections kept open, if not specified, DOCMATCHPIPELINE_API_ORACLE_POOL_SIZE from config
+        :param timeouts: dict of endpoint name to seconds, if not specified, DOCMATCHPIPELINE_API_ORACLE_TIMEOUTS from config
+        """
+        self.base_url = base_url or config.get('DOCMATCHPIPELINE_API_ORACLE_SERVICE_URL', 'http://localhost')
+        if token is None:
+            token = config.get('DOCMATCHPIPELINE_API_TOKEN', '')
+        if pool_size is None:
+            pool_size = int(config.get('DOCMATCHPIPELINE_API_ORACLE_POOL_SIZE', 10))
+        self.default_timeout = float(config.get('DOCMATCHPIPELINE_API_ORACLE_TIMEOUT_SEC', 60))
+        self.timeouts = dict(config.get('DOCMATCHPIPELINE_API_ORACLE_TIMEOUTS', {}))
+        if timeouts:
+            self.timeouts.update(timeouts)
+
+        self.pool_size = pool_size
+        self.headers = {'Authorization': 'Bearer %s' % token}
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def get_url(self, name, path=None):
+        """
+
+        :param name: endpoint name
+        :param path: if the path is not the endpoint name, ie, /confidence/<source>
+        :return:
+        """
+        return self.base_url + (path or '/' + name)
+
+    def get_timeout(self, name):
+        """
+
+        :param name: endpoint name
+        :return:
+        """
+        return float(self.timeouts.get(name, self.default_timeout))
+
+    def record(self, name, status_code, seconds):
+        """
+        count one call to the endpoint
+
+        :param name: endpoint name
+        :param status_code: None if the call raised an exception
+        :param seconds:
+        :return:
+        """
+        with self.lock:
+            counter = self.counters.setdefault(name, {'calls': 0, 'exceptions': 0, 'seconds': 0.0, 'status': {}})
+            counter['calls'] += 1
+            counter['seconds'] += seconds
+            if status_code is None:
+                counter['exceptions'] += 1
+            else:
+                counter['status'][status_code] = counter['status'].get(status_code, 0) + 1
+
+    def get_counters(self):
+        """
+
+        :return: copy of the per endpoint counters
+        """
+        with self.lock:
+            return {name: dict(counter, status=dict(counter['status'])) for name, counter in self.counters.items()}
+
+    def request(self, method, name, path=None, **kwargs):
+        """
+
+        :param method: post, put, or get
+        :param name: endpoint name
+        :param path:
+        :param kwargs: passed to requests, ie, headers and data
+        :return:
+        """
+        status_code = None
+        start_time = time.time()
+        try:
+            response = getattr(self.session, method)(url=self.get_url(name, path), timeout=self.get_timeout(name), **kwargs)
+            status_code = response.status_code
+            return response
+        finally:
+            self.record(name, status_code, time.time() - start_time)
+
+    def post(self, name, path=None, **kwargs):
+        return self.request('post', name, path, **kwargs)
+
+    def put(self, name, path=None, **kwargs):
+        return self.request('put', name, path, **kwargs)
+
+    def get(self, name, path=None, **kwargs):
+        return self.request('get', name, path, **kwargs)
@@ -1,6 +1,5 @@
 import math
 import os
-import requests
 import json
 import time
 from unidecode import unidecode
@@ -8,7 +7,16 @@ import pandas as pd
 import numpy as np
 import re
 import csv
+import signal
+import itertools
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 import adsdocmatch.utils as utils
+from adsdocmatch.oracle_transport import OracleTransport
+from adsdocmatch.batch_util import ordered_map
+from adsdocmatch.cache_util import LRUCache, SQLiteCache, get_hash
+from datetime import date
 from pathlib import Path
 
 from adsputils import setup_logging, load_config
@@ -19,6 +27,38 @@ config = load_config(proj_home=proj_home)
 logger = setup_logging("docmatching", level=config.get("LOGGING_LEVEL", "WARN"), proj_home=proj_home, attach_stdout=config.get("LOG_STDOUT", "FALSE"))
 
 
+class AuthorBudgetExceeded(Exception):
+    pass
+
+
+class AuthorListTooLong(Exception):
+    pass
+
+
+class QueryPageException(Exception):
+    pass
+
+
+class OracleRequest():
+    """
+    one call to the oracle service, yielded by the steps of the calls of OracleUtil,
+    so that the same steps are sent by the blocking client and by the asyncio one
+    """
+
+    def __init__(self, method, name, headers=None, data=None):
+        """
+
+        :param method: post, put, or get
+        :param name: endpoint name
+        :param headers:
+        :param data:
+        """
+        self.method = method
+        self.name = name
+        self.headers = headers
+        self.data = data
+
+
 class OracleUtil():
 
     # collabration can be listed before or after author list, also the word collabration can appear before or after the name (ie, Collabration, the ALICE, Planck Collaboration).
@@ -54,6 +94,89 @@ class OracleUtil():
            LAST_NAME_PAT.pattern, LAST_NAME_SUFFIX, LAST_NAME_PAT.pattern, LAST_NAME_SUFFIX))
 
     REMOVE_AND = re.compile(r"(,?\s+and\s+)", re.IGNORECASE)
+    # AND_HOOK cannot match without its anchor, and when it fails, takes exponential time in the number of names,
+    # so it is only tried on strings with the anchor, and where the budget cannot interrupt it, on at most AND_HOOK_MAX_WORDS words
+    AND_ANCHOR = re.compile(r"(\b[Aa]nd|\s&)\s")
+    AND_HOOK_MAX_WORDS = int(config.get('DOCMATCHPIPELINE_AND_HOOK_MAX_WORDS', 10))
+
+    # when set, during batch runs, shared limit on the number of /docmatch_add requests in flight
+    concurrency_controller = None
+
+    # normalized author lists of the last records, shared by all the instances
+    author_cache = LRUCache(int(config.get('DOCMATCHPIPELINE_AUTHOR_CACHE_SIZE', 0)))
+    # when set, author lists with more authors than this send only the collaborations and the first max_authors authors,
+    # along with the number of authors
+    max_authors = int(config.get('DOCMATCHPIPELINE_MAX_AUTHORS', 0))
+
+    # seconds allowed to normalize one author list, before falling back to the last names only, 0 means no limit
+    author_budget_sec = float(config.get('DOCMATCHPIPELINE_AUTHOR_BUDGET_SEC', 0))
+    # off the main thread, where the budget cannot interrupt a pattern, author lists with more words than this
+    # are normalized in a worker process instead, 0 means no limit
+    author_thread_max_words = int(config.get('DOCMATCHPIPELINE_AUTHOR_THREAD_MAX_WORDS', 0))
+
+    # when True, the match cache is not read, but is still written, to refresh the cached results
+    match_cache_bypass = str(config.get('DOCMATCHPIPELINE_ORACLE_CACHE_BYPASS', 'False')).lower() == 'true'
+
+    # the transport, the match cache, and the author worker process are shared by all the instances
+    _transport = None
+    _transport_lock = threading.Lock()
+    _match_cache = None
+    _author_executor = None
+
+    @property
+    def transport(self):
+        """
+        pooled http transport for all the calls to oracle, created on first use
+
+        :return:
+        """
+        if OracleUtil._transport is None:
+            with self._transport_lock:
+                if OracleUtil._transport is None:
+                    OracleUtil._transport = OracleTransport()
+        return OracleUtil._transport
+
+    @property
+    def match_cache(self):
+        """
+        local cache of the oracle responses to /docmatch_add, opened on first use,
+        None if DOCMATCHPIPELINE_ORACLE_CACHE_FILENAME is not set
+
+        :return:
+        """
+        if OracleUtil._match_cache is None and config.get('DOCMATCHPIPELINE_ORACLE_CACHE_FILENAME', ''):
+            with self._transport_lock:
+                if OracleUtil._match_cache is None:
+                    OracleUtil._match_cache = SQLiteCache(config['DOCMATCHPIPELINE_ORACLE_CACHE_FILENAME'],
+                                                           ttl_sec=float(config.get('DOCMATCHPIPELINE_ORACLE_CACHE_TTL_SEC', 0)),
+                                                           max_entries=int(config.get('DOCMATCHPIPELINE_ORACLE_CACHE_MAX_ENTRIES', 0)))
+        return OracleUtil._match_cache
+
+    def get_cached_match(self, payload):
+        """
+
+        :param payload:
+        :return: cache key, and the cached response text or None
+        """
+        match_cache = self.match_cache
+        if not match_cache:
+            return None, None
+        cache_key = get_hash(payload)
+        if self.match_cache_bypass:
+            return cache_key, None
+        return cache_key, match_cache.get(cache_key)
+
+    def set_cached_match(self, cache_key, status_code, response_text):
+        """
+        only successful responses are cached
+
+        :param cache_key: returned by get_cached_match
+        :param status_code:
+        :param response_text:
+        :return:
+        """
+        if cache_key and status_code == 200:
+            self.match_cache.set(cache_key, response_text)
 
     def set_local_config_test(self):
         """
@@ -64,41 +187,53 @@ class OracleUtil():
         """
         config.update({
             'DOCMATCHPIPELINE_API_ORACLE_SERVICE_ATTEMPTS': '1',
-            'DOCMATCHPIPELINE_API_ORACLE_SERVICE_SLEEP_SEC': '0'
+            'DOCMATCHPIPELINE_API_ORACLE_SERVICE_SLEEP_SEC': '0',
+            'DOCMATCHPIPELINE_ORACLE_QUERY_WORKERS': '1'
         })
 
-    def get_authors_last_attempt(self, ref_string):
+    def get_authors_last_attempt(self, ref_string, max_words=0):
         """
         last attempt to identify author(s)
 
         :param ref_string:
+        :param max_words: if set, AuthorListTooLong is raised instead of trying AND_HOOK on more than AND_HOOK_MAX_WORDS words
         :return:
         """
         # if there is an and, used that as an anchor
-        match = self.AND_HOOK.match(ref_string)
-        if match:
-            return match.group(0).strip()
-        # grab first author's lastname and include etal
+        if self.AND_ANCHOR.search(ref_string):
+            if max_words and len(self.WORDS_ONLY.findall(ref_string)) > self.AND_HOOK_MAX_WORDS:
+                raise AuthorListTooLong()
+            match = self.AND_HOOK.match(ref_string)
+            if match:
+                return match.group(0).strip()
+        return self.get_last_names(ref_string)
+
+    def get_last_names(self, ref_string):
+        """
+        grab the authors' lastnames, in linear time, what is left when the author list cannot be parsed in time
+
+        :param ref_string:
+        :return: None if there are no names
+        """
         match = self.LAST_NAME_PAT.findall(ref_string)
         if match:
             return '; '.join(match)
         return None
 
-    def get_length_matched_authors(self, ref_string, matches):
+    def iter_matched_words(self, matches, consumed):
         """
-        make sure the author was matched from the beginning of the reference
+        words of the matches, in the order they were found, same as the words of the matches joined into one string
 
-        :param ref_string:
-        :param matched:
+        :param matches: iterator of match objects
+        :param consumed: list the matches are appended to as they are read
         :return:
         """
-        matched_str = ', '.join([' '.join(list(filter(None, author))).strip() for author in matches])
-        count = 0
-        for sub, full in zip(self.WORDS_ONLY.findall(matched_str), self.WORDS_ONLY.findall(ref_string)):
-            if sub != full:
-                break
-            count += 1
-        return count
+        for match in matches:
+            consumed.append(match)
+            for group in match.groups():
+                if group:
+                    for word in self.WORDS_ONLY.findall(group):
+                        yield word
 
     def get_collaborators(self, ref_string):
         """
@@ -108,6 +243,9 @@ class OracleUtil():
         :param ref_string:
         :return:
         """
+        # the pattern takes quadratic time on long lists, skip it when the word it looks for is not there
+        if 'ollaboration' not in ref_string:
+            return 0, 0
         match = self.COLLABORATION_PAT.findall(self.COMMA_BEFORE_AND.sub(r',\2', ref_string))
         if len(match) > 0:
             collaboration = match[-1]
@@ -126,20 +264,57 @@ class OracleUtil():
         :param ref_string:
         :return:
         """
+        return self.match_author_pattern(ref_string)[0]
+
+    def match_author_pattern(self, ref_string, deadline=None):
+        """
+        same as get_author_pattern, also returning the matches of the pattern
+
+        each pattern is scored with the number of words of ref_string its matches line up with from the beginning,
+        the words of the matches are compared as the matches are found, so that a pattern stops being run at its
+        first word that does not line up, instead of going over the whole string, and the matches of the pattern
+        picked are kept, not to look for them again
+
+        :param ref_string:
+        :param deadline: time.monotonic() value, checked after each match
+        :return: the pattern and the list of its matches, or None, None
+        """
         patterns = [self.TRAILING_INIT_PAT, self.LEADING_INIT_PAT, self.TRAILING_FULL_PAT, self.LEADING_FULL_PAT]
         lengths = [0] * len(patterns)
+        consumed = [[] for _ in patterns]
+        remaining = [None] * len(patterns)
 
+        ref_words = self.WORDS_ONLY.findall(ref_string)
         for i, pattern in enumerate(patterns):
-            # lengths[i] = len(pattern.findall(ref_string))
-            lengths[i] = self.get_length_matched_authors(ref_string, pattern.findall(ref_string))
+            remaining[i] = pattern.finditer(ref_string)
+            for sub, full in zip(self.iter_matched_words(remaining[i], consumed[i]), ref_words):
+                if sub != full:
+                    break
+                lengths[i] += 1
+                self.check_author_budget(deadline)
+
+        index = self.pick_author_pattern(lengths)
+        if index is None:
+            return None, None
+        for match in remaining[index]:
+            consumed[index].append(match)
+            self.check_author_budget(deadline)
+        return patterns[index], consumed[index]
+
+    def pick_author_pattern(self, lengths):
+        """
+        pick the pattern from the number of words each pattern matched
 
+        :param lengths: for TRAILING_INIT_PAT, LEADING_INIT_PAT, TRAILING_FULL_PAT, and LEADING_FULL_PAT
+        :return: index of the pattern, or None if undecidable
+        """
         indices_max = [index for index, value in enumerate(lengths) if value == max(lengths)]
         if len(indices_max) != 1:
             indices_match = [index for index, value in enumerate(lengths) if value > 0]
 
             # if there were multiple max and one min, pick the min
             if len(indices_match) - len(indices_max) == 1:
-                return patterns[min(indices_match)]
+                return min(indices_match)
 
             # see which two or more patterns recognized this reference, turn the indices_max to on/off, convert to binary,
             # and then decimal, note that 1, 2, 4, and 8 do not get there
@@ -153,21 +328,21 @@ class OracleUtil():
             # this happens when there is no init and last-first is not distinguishable with first-last,
             # so pick last-first
             if on_off_value == 3:
-                return patterns[2]
+                return 2
             # 0101 and 0111 pick second pattern
             if on_off_value in [5, 7]:
-                return patterns[1]
+                return 1
             # 1010 and 1011 pick first pattern
             if on_off_value in [10, 11]:
-                return patterns[0]
+                return 0
             # 1101 pick fourth pattern
             if on_off_value == 13:
-                return patterns[3]
+                return 3
             # 1110 pick third pattern
             if on_off_value == 14:
-                return patterns[2]
+                return 2
 
-        return patterns[indices_max[0]]
+        return indices_max[0]
 
     def normalize_author_list(self, author_string):
         """
@@ -175,9 +350,169 @@ class OracleUtil():
 
         If the function cannot make sense of author_string, it returns it unchanged.
 
+        the last DOCMATCHPIPELINE_AUTHOR_CACHE_SIZE author lists are kept, since the same long lists
+        of large collaborations come through many times
+
+        :param author_string:
+        :return:
+        """
+        authors = self.author_cache.get(author_string)
+        if authors is None:
+            try:
+                authors = self.parse_author_list_timed(author_string)
+            except AuthorListTooLong:
+                authors = self.get_author_executor().submit(parse_author_list_in_process, author_string).result()
+            except AuthorBudgetExceeded:
+                pass
+            if authors is None:
+                logger.warning('Author list of %d characters not parsed in %s seconds, kept the last names only.' % (len(author_string), self.author_budget_sec))
+                authors = self.get_last_names(unidecode(author_string)) or author_string
+            self.author_cache.set(author_string, authors)
+        return authors
+
+    def parse_author_list_timed(self, author_string):
+        """
+        parse_author_list within author_budget_sec, off the main thread, the patterns cannot be interrupted,
+        and take quadratic time in the number of words, so lists longer than author_thread_max_words are not parsed there,
+        nor are those AND_HOOK is to be tried on with more than AND_HOOK_MAX_WORDS words
+
+        :param author_string:
+        :return: raises AuthorBudgetExceeded past the budget, or AuthorListTooLong when the list is to be parsed in a worker process
+        """
+        with self.author_time_limit(self.author_budget_sec) as interruptible:
+            max_words = self.author_thread_max_words if self.author_budget_sec > 0 and not interruptible else 0
+            return self.parse_author_list(author_string, self.get_author_deadline(self.author_budget_sec), max_words)
+
+    def get_author_executor(self):
+        """
+        worker process for the author lists too long to be parsed on a thread, where the budget
+        interrupts the patterns, since they run on the main thread of the process, created on first use,
+        batch runs start it before their threads with start_author_executor
+
+        :return:
+        """
+        if OracleUtil._author_executor is None:
+            with self._transport_lock:
+                if OracleUtil._author_executor is None:
+                    OracleUtil._author_executor = ProcessPoolExecutor(max_workers=1)
+        return OracleUtil._author_executor
+
+    def start_author_executor(self):
+        """
+        create the worker process of get_author_executor now, to be called before any thread is started,
+        so that the process is not forked from one with threads running
+
+        :return:
+        """
+        self.get_author_executor().submit(int).result()
+
+    def shutdown_author_executor(self):
+        """
+        stop the worker process of get_author_executor, if it was started, at the end of a batch run
+
+        :return:
+        """
+        with self._transport_lock:
+            executor, OracleUtil._author_executor = OracleUtil._author_executor, None
+        if executor:
+            executor.shutdown()
+
+    def truncate_author_list(self, author_string, max_authors):
+        """
+        keep the collaborations and the first max_authors authors of a list separated by semicolons,
+        as written by the metadata parser, so that only those are normalized
+
+        :param author_string:
+        :param max_authors:
+        :return: the author list, cut if there are more authors than max_authors, and the number of authors
+        """
+        kept = []
+        count = 0
+        for entry in author_string.split(';'):
+            entry = entry.strip()
+            if not entry:
+                continue
+            if self.get_collaborators(entry)[1] > 0:
+                kept.append(entry)
+                continue
+            count += 1
+            if count <= max_authors:
+                kept.append(entry)
+        return '; '.join(kept), count
+
+    def get_payload_authors(self, author_string):
+        """
+        normalized authors sent to oracle, for large collaborations, when max_authors is set,
+        only the collaborations and the first max_authors authors are normalized and sent, with the number of authors
+
+        :param author_string:
+        :return: dict with author, and author_count if the list was cut
+        """
+        if self.max_authors > 0:
+            truncated, count = self.truncate_author_list(author_string, self.max_authors)
+            if count > self.max_authors:
+                return {'author': self.normalize_author_list(truncated), 'author_count': count}
+        return {'author': self.normalize_author_list(author_string)}
+
+    def get_author_deadline(self, budget_sec):
+        """
+
+        :param budget_sec: zero means no limit
+        :return: time.monotonic() value the author list has to be parsed by, or None
+        """
+        if budget_sec > 0:
+            return time.monotonic() + budget_sec
+        return None
+
+    def check_author_budget(self, deadline):
+        """
+        called between the steps of parsing an author list
+
+        :param deadline:
+        :return:
+        """
+        if deadline is not None and time.monotonic() > deadline:
+            raise AuthorBudgetExceeded()
+
+    @contextmanager
+    def author_time_limit(self, budget_sec):
+        """
+        interrupts a regular expression still running when the budget is used up, with SIGALRM,
+        available only on the main thread, and when no other handler is set for it,
+        otherwise only the checks between the steps apply
+
+        :param budget_sec: zero means no limit
+        :return: True if a pattern still running is interrupted
+        """
+        if budget_sec <= 0 or not hasattr(signal, 'setitimer') or threading.current_thread() is not threading.main_thread() \
+                or signal.getsignal(signal.SIGALRM) != signal.SIG_DFL:
+            yield False
+            return
+
+        def on_alarm(signum, frame):
+            raise AuthorBudgetExceeded()
+
+        signal.signal(signal.SIGALRM, on_alarm)
+        signal.setitimer(signal.ITIMER_REAL, budget_sec)
+        try:
+            yield True
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, signal.SIG_DFL)
+
+    def parse_author_list(self, author_string, deadline=None, max_words=0):
+        """
+        normalize_author_list, without the cache
+
         :param author_string:
+        :param deadline: time.monotonic() value, AuthorBudgetExceeded is raised when a step ends after it
+        :param max_words: if set, AuthorListTooLong is raised for lists with more words than this,
+                          and for those AND_HOOK is to be tried on with more than AND_HOOK_MAX_WORDS words
         :return:
         """
+        if max_words and len(self.WORDS_ONLY.findall(author_string)) > max_words:
+            raise AuthorListTooLong()
+
         # if there is a collaboration included in the list of authors
         # remove that to be able to decide if the author list is trailing or ending
         collaborators_idx, collaborators_len = self.get_collaborators(author_string)
@@ -197,17 +532,19 @@ class OracleUtil():
         if not author_string and collaborator:
             return collaborator
 
+        self.check_author_budget(deadline)
         author_string = unidecode(self.REMOVE_AND.sub(',', author_string))
-        pattern = self.get_author_pattern(author_string)
+        pattern, matches = self.match_author_pattern(author_string, deadline)
         if pattern:
             authors = "; ".join("%s, %s" % (match.group("last"), match.group("first")[0])
-                             for match in pattern.finditer(author_string)).strip()
+                             for match in matches).strip()
             if collaborator:
                 return "%s; %s"%(collaborator, authors)
             else:
                 return authors
 
-        authors = self.get_authors_last_attempt(author_string)
+        self.check_author_budget(deadline)
+        authors = self.get_authors_last_attempt(author_string, max_words)
         if authors:
             return authors
         return author_string
@@ -234,65 +571,113 @@ class OracleUtil():
             return None
         return list(filter(None, doi))
 
-    def get_matches(self, metadata, doctype, must_match=False, match_doctype=None):
+    def send_request(self, request):
         """
+        send one OracleRequest on the blocking transport, if there is a concurrency controller,
+        requests to /docmatch_add wait for a slot first and report back the status code and latency
+
+        :param request:
+        :return:
+        """
+        controller = self.concurrency_controller if request.name == 'docmatch_add' else None
+        if controller:
+            controller.acquire()
+        status_code = None
+        start_time = time.time()
+        try:
+            response = getattr(self.transport, request.method)(request.name, headers=request.headers, data=request.data)
+            status_code = response.status_code
+            return response
+        finally:
+            if controller:
+                controller.release()
+                controller.record(status_code, time.time() - start_time)
+
+    def run_steps(self, steps):
+        """
+        run the steps of a call on the blocking transport, the steps are a generator that yields
+        an OracleRequest to be sent, and is given back the response, or the exception raised sending it,
+        or yields the seconds to wait, and returns the result of the call
+
+        :param steps:
+        :return: the result of the call
+        """
+        response, error = None, None
+        while True:
+            try:
+                step = steps.throw(error) if error else steps.send(response)
+            except StopIteration as e:
+                return e.value
+            response, error = None, None
+            if isinstance(step, OracleRequest):
+                try:
+                    response = self.send_request(step)
+                except Exception as e:
+                    error = e
+            elif step > 0:
+                time.sleep(step)
+
+    def make_match_payload(self, metadata, doctype, must_match=False, match_doctype=None, derived=None):
+        """
+        build the body sent to /docmatch_add, raises KeyError if a required field is missing
 
         :param metadata:
         :param doctype:
         :param must_match:
         :param match_doctype: list of doctypes, if specified only this type of doctype is matched
+        :param derived: dict with the author (and author_count) and doi fields already built for this metadata,
+                        ie from the metadata cache
         :return:
         """
-        results = []
-        try:
-            # 8/31 abstract can be empty, since oracle can match with title
-            payload = {'abstract': metadata.get('abstract', '').replace('\n', ' '),
-                       'title': metadata['title'].replace('\n', ' '),
-                       'author': self.normalize_author_list(metadata['authors']),
-                       'year': metadata['pubdate'][:4],
-                       'doctype': doctype,
-                       'bibcode': metadata['bibcode'],
-                       'doi': self.extract_doi(metadata),
-                       'mustmatch': must_match,
-                       'match_doctype': match_doctype}
-        except KeyError as e:
-            results.append({
-                'source_bibcode' : metadata['bibcode'],
-                'comment' : 'Exception: KeyError, %s missing.' % str(e),
-                'status_flaw': 'did not send request to oracle service'})
+        authors = derived if derived else self.get_payload_authors(metadata['authors'])
+        # 8/31 abstract can be empty, since oracle can match with title
+        payload = {'abstract': metadata.get('abstract', '').replace('\n', ' '),
+                   'title': metadata['title'].replace('\n', ' '),
+                   'author': authors['author'],
+                   'year': metadata['pubdate'][:4],
+                   'doctype': doctype,
+                   'bibcode': metadata['bibcode'],
+                   'doi': derived['doi'] if derived else self.extract_doi(metadata),
+                   'mustmatch': must_match,
+                   'match_doctype': match_doctype}
+        if 'author_count' in authors:
+            payload['author_count'] = authors['author_count']
+        return payload
+
+    def get_payload_error(self, metadata, error):
+        """
 
-            return results
+        :param metadata:
+        :param error: KeyError raised while building the payload
+        :return:
+        """
+        return [{
+            'source_bibcode' : metadata['bibcode'],
+            'comment' : 'Exception: KeyError, %s missing.' % str(error),
+            'status_flaw': 'did not send request to oracle service'}]
+
+    def get_retry_sleep(self, attempt):
+        """
+        seconds to wait before the next attempt when oracle returned 502/504
 
+        :param attempt: zero based
+        :return:
+        """
         sleep_sec = int(config.get('DOCMATCHPIPELINE_API_ORACLE_SERVICE_SLEEP_SEC', 5))
-        try:
-            num_attempts = int(config.get('DOCMATCHPIPELINE_API_ORACLE_SERVICE_ATTEMPTS', 5))
-            for i in range(num_attempts):
-                time_scaled = int(sleep_sec*math.exp(i/3.) + 0.5)
-                response = requests.post(
-                    url=config.get('DOCMATCHPIPELINE_API_ORACLE_SERVICE_URL', 'http://localhost') + '/docmatch_add',
-                    headers={'Authorization': 'Bearer %s' % config.get('DOCMATCHPIPELINE_API_TOKEN', '')},
-                    data=json.dumps(payload),
-                    timeout=60
-                )
-                status_code = response.status_code
-                if status_code == 200:
-                    logger.info('Got 200 for status_code at attempt # %d' % (i + 1))
-                    break
-                # if got 5xx errors from oracle, per alberto, sleep for five seconds and try again, attempt 3 times
-                elif status_code in [502, 504]:
-                    logger.info('Got %d status_code from oracle, waiting %d second and attempt again.' % (
-                    status_code, time_scaled))
-                    time.sleep(time_scaled)
-                # any other error, quit
-                else:
-                    logger.info('Got %s status_code from a call to oracle, stopping.' % status_code)
-                    break
-        except Exception as e:
-            status_code = 500
-            logger.info('Exception %s, stopping.' % str(e))
+        return int(sleep_sec*math.exp(attempt/3.) + 0.5)
 
+    def process_match_response(self, metadata, status_code, response_text):
+        """
+        turn the final response from /docmatch_add into the list of results
+
+        :param metadata:
+        :param status_code:
+        :param response_text:
+        :return:
+        """
+        results = []
         if status_code == 200:
-            json_text = json.loads(response.text)
+            json_text = json.loads(response_text)
             if 'match' in json_text:
                 confidences = [one_match['confidence'] for one_match in json_text['match']]
                 # do we have more than one match with the highest confidence
@@ -333,6 +718,65 @@ class OracleUtil():
             'status_flaw' : "got %d for the last failed attempt -- shall be added to rerun list." % status_code})
         return results
 
+    def get_matches(self, metadata, doctype, must_match=False, match_doctype=None, payload=None):
+        """
+
+        :param metadata:
+        :param doctype:
+        :param must_match:
+        :param match_doctype: list of doctypes, if specified only this type of doctype is matched
+        :param payload: if already built by make_match_payload
+        :return:
+        """
+        return self.run_steps(self.get_matches_steps(metadata, doctype, must_match, match_doctype, payload))
+
+    def get_matches_steps(self, metadata, doctype, must_match=False, match_doctype=None, payload=None):
+        """
+        steps of get_matches, see run_steps
+
+        :param metadata:
+        :param doctype:
+        :param must_match:
+        :param match_doctype:
+        :param payload:
+        :return:
+        """
+        if payload is None:
+            try:
+                payload = self.make_match_payload(metadata, doctype, must_match, match_doctype)
+            except KeyError as e:
+                return self.get_payload_error(metadata, e)
+
+        cache_key, response_text = self.get_cached_match(payload)
+        if response_text is not None:
+            return self.process_match_response(metadata, 200, response_text)
+
+        try:
+            num_attempts = int(config.get('DOCMATCHPIPELINE_API_ORACLE_SERVICE_ATTEMPTS', 5))
+            for i in range(num_attempts):
+                time_scaled = self.get_retry_sleep(i)
+                response = yield OracleRequest('post', 'docmatch_add', data=json.dumps(payload))
+                status_code = response.status_code
+                if status_code == 200:
+                    logger.info('Got 200 for status_code at attempt # %d' % (i + 1))
+                    response_text = response.text
+                    break
+                # if got 5xx errors from oracle, per alberto, sleep for five seconds and try again, attempt 3 times
+                elif status_code in [502, 504]:
+                    logger.info('Got %d status_code from oracle, waiting %d second and attempt again.' % (
+                    status_code, time_scaled))
+                    yield time_scaled
+                # any other error, quit
+                else:
+                    logger.info('Got %s status_code from a call to oracle, stopping.' % status_code)
+                    break
+        except Exception as e:
+            status_code = 500
+            logger.info('Exception %s, stopping.' % str(e))
+
+        self.set_cached_match(cache_key, status_code, response_text)
+        return self.process_match_response(metadata, status_code, response_text)
+
     def read_google_sheet(self, input_filename):
         """
 
@@ -428,6 +872,15 @@ class OracleUtil():
     def add_to_db(self, matches):
         """
 
+        :param matches:
+        :return:
+        """
+        return self.run_steps(self.add_to_db_steps(matches))
+
+    def add_to_db_steps(self, matches):
+        """
+        steps of add_to_db, see run_steps
+
         :param matches:
         :return:
         """
@@ -437,12 +890,9 @@ class OracleUtil():
         if len(data) > 0:
             for i in range(0, len(data), max_lines_one_call):
                 slice_item = slice(i, i + max_lines_one_call, 1)
-                response = requests.put(
-                    url=config.get('DOCMATCHPIPELINE_API_ORACLE_SERVICE_URL', 'http://localhost') + '/add',
-                    headers={'Content-type': 'application/json', 'Accept': 'text/plain',
-                             'Authorization': 'Bearer %s' % config.get('DOCMATCHPIPELINE_API_TOKEN', '')},
-                    data=json.dumps(data[slice_item]),
-                    timeout=60
+                response = yield OracleRequest('put', 'add',
+                    headers={'Content-type': 'application/json', 'Accept': 'text/plain'},
+                    data=json.dumps(data[slice_item])
                 )
                 if response.status_code == 200:
                     json_text = json.loads(response.text)
@@ -454,57 +904,263 @@ class OracleUtil():
             return 'Added %d records to database.'%count
         return 'No data!'
 
-    def output_query_matches(self, filename, results):
+    def add_each_to_db(self, matches):
+        """
+        add the matches one at a time, so that one that fails does not stop the others
+
+        :param matches:
+        :return: list of the result of add_to_db, or of the exception it raised, for each match
+        """
+        results = []
+        for match in matches:
+            try:
+                results.append(self.add_to_db([match]))
+            except Exception as err:
+                results.append(err)
+        return results
+
+    def write_query_matches(self, fp, results):
         """
 
-        :param filename:
+        :param fp: output file opened for writing
         :param results:
         :return:
         """
-        with open(filename, 'a') as fp:
-            for result in results:
-                fp.write('%s\t%s\t%s\n' % (result[0], result[1], result[2]))
+        for result in results:
+            fp.write('%s\t%s\t%s\n' % (result[0], result[1], result[2]))
+
+    def get_query_request(self, start, days=None):
+        """
+
+        :param start: offset of the first match of the page
+        :param days: optinal query filter, how many days of update to include in the query, if none, all are included
+        :return: headers and body of the request for one page of /query
+        """
+        params = {'start': start}
+        if days:
+            params['days'] = int(days)
+        return {'Content-type': 'application/json', 'Accept': 'application/json'}, json.dumps(params)
+
+    def get_query_page(self, start, days=None):
+        """
+        one page of the matches in oracle db, attempted DOCMATCHPIPELINE_API_ORACLE_SERVICE_ATTEMPTS times,
+        waiting longer after each failure, raises QueryPageException if none succeeded
+
+        :param start: offset of the first match of the page
+        :param days: optinal query filter, how many days of update to include in the query, if none, all are included
+        :return: number of rows per page, and the matches of this page
+        """
+        return self.run_steps(self.get_query_page_steps(start, days))
+
+    def get_query_page_steps(self, start, days=None):
+        """
+        steps of get_query_page, see run_steps
+
+        :param start:
+        :param days:
+        :return:
+        """
+        headers, data = self.get_query_request(start, days)
+        num_attempts = int(config.get('DOCMATCHPIPELINE_API_ORACLE_SERVICE_ATTEMPTS', 5))
+        for i in range(num_attempts):
+            try:
+                response = yield OracleRequest('post', 'query', headers=headers, data=data)
+                if response.status_code == 200:
+                    json_dict = json.loads(response.text)
+                    return json_dict['params']['rows'], json_dict['results']
+                logger.info('Got %d status_code from oracle for the page at %d, attempt # %d.' % (response.status_code, start, i + 1))
+            except Exception as e:
+                logger.info('Exception %s for the page at %d, attempt # %d.' % (str(e), start, i + 1))
+            if i + 1 < num_attempts:
+                yield self.get_retry_sleep(i)
+        raise QueryPageException('Unable to get the page at %d from oracle after %d attempts.' % (start, num_attempts))
+
+    def read_query_state(self, state_filename, days):
+        """
+
+        :param state_filename:
+        :param days:
+        :return: state saved by an earlier query run the same day with the same days, or None
+        """
+        try:
+            with open(state_filename, 'r') as fp:
+                state = json.load(fp)
+        except (OSError, ValueError):
+            return None
+        # the days of the query count back from the day it is run, a query left from another day is started over
+        if state.get('days') != days or state.get('date') != date.today().isoformat():
+            return None
+        return state
+
+    def open_query_output(self, output_filename, days):
+        """
+        the pages of a query go to output_filename.part, continued if an earlier query run the same day with
+        the same days saved its state in output_filename.state, and started over otherwise
+
+        :param output_filename:
+        :param days:
+        :return: the part file, and the state to resume from, or None
+        """
+        part_filename = output_filename + '.part'
+        state = self.read_query_state(output_filename + '.state', days) if os.path.exists(part_filename) else None
+        fp = open(part_filename, 'r+' if state else 'w')
+        if state:
+            # drop what was written after the last page saved
+            fp.seek(state['size'])
+            fp.truncate()
+            logger.info('Resuming query at %d, after %d records.' % (state['start'], state['count']))
+        return fp, state
+
+    def save_first_query_page(self, fp, output_filename, days, rows, results):
+        """
+
+        :param fp: part file
+        :param output_filename:
+        :param days:
+        :param rows: number of rows per page
+        :param results: the matches of the first page
+        :return: the state of the query, with rows zero if there are no more pages
+        """
+        logger.info('[%d, %d]' % (0, len(results)))
+        state = {'date': date.today().isoformat(), 'days': days, 'rows': rows, 'start': 0, 'count': 0, 'size': 0}
+        if results and rows:
+            self.save_query_page(fp, output_filename + '.state', state, results)
+        else:
+            state['rows'] = 0
+        return state
+
+    def save_query_page(self, fp, state_filename, state, results):
+        """
+        write the matches of a page, and then the offset of the next page and the size of the file,
+        to resume from if the query fails
+
+        :param fp: output file
+        :param state_filename:
+        :param state: dict with date, days, rows, start, count, and size, updated
+        :param results:
+        :return:
+        """
+        self.write_query_matches(fp, results)
+        fp.flush()
+        state.update(start=state['start'] + state['rows'], count=state['count'] + len(results), size=fp.tell())
+        with open(state_filename + '.tmp', 'w') as state_fp:
+            json.dump(state, state_fp)
+        os.replace(state_filename + '.tmp', state_filename)
+
+    def close_query_output(self, output_filename, state):
+        """
+        once all the pages are in, replace output_filename with the part file
+
+        :param output_filename:
+        :param state:
+        :return:
+        """
+        os.replace(output_filename + '.part', output_filename)
+        if os.path.exists(output_filename + '.state'):
+            os.remove(output_filename + '.state')
+        return 'Got %d records from db.' % state['count']
 
     def query(self, output_filename, days=None):
         """
+        the page size is taken from the first page, then DOCMATCHPIPELINE_ORACLE_QUERY_WORKERS pages
+        are requested at once, and written in order as they come back
+
+        the pages go to output_filename.part, and after each page the offset of the next one is saved to
+        output_filename.state, so that when a page cannot be had and the query fails, running it again the same day
+        with the same days resumes from there, output_filename is replaced once all the pages are in
 
         :param output_filename:
         :param days: optinal query filter, how many days of update to include in the query, if none, all are included
         :return:
         """
-        # remove the input file if it exitsted, since the subsequent calls use flag `a`.
-        try:
-            os.remove(output_filename)
-        except OSError:
-            pass
+        num_workers = int(config.get('DOCMATCHPIPELINE_ORACLE_QUERY_WORKERS', 1))
+        days = int(days) if days else None
+        fp, state = self.open_query_output(output_filename, days)
+        with fp:
+            if state is None:
+                rows, results = self.get_query_page(0, days)
+                state = self.save_first_query_page(fp, output_filename, days, rows, results)
+            if state['rows']:
+                # past the last page, pages come back empty, the ones already requested are dropped
+                starts = itertools.count(state['start'], state['rows'])
+                for start, (_, results) in ordered_map(lambda start: self.get_query_page(start, days), starts,
+                                                       num_workers, max_pending=num_workers):
+                    logger.info('[%d, %d]' % (start, start + len(results)))
+                    if not results:
+                        break
+                    self.save_query_page(fp, output_filename + '.state', state, results)
+        return self.close_query_output(output_filename, state)
+
+    def merge_query_matches(self, dump_filename, delta_filename, output_filename):
+        """
+        merge the matches of delta_filename into the previous dump, keyed by the source and matched bibcodes,
+        the matches of the delta replace those of the dump, and the new ones are added at the end
 
-        start = 0
+        :param dump_filename:
+        :param delta_filename:
+        :param output_filename:
+        :return: number of matches in output_filename
+        """
+        delta = {}
+        with open(delta_filename, 'r') as fp:
+            for line in fp:
+                fields = line.split('\t')
+                delta[(fields[0], fields[1])] = line
         count = 0
-        headers = {'Content-type': 'application/json', 'Accept': 'application/json',
-                   'Authorization': 'Bearer %s' % config.get('DOCMATCHPIPELINE_API_TOKEN', '')}
-        url = config.get('DOCMATCHPIPELINE_API_ORACLE_SERVICE_URL', 'http://localhost') + '/query'
-        while True:
-            params = {'start': start}
-            if days:
-                params['days'] = int(days)
-            response = requests.post(url=url, headers=headers, data=json.dumps(params), timeout=60)
-            if response.status_code == 200:
-                json_dict = json.loads(response.text)
-                params = json_dict['params']
-                results = json_dict['results']
-                logger.info('[%d, %d]' % (start, start + len(results)))
-                count += len(results)
-                start += params['rows']
-                if not results:
-                    break
-                self.output_query_matches(output_filename, results)
-        return 'Got %d records from db.' % count
+        with open(dump_filename, 'r') as dump_fp, open(output_filename, 'w') as fp:
+            for line in dump_fp:
+                fields = line.split('\t')
+                if len(fields) > 1:
+                    line = delta.pop((fields[0], fields[1]), line)
+                fp.write(line)
+                count += 1
+            for line in delta.values():
+                fp.write(line)
+                count += 1
+        return count
+
+    def get_dump_days(self, daily_file, full_refresh_file):
+        """
+        how many days of matches to fetch and merge into the previous dump,
+        covering the days since that dump was written, in case some were missed
+
+        :param daily_file:
+        :param full_refresh_file: touched when the whole db is dumped
+        :return: zero when the whole db is to be dumped
+        """
+        incremental_days = int(config.get('DOCMATCHPIPELINE_ORACLE_DUMP_INCREMENTAL_DAYS', 0))
+        full_refresh_days = float(config.get('DOCMATCHPIPELINE_ORACLE_DUMP_FULL_REFRESH_DAYS', 7))
+        if incremental_days <= 0 or not os.path.exists(daily_file) or not os.path.exists(full_refresh_file):
+            return 0
+        now = time.time()
+        if now - os.path.getmtime(full_refresh_file) >= full_refresh_days * 86400:
+            return 0
+        return max(incremental_days, int(math.ceil((now - os.path.getmtime(daily_file)) / 86400.)))
 
     def dump_oracledb(self):
+        """
+        dump oracle db to file, with DOCMATCHPIPELINE_ORACLE_DUMP_INCREMENTAL_DAYS set, only the matches of the last days
+        are fetched and merged into the previous dump, and the whole db is dumped every DOCMATCHPIPELINE_ORACLE_DUMP_FULL_REFRESH_DAYS,
+        to drop the matches deleted from db, the dump is replaced once complete, and a failed dump resumes where it stopped
+
+        :return:
+        """
         daily_file = config.get("DOCMATCHPIPELINE_PUBLISHED_DIR", "/tmp/") + config.get("DOCMATCHPIPELINE_ORACLE_DUMP_FILE", "oracle_dump.tsv")
         daily_maxage = config.get("DOCMATCHPIPELINE_ORACLE_DUMP_AGE", 9999)
-        result = self.query(daily_file, days=daily_maxage)
-        logger.info('Query returns: %s; Oracle db successfully dumped to file: %s' % (result, daily_file))
+        full_refresh_file = daily_file + '.full'
+        days = self.get_dump_days(daily_file, full_refresh_file)
+        if days:
+            delta_file = daily_file + '.delta'
+            tmp_file = daily_file + '.tmp'
+            result = self.query(delta_file, days=days)
+            count = self.merge_query_matches(daily_file, delta_file, tmp_file)
+            os.remove(delta_file)
+            os.replace(tmp_file, daily_file)
+            logger.info('Query returns: %s; merged into %d records of oracle db dump file: %s' % (result, count, daily_file))
+        else:
+            result = self.query(daily_file, days=daily_maxage)
+            Path(full_refresh_file).touch()
+            logger.info('Query returns: %s; Oracle db successfully dumped to file: %s' % (result, daily_file))
 
 
     def update_db_curated_matches(self, input_filename):
@@ -524,11 +1180,7 @@ class OracleUtil():
         :return:
         """
         try:
-            response = requests.get(
-                url=config.get('DOCMATCHPIPELINE_API_ORACLE_SERVICE_URL', 'http://localhost') + '/source_score',
-                headers={'Authorization': 'Bearer %s' % config.get('DOCMATCHPIPELINE_API_TOKEN', '')},
-                timeout=60
-            )
+            response = self.transport.get('source_score')
             if response.status_code == 200:
                 source_score = json.loads(response.text)
                 return source_score.get('results', [])
@@ -546,11 +1198,7 @@ class OracleUtil():
         :return:
         """
         try:
-            response = requests.get(
-                url=config.get('DOCMATCHPIPELINE_API_ORACLE_SERVICE_URL', 'http://localhost') + '/confidence/%s'%source,
-                headers={'Authorization': 'Bearer %s' % config.get('DOCMATCHPIPELINE_API_TOKEN', '')},
-                timeout=60
-            )
+            response = self.transport.get('confidence', '/confidence/%s'%source)
             if response.status_code == 200:
                 confidence = json.loads(response.text)
                 return confidence.get('confidence', None)
@@ -590,9 +1238,7 @@ class OracleUtil():
             sleep_sec = int(config.get('DOCMATCHPIPELINE_API_ORACLE_SERVICE_SLEEP_SEC', 5))
             num_attempts = int(config.get('DOCMATCHPIPELINE_API_ORACLE_SERVICE_ATTEMPTS', 5))
             for i in range(num_attempts):
-                response = requests.get(
-                    url=config.get('DOCMATCHPIPELINE_API_ORACLE_SERVICE_URL', 'http://localhost') + '/cleanup',
-                    headers={'Authorization': 'Bearer %s' % config.get('DOCMATCHPIPELINE_API_TOKEN', '')})
+                response = self.transport.get('cleanup')
                 status_code = response.status_code
                 if status_code == 200:
                     logger.info('Got HTTP Status 200 from oracle at attempt # %d' % (i + 1))
@@ -627,12 +1273,11 @@ class OracleUtil():
             while input_pairs:
                 (upload_rows, retry_rows) = utils.dedup_pairs(input_pairs)
                 match_upload = [[x, y, input_score] for (x, y) in upload_rows]
-                for pair in match_upload:
-                    try:
-                        result = self.add_to_db([pair])
-                        logger.info("Result from add_to_db: %s" % result)
-                    except Exception as err:
+                for pair, result in zip(match_upload, self.add_each_to_db(match_upload)):
+                    if isinstance(result, Exception):
                         logger.warning("Unable to add result (%s): %s" % (pair, result))
+                    else:
+                        logger.info("Result from add_to_db: %s" % result)
                 if retry_rows:
                     input_pairs = retry_rows
                 else:
@@ -649,3 +1294,16 @@ class OracleUtil():
                     logger.info("Contents of %s successfully backed up to %s" % (input_filename, frozen_filename))
             else:
                 logger.info("Backup not triggered for %s, stopping." % input_filename)
+
+
+def parse_author_list_in_process(author_string):
+    """
+    run by the worker process of OracleUtil.get_author_executor, on its main thread
+
+    :param author_string:
+    :return: normalized authors, or None if they could not be parsed within the budget
+    """
+    try:
+        return OracleUtil().parse_author_list_timed(author_string)
+    except (AuthorBudgetExceeded, AuthorListTooLong):
+        return None
@@ -8,6 +8,8 @@ logger = setup_logging('docmatch_log_pub_parser')
 
 FIELDPAT = re.compile(r"([A-Za-z][^:]*):\s*(.*)")
 MAX_ABSTRACT_FIELD_LINES = 50000
+# line separating the header from the abstract
+ABSTRACT_LINE = '                               Abstract'
 # Fieldes containing HTML encoded content
 HTML_ENCODED_FIELDS = ['Journal', 'Authors', 'Abstract', 'Title']
 
@@ -36,6 +38,19 @@ ILLEGALCHARSREGEX = get_illegal_char_regex()
 
 UNICODE_HANDLER = UnicodeHandler()
 
+# fields of the metadata file that are kept, and their names in the returned metadata
+FIELD_MAPPINGS = [
+    ("Authors", "authors"),
+    ("Title", "title"),
+    ("Abstract", "abstract"),
+    ("Journal", "pub"),
+    ("Publication Date", "pubdate"),
+    ("Bibliographic Code", "bibcode"),
+    ("DOI", "doi"),
+    ("Comments", "comments"),
+    ("Origin", "origin")
+]
+
 def as_needed(article):
     """
     return only needed fields
@@ -43,75 +58,271 @@ def as_needed(article):
     :param article:
     :return:
     """
-    field_mappings = [
-        ("Authors", "authors"),
-        ("Title", "title"),
-        ("Abstract", "abstract"),
-        ("Journal", "pub"),
-        ("Publication Date", "pubdate"),
-        ("Bibliographic Code", "bibcode"),
-        ("DOI", "doi"),
-        ("Comments", "comments"),
-        ("Origin", "origin")
-    ]
     return_record = {}
-    for src_key, dest_key in field_mappings:
+    for src_key, dest_key in FIELD_MAPPINGS:
         value = article.get(src_key, None)
         if value:
             return_record[dest_key] = value
     return return_record
 
+class PubMetadata(object):
+    """
+    compact version of the dict returned by get_pub_metadata, with a fixed set of attributes instead of
+    a dict per record, that can be used in place of the dict: fields missing from the metadata file are
+    missing here as well, so get, [], in, pop, and assignment to the fields behave as they do for the dict
+
+    besides the fields, filename is the metadata file the record was read from, and content_hash is set
+    when the record went through the metadata cache
+    """
+
+    FIELDS = tuple(dest_key for _, dest_key in FIELD_MAPPINGS)
+
+    __slots__ = FIELDS + ('filename', 'content_hash')
+
+    def __init__(self, filename=None, **fields):
+        """
+
+        :param filename: metadata file the record was read from
+        :param fields:
+        """
+        self.filename = filename
+        for key, value in fields.items():
+            self[key] = value
+
+    def __getitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        delattr(self, key)
+
+    def __contains__(self, key):
+        return key in self.FIELDS and hasattr(self, key)
+
+    def __eq__(self, other):
+        if isinstance(other, PubMetadata):
+            other = other.to_dict()
+        return self.to_dict() == other
+
+    def __repr__(self):
+        return 'PubMetadata(%r, %r)' % (self.filename, self.to_dict())
+
+    def get(self, key, default=None):
+        """
+
+        :param key:
+        :param default:
+        :return:
+        """
+        return getattr(self, key, default) if key in self.FIELDS else default
+
+    def pop(self, key, *default):
+        """
+
+        :param key:
+        :param default:
+        :return:
+        """
+        if key in self:
+            value = getattr(self, key)
+            delattr(self, key)
+            return value
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+    def keys(self):
+        """
+
+        :return:
+        """
+        return [key for key in self.FIELDS if hasattr(self, key)]
+
+    def to_dict(self):
+        """
+
+        :return: same dict get_pub_metadata returns
+        """
+        return {key: getattr(self, key) for key in self.keys()}
+
+def as_record(article, filename=None):
+    """
+    same as as_needed, returning a PubMetadata instead of a dict
+
+    :param article:
+    :param filename:
+    :return:
+    """
+    record = PubMetadata(filename)
+    for src_key, dest_key in FIELD_MAPPINGS:
+        value = article.get(src_key, None)
+        if value:
+            setattr(record, dest_key, value)
+    # the few distinct values are shared by all the records
+    if record.get('origin'):
+        record.origin = sys.intern(record.origin)
+    return record
+
+def read_lines(contents):
+    """
+    yield the lines of the metadata, without the line ends, removing illegal unicode characters
+
+    :param contents: bytes or str with the whole metadata, or a file object opened in binary (or text) mode,
+                     which is read one line at a time
+    :return:
+    """
+    if isinstance(contents, (bytes, str)):
+        if isinstance(contents, bytes):
+            contents = contents.decode('utf-8')
+        #I check if in the file there are invalid unicode characters
+        if ILLEGALCHARSREGEX.search(contents):
+            # strip illegal stuff but keep newlines
+            contents = UNICODE_HANDLER.remove_control_chars(contents, strict=True)
+            logger.error('Illegal unicode character in metadata file')
+        for line in contents.split('\n'):
+            yield line
+        return
+
+    found_illegal = False
+    for line in contents:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        if line.endswith('\n'):
+            line = line[:-1]
+        if ILLEGALCHARSREGEX.search(line):
+            line = UNICODE_HANDLER.remove_control_chars(line, strict=True)
+            found_illegal = True
+        yield line
+    if found_illegal:
+        logger.error('Illegal unicode character in metadata file')
+
+def strip_lines(lines):
+    """
+    same as stripping the whole metadata before splitting it into lines, without holding all the lines:
+    blank lines at the beginning and the end are dropped, the first line is left stripped and the last
+    one right stripped
+
+    :param lines: iterator of lines
+    :return:
+    """
+    # blank lines are held until a non blank line shows they are not at the end
+    blank_lines = []
+    previous = None
+    for line in lines:
+        if previous is None:
+            if not line.strip():
+                continue
+            previous = line.lstrip()
+        elif not line.strip():
+            blank_lines.append(line)
+        else:
+            yield previous
+            for blank_line in blank_lines:
+                yield blank_line
+            blank_lines = []
+            previous = line
+    if previous is not None:
+        yield previous.rstrip()
+
 def get_pub_metadata(contents):
     """
     Returns a dictionary generated from the metadata file.
 
-    :param contents:
+    :param contents: bytes or str with the whole metadata, or a file object opened in binary mode
+    :return:
+    """
+    return as_needed(parse_article(contents))
+
+def get_pub_record(contents, filename=None):
+    """
+    same as get_pub_metadata, returning a PubMetadata instead of a dict
+
+    :param contents: bytes or str with the whole metadata, or a file object opened in binary mode
+    :param filename:
+    :return:
+    """
+    return as_record(parse_article(contents), filename)
+
+def get_pub_bibcode(contents):
+    """
+    read only the header of the metadata file, stopping at the abstract, to get the bibcode without
+    parsing and decoding the rest of the file
+
+    :param contents: bytes or str with the whole metadata, or a file object opened in binary mode
+    :return: the bibcode get_pub_metadata would return, or None if the header has no valid bibcode,
+             in which case get_pub_metadata raises MetadataError
+    """
+    bibcode = None
+    current_field = ''
+    current_value = []
+    for line in strip_lines(read_lines(contents)):
+        match = FIELDPAT.match(line)
+        if match or line == ABSTRACT_LINE:
+            # same as parse_article, a field is only kept once the next one, or the abstract, starts
+            if current_field == 'Bibliographic Code':
+                bibcode = ' '.join(current_value)
+            if not match:
+                break
+            current_field = match.group(1)
+            current_value = [match.group(2).strip()]
+        elif line.strip():
+            current_value.append(line.strip())
+    if bibcode is None or len(bibcode) != 19:
+        return None
+    return bibcode
+
+def parse_article(contents):
+    """
+    Returns all the fields of the metadata file, with the name they have in the file.
+
+    The metadata is read in a single pass, each line is looked at once, and the lines of multi-line
+    fields are collected in a list and joined once the field ends.
+
+    :param contents: bytes or str with the whole metadata, or a file object opened in binary mode
     :return:
     """
     article = {}
     article[u'Bibliographic Code'] = ''
     current_field = ''
-    current_value = ''
+    current_value = []
     fields_found_in_file = []
     num_lines = 0
 
-    if (isinstance(contents, bytes)):
-        contents = contents.decode('utf-8')
-
-    #I check if in the file there are invalid unicode characters
-    if ILLEGALCHARSREGEX.search(contents):
-        # strip illegal stuff but keep newlines
-        contents = UNICODE_HANDLER.remove_control_chars(contents, strict=True)
-        logger.error('Illegal unicode character in metadata file')
-    contents = contents.strip().split('\n')
-
-    while contents:
-        line = contents.pop(0)
+    lines = strip_lines(read_lines(contents))
+    for line in lines:
         match = FIELDPAT.match(line)
         if match:
             # see if we have an existing field
             if current_field:
-                article[current_field] = current_value
+                article[current_field] = ' '.join(current_value)
             current_field = match.group(1)
-            current_value = match.group(2).strip()
+            current_value = [match.group(2).strip()]
             fields_found_in_file.append(current_field)
             num_lines = 1
-        elif line == '                               Abstract':
+        elif line == ABSTRACT_LINE:
             # Beginning of the abstract.
             fields_found_in_file.append('Abstract')
-            article[current_field] = current_value
+            article[current_field] = ' '.join(current_value)
             break
         elif line.strip():
             # Same field as previous line. Append to the value.
-            current_value = current_value + ' ' + line.strip()
+            current_value.append(line.strip())
             num_lines += 1
 
         if num_lines > MAX_ABSTRACT_FIELD_LINES:
             raise MetadataError('Number of lines for field %s too large (%d).'%(current_field, num_lines))
 
-    # Now let's get the abstract. The abstract can contain multiple
-    # paragraphs so we need to make sure that we keep this information.
-    abstract = ''.join([l.strip() and l.strip() + ' ' or '<P />' for l in contents])
+    # Now let's get the abstract, from the lines left after the header. The abstract can contain
+    # multiple paragraphs so we need to make sure that we keep this information.
+    abstract = ''.join([l.strip() and l.strip() + ' ' or '<P />' for l in lines])
     article[u'Abstract'] = abstract.strip().replace(' \n', '\n')
 
     # if the bibcode is not in the field that I have retrieved then there is a huge problem with the file
@@ -133,4 +344,4 @@ def get_pub_metadata(contents):
     switch_date = article['Publication Date'].split('/')
     article['Publication Date'] = switch_date[1] + '/' + switch_date[0]
 
-    return as_needed(article)
+    return article
@@ -2,6 +2,9 @@ from builtins import chr
 from builtins import object
 import os
 import re
+import pickle
+import hashlib
+import threading
 from collections import UserDict
 
 
@@ -13,6 +16,9 @@ class UnicodeError(Exception):
 
 
 class UnicodeChar(object):
+
+    __slots__ = ('code', 'entity', 'ascii', 'latex', 'type')
+
     def __init__(self, fields):
         """
 
@@ -27,6 +33,13 @@ class UnicodeChar(object):
         else:
             self.type = ''
 
+    def to_row(self):
+        """
+
+        :return: fields to rebuild the object from
+        """
+        return (str(self.code), self.entity, self.ascii, self.latex, self.type)
+
 
 class UnicodeHandler(UserDict):
     """
@@ -48,6 +61,11 @@ class UnicodeHandler(UserDict):
     re_entity = re.compile(r'&([a-zA-Z0-9]{2,}?);')
     re_numentity = re.compile(r'&#(?P<number>\d+);')
     re_hexnumentity = re.compile('&#x(?P<hexnum>[0-9a-fA-F]+);')
+    # the three above in one pass
+    re_any_entity = re.compile(r'&(?:#(?P<number>\d+)|#x(?P<hexnum>[0-9a-fA-F]+)|(?P<name>[a-zA-Z0-9]{2,}?));')
+
+    # characters that, once decoded, can form a new entity with the text around them
+    CHAINING_CHARS = frozenset('&#;0123456789abcdefABCDEFx')
 
     # Courtesy of Chase Seibert.
     # http://bitkickers.blogspot.com/2011/05/stripping-control-characters-in-python.html
@@ -60,17 +78,72 @@ class UnicodeHandler(UserDict):
 
     XML_PREDEFINED_ENTITIES = ('quot', 'amp', 'apos', 'lt', 'gt')
 
-    def __init__(self):
+    # bump when what is kept in the cache changes
+    CACHE_VERSION = 1
+
+    def __init__(self, data_filename=None, cache_filename=None):
         """
+        the table is loaded on first use, from a binary cache of the parsed data file
+        that is written next to it and rebuilt when the data file changes
+
+        :param data_filename: if not specified, unicode.dat in this directory
+        :param cache_filename: if not specified, the data filename with the extension .cache
+        """
+        self.data_filename = data_filename or os.path.dirname(__file__) + '/unicode.dat'
+        self.cache_filename = cache_filename or self.data_filename + '.cache'
+        self._data = None
+        self._str = None
+        self._entity_chars = None
+        self._lock = threading.Lock()
+
+    @property
+    def data(self):
+        """
+        entity name to UnicodeChar, the dict behind UserDict
+
+        :return:
+        """
+        if self._data is None:
+            self.load()
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = value
 
-        :param data_filename:
+    @property
+    def str(self):
         """
-        self.data_filename = os.path.dirname(__file__) + '/unicode.dat'
-        self.str = [None, ] * 65536
+        code to UnicodeChar, for the codes with a type
 
-        lines = open(self.data_filename).readlines()
-        UserDict.__init__(self)
-        for line in lines:
+        :return:
+        """
+        if self._str is None:
+            self.load()
+        return self._str
+
+    @property
+    def entity_chars(self):
+        """
+        entity name to character
+
+        :return:
+        """
+        if self._entity_chars is None:
+            self.load()
+        return self._entity_chars
+
+    def parse_data(self, contents):
+        """
+        parse the data file
+
+        :param contents:
+        :return: list of the fields of the entities, and list of the code table as (code, index in the list of entities)
+        """
+        rows = []
+        codes = []
+        # same lines as reading the file in text mode
+        for line in contents.replace('\r\n', '\n').replace('\r', '\n').split('\n'):
             fields = line.split()
             for i, field in enumerate(fields):
                 if field.startswith('"') and field.endswith('"'):
@@ -79,15 +152,75 @@ class UnicodeHandler(UserDict):
                 try:
                     code = int(fields[0].split(':')[0].split(';')[0])
                     entity = fields[1]
-                    self[entity] = UnicodeChar(fields)  # keep entity table
-
+                    rows.append((entity, UnicodeChar(fields).to_row()))  # keep entity table
                     if len(fields) > 4:  # keep code table
-                        if not self.str[code]:
-                            self.str[code] = self[entity]
-                        else:
-                            pass
+                        codes.append((code, len(rows) - 1))
                 except ValueError:
                     pass
+        return rows, codes
+
+    def read_cache(self, key):
+        """
+
+        :param key: identifies the version of the data file the cache has to be built from
+        :return: what parse_data returns, or None if there is no cache or it is stale
+        """
+        try:
+            with open(self.cache_filename, 'rb') as fp:
+                cached = pickle.load(fp)
+            if cached['key'] == key:
+                return cached['rows'], cached['codes']
+        except Exception:
+            pass
+        return None
+
+    def write_cache(self, key, rows, codes):
+        """
+        the cache is only an optimization, it is not written if the directory is read only
+
+        :param key:
+        :param rows:
+        :param codes:
+        :return:
+        """
+        try:
+            tmp_filename = '%s.%d.tmp' % (self.cache_filename, os.getpid())
+            with open(tmp_filename, 'wb') as fp:
+                pickle.dump({'key': key, 'rows': rows, 'codes': codes}, fp, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_filename, self.cache_filename)
+        except OSError:
+            pass
+
+    def load(self):
+        """
+        build the tables, from the cache when it is up to date with the data file
+
+        :return:
+        """
+        with self._lock:
+            if self._data is not None:
+                return
+            with open(self.data_filename, 'rb') as fp:
+                contents = fp.read()
+            key = (self.CACHE_VERSION, hashlib.sha1(contents).hexdigest())
+            cached = self.read_cache(key)
+            if cached:
+                rows, codes = cached
+            else:
+                rows, codes = self.parse_data(contents.decode('utf-8'))
+                self.write_cache(key, rows, codes)
+
+            unicode_chars = [UnicodeChar(fields) for _, fields in rows]
+            data = {}
+            for (entity, _), unicode_char in zip(rows, unicode_chars):
+                data[entity] = unicode_char
+            code_table = {}
+            for code, index in codes:
+                if code not in code_table:
+                    code_table[code] = unicode_chars[index]
+            self._str = code_table
+            self._entity_chars = {entity: chr(unicode_char.code) for entity, unicode_char in data.items()}
+            self._data = data
 
     def __unichr(self, value):
         """
@@ -109,11 +242,7 @@ class UnicodeHandler(UserDict):
         :param match:
         :return:
         """
-        ent = match.group(1)
-        if ent in list(self.keys()):
-            ret = eval("u'\\u%04x'" % self[ent].code)
-            return ret
-        return None
+        return self.entity_chars.get(match.group(1), None)
 
     def sub_xml_entity(self, match):
         """
@@ -125,10 +254,9 @@ class UnicodeHandler(UserDict):
         ent = match.group(1)
         if ent in self.XML_PREDEFINED_ENTITIES:
             return "&" + ent + ";"
-        elif ent in list(self.keys()):
-            ret = eval("u'\\u%04x'" % self[ent].code)
-            return ret
-        else:
+        try:
+            return self.entity_chars[ent]
+        except KeyError:
             raise UnicodeError('Unknown numeric entity: %s' % match.group(0))
 
     def numeric_entity_to_unicode(self, match):
@@ -172,6 +300,42 @@ class UnicodeHandler(UserDict):
         translates entities to unicode but keep basic XML entities (such as "&lt;", "&gt;") encoded
         (we use this to properly process fields such as abstracts and title which may contain HTML markup)
 
+        named, decimal, and hexadecimal entities are translated in a single pass, the rare text where
+        a translated character could form a new entity with what follows, or that has an entity that
+        cannot be translated, goes through the three passes, one per kind of entity, of ent2xml_by_kind
+
+        :param the_entity:
+        :return:
+        """
+        if '&' not in the_entity:
+            return the_entity
+
+        by_kind = []
+        def sub_any_entity(match):
+            if match.group('name') is not None:
+                if match.group('name') in self.XML_PREDEFINED_ENTITIES:
+                    return match.group(0)
+                char = self.entity_chars[match.group('name')]
+            elif match.group('number') is not None:
+                char = chr(int(match.group('number')))
+            else:
+                char = chr(int(match.group('hexnum'), 16))
+            if char in self.CHAINING_CHARS:
+                by_kind.append(True)
+            return char
+
+        try:
+            the_xml = self.re_any_entity.sub(sub_any_entity, the_entity)
+        except (KeyError, ValueError, OverflowError):
+            by_kind.append(True)
+        if by_kind:
+            return self.ent2xml_by_kind(the_entity)
+        return the_xml
+
+    def ent2xml_by_kind(self, the_entity):
+        """
+        same as ent2xml, going over the text once per kind of entity, named first, then decimal and hexadecimal
+
         :param the_entity:
         :return:
         """
@@ -0,0 +1,230 @@
+import os
+import json
+import time
+
+
+class CSVResultFormat():
+    """
+    the spreadsheet the curators review, with the bibcodes as links to the abstract page,
+    errors are written as a single column
+    """
+
+    HEADER = 'source bibcode (link),verified bibcode,matched bibcode (link),label,confidence,matched scores,comment\n'
+    HYPERLINK_FORMAT = '"=HYPERLINK(""https://ui.adsabs.harvard.edu/abs/%s/abstract"",""%s"")"'
+
+    def get_header(self):
+        """
+
+        :return:
+        """
+        return self.HEADER
+
+    def format(self, metadata_filename, results):
+        """
+
+        :param metadata_filename:
+        :param results: list of dicts returned by oracle
+        :return: lines to write
+        """
+        lines = []
+        for result in get_matched(results):
+            lines.append('%s,,%s,%s,%s,"%s","%s"\n' % (
+                self.HYPERLINK_FORMAT % (result['source_bibcode'], result['source_bibcode']),
+                self.HYPERLINK_FORMAT % (result['matched_bibcode'], result['matched_bibcode']),
+                result.get('label', ''),
+                result.get('confidence', ''),
+                result.get('score', ''),
+                result.get('comment', ''),
+            ))
+        if not lines and results:
+            lines.append('%s\n' % [get_error_line(results)])
+        return lines
+
+
+class TSVResultFormat():
+    """
+    the six tab separated columns returned by single match, errors are written as a single column
+    """
+
+    FIELDS = ['source_bibcode', 'matched_bibcode', 'label', 'confidence', 'score', 'comment']
+
+    def get_header(self):
+        """
+
+        :return:
+        """
+        return ''
+
+    def format(self, metadata_filename, results):
+        """
+
+        :param metadata_filename:
+        :param results: list of dicts returned by oracle
+        :return: lines to write
+        """
+        lines = ['%s\n' % '\t'.join([str(result.get(field, '')) for field in self.FIELDS]) for result in get_matched(results)]
+        if not lines and results:
+            lines.append('%s\n' % get_error_line(results))
+        return lines
+
+
+class JSONLResultFormat():
+    """
+    one json object per result returned by oracle, with the metadata filename it came from
+    """
+
+    def get_header(self):
+        """
+
+        :return:
+        """
+        return ''
+
+    def format(self, metadata_filename, results):
+        """
+
+        :param metadata_filename:
+        :param results: list of dicts returned by oracle
+        :return: lines to write
+        """
+        return ['%s\n' % json.dumps(dict(result, metadata_filename=metadata_filename)) for result in results or []]
+
+
+def get_matched(results):
+    """
+
+    :param results:
+    :return: results that oracle returned a matched bibcode for, including the not matched ones with the dots bibcode
+    """
+    return [result for result in results or [] if result.get('matched_bibcode', None)]
+
+
+def get_error_line(results):
+    """
+    same line single match returns when there was no match
+
+    :param results:
+    :return:
+    """
+    status_flaw = results[0].get('status_flaw', '')
+    if status_flaw:
+        return '%s %s status_flaw=%s' % (results[0].get('source_bibcode', ''), results[0].get('comment', ''), status_flaw)
+    return '%s %s' % (results[0].get('source_bibcode', ''), results[0].get('comment', ''))
+
+
+class ResultSink():
+    """
+    writes the results of a batch run, opening the result and rerun files once for the whole run,
+    and buffering the lines in memory until buffer_size bytes are pending, flush_sec seconds have
+    passed since the last flush, or the sink is closed
+
+    when a journal is given, the filenames are added to the journal only after their results
+    are flushed, so that a resumed run never skips a record whose results were lost
+    """
+
+    FORMATS = {
+        'csv': CSVResultFormat,
+        'tsv': TSVResultFormat,
+        'jsonl': JSONLResultFormat,
+    }
+
+    def __init__(self, result_filename, rerun_filename, result_format='csv', buffer_size=65536, flush_sec=5, journal=None):
+        """
+
+        :param result_filename:
+        :param rerun_filename: metadata filenames that failed to be processed are logged here for later reprocessing
+        :param result_format: one of the keys of FORMATS
+        :param buffer_size: bytes
+        :param flush_sec:
+        :param journal: optional opened MatchJournal
+        """
+        if result_format not in self.FORMATS:
+            raise ValueError('Unknown result format %s, expected one of %s.' % (result_format, ', '.join(sorted(self.FORMATS))))
+        self.result_filename = result_filename
+        self.rerun_filename = rerun_filename
+        self.formatter = self.FORMATS[result_format]()
+        self.buffer_size = buffer_size
+        self.flush_sec = flush_sec
+        self.journal = journal
+        self.result_fp = None
+        self.rerun_fp = None
+        self.result_buffer = []
+        self.rerun_buffer = []
+        self.journal_buffer = []
+        self.pending_size = 0
+        self.last_flush = time.monotonic()
+
+    def open(self):
+        """
+        append to the result file if it exists, otherwise create it and write the header
+
+        :return:
+        """
+        new_file = not os.path.exists(self.result_filename) or os.path.getsize(self.result_filename) == 0
+        self.result_fp = open(self.result_filename, 'a')
+        if new_file:
+            self.result_fp.write(self.formatter.get_header())
+        return self
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
+    def write(self, metadata_filename, results, outcome=None):
+        """
+
+        :param metadata_filename:
+        :param results: list of dicts returned by oracle
+        :param outcome: added to the journal with the metadata filename
+        :return:
+        """
+        lines = self.formatter.format(metadata_filename, results)
+        self.result_buffer.extend(lines)
+        self.pending_size += sum(len(line) for line in lines)
+        # only log rerun if it failed to be processed from oracle side
+        if results and not get_matched(results) and results[0].get('status_flaw', None):
+            self.rerun_buffer.append('%s\n' % metadata_filename)
+        if self.journal:
+            self.journal_buffer.append((metadata_filename, outcome))
+        if self.pending_size >= self.buffer_size or time.monotonic() - self.last_flush >= self.flush_sec:
+            self.flush()
+
+    def flush(self):
+        """
+        write out the pending lines, results first, then reruns, then the journal entries
+
+        :return:
+        """
+        if self.result_buffer:
+            self.result_fp.write(''.join(self.result_buffer))
+            self.result_buffer = []
+        self.result_fp.flush()
+        if self.rerun_buffer:
+            if not self.rerun_fp:
+                self.rerun_fp = open(self.rerun_filename, 'a')
+            self.rerun_fp.write(''.join(self.rerun_buffer))
+            self.rerun_fp.flush()
+            self.rerun_buffer = []
+        if self.journal_buffer:
+            self.journal.add_many(self.journal_buffer)
+            self.journal_buffer = []
+        self.pending_size = 0
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        """
+        flush and close the files, syncing them to disk, the journal is left for the caller to close
+
+        :return:
+        """
+        if self.result_fp:
+            self.flush()
+            for fp in [self.result_fp, self.rerun_fp]:
+                if fp:
+                    os.fsync(fp.fileno())
+                    fp.close()
+            self.result_fp = None
+            self.rerun_fp = None
@@ -0,0 +1,258 @@
+import sys, os
+project_home = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../../'))
+if project_home not in sys.path:
+    sys.path.insert(0, project_home)
+
+import unittest
+import asyncio
+import time
+import random
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from adsdocmatch.batch_util import RateLimiter, Prefetcher, ConcurrencyController, RequestDeduplicator, MatchJournal, ordered_map, ordered_map_async, threaded_stage
+
+
+class TestBatchUtil(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+    def test_rate_limiter(self):
+        """ test that calls are spaced out, and that no limit means no wait """
+        rate_limiter = RateLimiter(20)
+        start_time = time.monotonic()
+        for _ in range(5):
+            rate_limiter.wait()
+        # first call goes right away, the next four are 0.05 second apart
+        self.assertGreaterEqual(time.monotonic() - start_time, 0.19)
+
+        rate_limiter = RateLimiter(0)
+        start_time = time.monotonic()
+        for _ in range(100):
+            rate_limiter.wait()
+        self.assertLess(time.monotonic() - start_time, 0.1)
+
+    def test_ordered_map(self):
+        """ test that results come back in input order even when calls finish out of order """
+        def slow_square(value):
+            time.sleep(random.uniform(0, 0.01))
+            return value * value
+
+        items = list(range(50))
+        results = list(ordered_map(slow_square, iter(items), num_workers=8))
+        self.assertEqual(results, [(value, value * value) for value in items])
+
+        # with a single worker
+        results = list(ordered_map(slow_square, items[:5], num_workers=1, rate_limiter=RateLimiter(0)))
+        self.assertEqual(results, [(value, value * value) for value in items[:5]])
+
+        # on worker processes
+        results = list(ordered_map(abs, [-value for value in items], num_workers=2, executor_class=ProcessPoolExecutor, max_pending=5))
+        self.assertEqual(results, [(-value, value) for value in items])
+
+    def test_ordered_map_async(self):
+        """ test that results come back in input order, with at most max_pending calls awaited at once, and that stopping early cancels the rest """
+        in_flight = []
+        most_in_flight = []
+        finished = []
+        async def slow_square(value):
+            in_flight.append(value)
+            most_in_flight.append(len(in_flight))
+            await asyncio.sleep(random.uniform(0, 0.01))
+            in_flight.remove(value)
+            finished.append(value)
+            return value * value
+
+        async def collect(items, max_pending, rate_limiter=None, stop_at=None):
+            results = []
+            pairs = ordered_map_async(slow_square, items, max_pending, rate_limiter)
+            try:
+                async for item, result in pairs:
+                    results.append((item, result))
+                    if item == stop_at:
+                        break
+            finally:
+                await pairs.aclose()
+            # nothing left running
+            num_finished = len(finished)
+            await asyncio.sleep(0.05)
+            self.assertEqual(len(finished), num_finished)
+            return results
+
+        items = list(range(50))
+        self.assertEqual(asyncio.run(collect(iter(items), 8)), [(value, value * value) for value in items])
+        self.assertLessEqual(max(most_in_flight), 8)
+
+        # spaced out by the rate limiter
+        start_time = time.monotonic()
+        self.assertEqual(asyncio.run(collect(items[:5], 5, RateLimiter(20))), [(value, value * value) for value in items[:5]])
+        self.assertGreaterEqual(time.monotonic() - start_time, 0.19)
+
+        # the calls still pending are cancelled
+        finished.clear()
+        self.assertEqual(asyncio.run(collect(items, 8, stop_at=3)), [(value, value * value) for value in range(4)])
+        self.assertLess(len(finished), len(items))
+
+    def test_threaded_stage(self):
+        """ test that the stage keeps the order, runs at most queue_size ahead, and passes exceptions on """
+        consumed = []
+        def items():
+            for value in range(20):
+                consumed.append(value)
+                yield value
+
+        stage = threaded_stage(lambda value: value * value, items(), queue_size=2)
+        self.assertEqual(next(stage), (0, 0))
+        time.sleep(0.05)
+        # one handed over, two in the queue, and one waiting to be put in the queue
+        self.assertLessEqual(len(consumed), 4)
+        self.assertEqual(list(stage), [(value, value * value) for value in range(1, 20)])
+
+        # stopping early stops the background thread
+        stage = threaded_stage(lambda value: value, items(), queue_size=1)
+        next(stage)
+        stage.close()
+
+        def fail(value):
+            if value == 3:
+                raise ValueError('bad record')
+            return value
+        with self.assertRaises(ValueError):
+            list(threaded_stage(fail, range(10), queue_size=2))
+
+    def test_prefetcher(self):
+        """ test that files are read ahead in order, at most window records ahead, and the other records are passed on """
+        stubdata_dir = os.path.dirname(__file__) + '/stubdata/'
+        filenames = [stubdata_dir + filename for filename in sorted(os.listdir(stubdata_dir)) if filename.endswith('.abs')]
+        consumed = []
+        def records():
+            for filename in filenames:
+                consumed.append(filename)
+                yield filename, None
+            yield stubdata_dir + 'missing.abs', None
+            yield 'record', {'bibcode': '2017arXiv170100200T'}
+
+        prefetcher = Prefetcher(window=2, num_threads=2, readahead=True)
+        records = prefetcher.prefetch(records())
+        self.assertEqual(next(records)[0], filenames[0])
+        self.assertLessEqual(len(consumed), 3)
+        records = [next(records)] + list(records)
+        self.assertEqual([name for name, _ in records[:-2]], filenames[1:])
+        for filename, contents in records[:-2]:
+            with open(filename, 'rb') as fp:
+                self.assertEqual(contents, fp.read())
+        # left for the consumer to report
+        self.assertEqual(records[-2], (stubdata_dir + 'missing.abs', None))
+        self.assertEqual(records[-1], ('record', {'bibcode': '2017arXiv170100200T'}))
+        stats = prefetcher.get_stats()
+        self.assertEqual(stats['hits'] + stats['misses'], len(filenames) + 1)
+
+    def test_concurrency_controller(self):
+        """ test additive increase on healthy responses and multiplicative decrease on gateway errors """
+        controller = ConcurrencyController(initial=1, minimum=1, maximum=4, latency_threshold=1)
+        # a full window of healthy responses raises the limit by one
+        controller.record(200, 0.1)
+        self.assertEqual(controller.get_stats()['limit'], 2)
+        controller.record(200, 0.1)
+        controller.record(200, 0.1)
+        self.assertEqual(controller.get_stats()['limit'], 3)
+        # slow responses do not count as healthy
+        for _ in range(5):
+            controller.record(200, 5)
+        self.assertEqual(controller.get_stats()['limit'], 3)
+        for _ in range(10):
+            controller.record(200, 0.1)
+        # never goes above the maximum
+        self.assertEqual(controller.get_stats()['limit'], 4)
+
+        # gateway errors halve the limit, but only once for errors coming back together
+        controller.record(502, 0.1)
+        self.assertEqual(controller.get_stats()['limit'], 2)
+        controller.record(504, 0.1)
+        self.assertEqual(controller.get_stats()['limit'], 2)
+        self.assertEqual(controller.get_stats(), {'limit': 2, 'responses': 20, 'errors': 2})
+
+        # once the limit is reached, acquire blocks until a slot is released
+        controller.acquire()
+        controller.acquire()
+        released = []
+        def release():
+            time.sleep(0.05)
+            released.append(True)
+            controller.release()
+        thread = threading.Thread(target=release)
+        thread.start()
+        controller.acquire()
+        self.assertEqual(released, [True])
+        thread.join()
+
+    def test_request_deduplicator(self):
+        """ test that identical payloads are sent once, and each duplicate gets its own copy of the result """
+        deduplicator = RequestDeduplicator(maxsize=2)
+        calls = []
+        def send(payload):
+            def func():
+                calls.append(payload['bibcode'])
+                time.sleep(0.01)
+                return [{'source_bibcode': payload['bibcode'], 'comment': ''}]
+            return func
+
+        payload = {'bibcode': '2021arXiv210312030S', 'title': 'title'}
+        # duplicates arriving while the first one is still in flight wait for it
+        results = list(ordered_map(lambda payload: deduplicator.call(payload, send(payload)), [payload] * 5, num_workers=5))
+        self.assertEqual(calls, ['2021arXiv210312030S'])
+        results[0][1][0]['comment'] = 'changed'
+        self.assertEqual(results[1][1][0]['comment'], '')
+
+        # same bibcode with different metadata is sent again
+        deduplicator.call(dict(payload, title='new title'), send(payload))
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(deduplicator.get_stats(), {'requests': 6, 'saved': 4})
+
+        # failed results are not kept
+        failed = {'bibcode': '2023arXiv230503053S'}
+        for _ in range(2):
+            deduplicator.call(failed, lambda: [{'source_bibcode': '2023arXiv230503053S', 'status_flaw': 'got 502'}])
+        self.assertEqual(deduplicator.get_stats(), {'requests': 8, 'saved': 4})
+
+        # the same from coroutines
+        deduplicator = RequestDeduplicator()
+        calls = []
+        async def send_async(payload):
+            calls.append(payload['bibcode'])
+            await asyncio.sleep(0.01)
+            return [{'source_bibcode': payload['bibcode'], 'comment': ''}]
+        async def send_all():
+            return await asyncio.gather(*[deduplicator.call_async(payload, lambda: send_async(payload)) for _ in range(5)])
+        results = asyncio.run(send_all())
+        self.assertEqual(calls, ['2021arXiv210312030S'])
+        results[0][0]['comment'] = 'changed'
+        self.assertEqual(results[1][0]['comment'], '')
+        self.assertEqual(deduplicator.get_stats(), {'requests': 5, 'saved': 4})
+
+    def test_match_journal(self):
+        """ test writing and reading back the journal """
+        result_filename = os.path.dirname(__file__) + '/stubdata/journal_test.csv'
+        journal = MatchJournal(result_filename)
+        self.assertEqual(journal.open(resume=True), {})
+        journal.add('/a/X01.abs', 'matched')
+        journal.add('/a/X02.abs', 'rerun')
+        journal.close()
+        self.assertEqual(journal.get_completed(), {'/a/X01.abs': 'matched', '/a/X02.abs': 'rerun'})
+
+        # resume keeps the entries, a new run starts over
+        self.assertEqual(journal.open(resume=True), {'/a/X01.abs': 'matched', '/a/X02.abs': 'rerun'})
+        journal.close()
+        self.assertEqual(journal.open(resume=False), {})
+        journal.close()
+        self.assertEqual(journal.get_completed(), {})
+
+        os.remove(result_filename + '.journal')
+
+
+if __name__ == '__main__':
+    unittest.main()
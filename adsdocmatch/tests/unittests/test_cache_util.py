@@ -0,0 +1,89 @@
+import sys, os
+project_home = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../../'))
+if project_home not in sys.path:
+    sys.path.insert(0, project_home)
+
+import unittest
+import mock
+
+from adsdocmatch.cache_util import LRUCache, SQLiteCache, get_hash
+
+
+class TestCacheUtil(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_filename = os.path.dirname(__file__) + '/stubdata/cache_util_test.sqlite'
+
+    def tearDown(self):
+        for extension in ['', '-wal', '-shm']:
+            if os.path.exists(self.cache_filename + extension):
+                os.remove(self.cache_filename + extension)
+
+    def test_get_hash(self):
+        """ test that the hash does not depend on the order of the keys """
+        self.assertEqual(get_hash({'title': 'a', 'year': '2018'}), get_hash({'year': '2018', 'title': 'a'}))
+        self.assertNotEqual(get_hash({'title': 'a', 'year': '2018'}), get_hash({'title': 'a', 'year': '2019'}))
+
+    def test_lru_cache(self):
+        """ test that the least recently used entries are evicted, and the hit rate """
+        cache = LRUCache(2)
+        cache.set('a', 'first')
+        cache.set('b', 'second')
+        self.assertEqual(cache.get('a'), 'first')
+        cache.set('c', 'third')
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('c'), 'third')
+        self.assertEqual(cache.get_stats(), {'hits': 2, 'misses': 1, 'hit_rate': 0.667, 'entries': 2})
+
+        # nothing is kept when the size is zero
+        cache = LRUCache(0)
+        cache.set('a', 'first')
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.get_stats(), {'hits': 0, 'misses': 1, 'hit_rate': 0.0, 'entries': 0})
+
+    def test_cache(self):
+        """ test get and set, persisting across connections """
+        cache = SQLiteCache(self.cache_filename)
+        self.assertEqual(cache.get('a'), None)
+        cache.set('a', 'first')
+        cache.set('a', 'second')
+        self.assertEqual(cache.get('a'), 'second')
+        self.assertEqual(cache.get_stats(), {'hits': 1, 'misses': 1, 'writes': 2, 'evictions': 0, 'entries': 1})
+        cache.close()
+
+        cache = SQLiteCache(self.cache_filename)
+        self.assertEqual(cache.get('a'), 'second')
+        cache.close()
+
+    def test_ttl(self):
+        """ test that entries expire """
+        cache = SQLiteCache(self.cache_filename, ttl_sec=60)
+        with mock.patch('time.time', return_value=1000):
+            cache.set('a', 'value')
+        with mock.patch('time.time', return_value=1059):
+            self.assertEqual(cache.get('a'), 'value')
+        with mock.patch('time.time', return_value=1061):
+            self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.get_stats()['entries'], 0)
+        cache.close()
+
+    def test_eviction(self):
+        """ test that the least recently used entries are evicted """
+        cache = SQLiteCache(self.cache_filename, max_entries=2)
+        with mock.patch('time.time', return_value=1000):
+            cache.set('a', '1')
+        with mock.patch('time.time', return_value=1001):
+            cache.set('b', '2')
+        with mock.patch('time.time', return_value=1002):
+            cache.get('a')
+        with mock.patch('time.time', return_value=1003):
+            cache.set('c', '3')
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), '1')
+        self.assertEqual(cache.get('c'), '3')
+        self.assertEqual(cache.get_stats()['evictions'], 1)
+        cache.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,12 +4,20 @@ if project_home not in sys.path:
     sys.path.insert(0, project_home)
 
 import unittest
+import asyncio
 import mock
 import requests
 import json
+import time
+import gzip
+import tarfile
+import zipfile
 
 from adsputils import load_config
-from adsdocmatch.match_w_metadata import MatchMetadata
+from adsdocmatch.match_w_metadata import MatchMetadata, config as match_config
+from adsdocmatch.batch_util import MatchJournal
+from adsdocmatch.oracle_async import AsyncOracleUtil
+from adsdocmatch.pub_parser import get_pub_metadata, get_pub_record
 
 config = load_config(proj_home=project_home)
 
@@ -30,6 +38,18 @@ class TestDocMatch(unittest.TestCase):
         response._content = bytes(json.dumps(text).encode('utf-8'))
         return response
 
+    def get_not_matched(self, metadata, doctype, must_match=False, match_doctype=None, payload=None):
+        """ stands in for get_matches in the batch tests, the record is not matched """
+        return [{'source_bibcode': metadata['bibcode'], 'matched_bibcode': '.' * 19, 'label': 'Not Match', 'confidence': 0, 'score': '', 'comment': ''}]
+
+    def remove_at_cleanup(self, *filenames):
+        """ remove the temp files written by the test once it is done, also when it fails """
+        def remove(filename):
+            if os.path.exists(filename):
+                os.remove(filename)
+        for filename in filenames:
+            self.addCleanup(remove, filename)
+
     def test_match_to_arXiv_1(self):
         """ test match_to_arXiv when there are no matches """
 
@@ -278,6 +298,7 @@ class TestDocMatch(unittest.TestCase):
         # remove temp files
         os.remove(input_filename)
         os.remove(result_filename)
+        os.remove(result_filename + '.journal')
 
     def test_batch_match_to_arXiv(self):
         """ test batch mode of match_to_arxiv """
@@ -321,6 +342,314 @@ class TestDocMatch(unittest.TestCase):
         # remove test files
         os.remove(input_filename)
         os.remove(result_filename)
+        os.remove(result_filename + '.journal')
+
+    def test_batch_match_to_pub_concurrent(self):
+        """ test batch mode of match_to_pub with multiple workers writes results in the input order """
+
+        # setup filenames
+        stubdata_dir = os.path.dirname(__file__) + '/stubdata'
+        input_filename = "%s%s" % (stubdata_dir, config['DOCMATCHPIPELINE_INPUT_FILENAME'])
+        result_filename = "%s%s" % (stubdata_dir, config['DOCMATCHPIPELINE_EPRINT_RESULT_FILENAME'])
+        rerun_filename = os.path.abspath(os.path.join(stubdata_dir, config['DOCMATCHPIPELINE_RERUN_FILENAME']))
+        self.remove_at_cleanup(input_filename, result_filename, result_filename + '.journal')
+
+        # create input file with list of eprint filenames
+        eprint_filenames = ['/X18-10145.abs', '/X10-50737.abs', '/X11-85081.abs', '/X23-45511.abs', '/X21-91237.abs']
+        with open(input_filename, "w") as f:
+            for filename in eprint_filenames:
+                f.write("%s\n"%(stubdata_dir+filename))
+            f.close()
+
+        expected_bibcodes = []
+        for filename in eprint_filenames:
+            with open(stubdata_dir + filename, 'rb') as arxiv_fp:
+                expected_bibcodes.append(get_pub_metadata(arxiv_fp.read())['bibcode'])
+
+        # the first records listed are answered slowest
+        def get_matches(metadata, doctype, must_match=False, match_doctype=None, payload=None):
+            bibcode = metadata['bibcode']
+            time.sleep(0.05 * (len(expected_bibcodes) - expected_bibcodes.index(bibcode)))
+            return self.get_not_matched(metadata, doctype)
+
+        # with the smallest queue between parsing and matching, the files read ahead, parsing on a thread, and then on two processes
+        for num_processes in ['0', '2']:
+            with mock.patch.dict(match_config, {'DOCMATCHPIPELINE_MATCH_WORKERS': '4', 'DOCMATCHPIPELINE_MATCH_RATE_PER_SEC': '0',
+                                                'DOCMATCHPIPELINE_MATCH_QUEUE_SIZE': '1', 'DOCMATCHPIPELINE_MATCH_PARSE_PROCESSES': num_processes,
+                                                'DOCMATCHPIPELINE_MATCH_PREFETCH': '2'}):
+                with mock.patch.object(self.match_metadata.ORACLE_UTIL, 'get_matches', side_effect=get_matches) as mock_get_matches, \
+                        mock.patch.object(self.match_metadata.ORACLE_UTIL, 'author_budget_sec', 1), \
+                        mock.patch.object(self.match_metadata.ORACLE_UTIL, 'author_thread_max_words', 300), \
+                        mock.patch.object(self.match_metadata.ORACLE_UTIL, 'start_author_executor', wraps=self.match_metadata.ORACLE_UTIL.start_author_executor) as mock_start:
+                    self.match_metadata.batch_match_to_pub(input_filename=input_filename, result_filename=result_filename, rerun_filename=rerun_filename)
+
+            # the worker process for the long author lists is started before the threads, only when parsing on a thread,
+            # and is shut down at the end of the run
+            self.assertEqual(mock_start.call_count, 1 if num_processes == '0' else 0)
+            self.assertIsNone(self.match_metadata.ORACLE_UTIL._author_executor)
+
+            # the payload is built while parsing
+            for call in mock_get_matches.call_args_list:
+                self.assertEqual(call[1]['payload'], self.match_metadata.ORACLE_UTIL.make_match_payload(*call[0]))
+
+            # make sure output file is written in the order of the input file
+            with open(result_filename, "r") as f:
+                lines = f.readlines()[1:]
+                self.assertEqual(len(lines), len(expected_bibcodes))
+                for bibcode, line in zip(expected_bibcodes, lines):
+                    self.assertTrue(line.startswith('"=HYPERLINK(""https://ui.adsabs.harvard.edu/abs/%s/abstract""' % bibcode))
+
+            # the results are appended, the next run starts from no results
+            os.remove(result_filename)
+            os.remove(result_filename + '.journal')
+
+    def test_batch_match_to_pub_jsonl(self):
+        """ test batch mode of match_to_pub reading the records from a gzipped JSON Lines file """
+
+        # setup filenames
+        stubdata_dir = os.path.dirname(__file__) + '/stubdata'
+        input_filename = "%s%s" % (stubdata_dir, config['DOCMATCHPIPELINE_INPUT_RECORDS_FILENAME'])
+        result_filename = "%s%s" % (stubdata_dir, config['DOCMATCHPIPELINE_EPRINT_RESULT_FILENAME'])
+        rerun_filename = os.path.abspath(os.path.join(stubdata_dir, config['DOCMATCHPIPELINE_RERUN_FILENAME']))
+        self.remove_at_cleanup(input_filename, result_filename, result_filename + '.journal')
+        self.assertEqual(self.match_metadata.get_input_filename(stubdata_dir), "%s%s" % (stubdata_dir, config['DOCMATCHPIPELINE_INPUT_FILENAME']))
+
+        # create the bundle from the eprint files, the last record without a filename, and a line that is not json
+        eprint_filenames = [stubdata_dir + filename for filename in ['/X18-10145.abs', '/X10-50737.abs', '/X11-85081.abs']]
+        records = []
+        for filename in eprint_filenames:
+            with open(filename, 'rb') as arxiv_fp:
+                records.append(dict(get_pub_metadata(arxiv_fp), filename=filename))
+        del records[-1]['filename']
+        with gzip.open(input_filename, 'wt', encoding='utf-8') as f:
+            f.write('%s\n' % json.dumps(records[0]))
+            f.write('{"filename": "/a/X01.abs", "bibcode"\n\n')
+            for record in records[1:]:
+                f.write('%s\n' % json.dumps(record))
+        self.assertEqual(self.match_metadata.get_input_filename(stubdata_dir), input_filename)
+
+        with mock.patch.object(self.match_metadata.ORACLE_UTIL, 'get_matches', side_effect=self.get_not_matched) as mock_get_matches:
+            self.match_metadata.batch_match_to_pub(input_filename=input_filename, result_filename=result_filename, rerun_filename=rerun_filename)
+
+        # the records are matched the same as the files they came from
+        self.assertEqual(mock_get_matches.call_count, 3)
+        for filename, call in zip(eprint_filenames, mock_get_matches.call_args_list):
+            prepared = self.match_metadata.prepare_match_to_pub(filename)
+            self.assertEqual(call[0], (prepared['metadata'], prepared['doctype'], prepared['must_match'], prepared['match_doctype']))
+        self.assertEqual(list(MatchJournal(result_filename).get_completed()), eprint_filenames[:2] + ['%s:5' % input_filename])
+
+    def test_batch_match_archive(self):
+        """ test batch mode reading the metadata files from tar and zip archives """
+
+        # setup filenames
+        stubdata_dir = os.path.dirname(__file__) + '/stubdata'
+        result_filename = "%s%s" % (stubdata_dir, config['DOCMATCHPIPELINE_EPRINT_RESULT_FILENAME'])
+        rerun_filename = os.path.abspath(os.path.join(stubdata_dir, config['DOCMATCHPIPELINE_RERUN_FILENAME']))
+
+        member_names = ['2017/X18-10145.abs', '2017/X10-50737.abs', '2018/K47-02665.abs']
+        archive_filenames = ["%s%s" % (stubdata_dir, config['DOCMATCHPIPELINE_INPUT_ARCHIVE_FILENAME']), stubdata_dir + '/match_oracle.zip']
+        self.remove_at_cleanup(result_filename, result_filename + '.journal', *archive_filenames)
+        with tarfile.open(archive_filenames[0], 'w:gz') as archive:
+            for name in member_names:
+                archive.add(stubdata_dir + '/' + os.path.basename(name), arcname=name)
+        with zipfile.ZipFile(archive_filenames[1], 'w') as archive:
+            archive.writestr('2017/', '')
+            for name in member_names:
+                archive.write(stubdata_dir + '/' + os.path.basename(name), arcname=name)
+        self.assertEqual(self.match_metadata.get_input_filename(stubdata_dir), archive_filenames[0])
+
+        for input_filename in archive_filenames:
+            for batch_match, prepare_match in [(self.match_metadata.batch_match_to_pub, self.match_metadata.prepare_match_to_pub),
+                                               (self.match_metadata.batch_match_to_arXiv, self.match_metadata.prepare_match_to_arXiv)]:
+                with mock.patch.object(self.match_metadata.ORACLE_UTIL, 'get_matches', side_effect=self.get_not_matched) as mock_get_matches, \
+                        mock.patch.object(self.match_metadata, 'process_pub_metadata', return_value=1):
+                    batch_match(input_filename=input_filename, result_filename=result_filename, rerun_filename=rerun_filename)
+
+                    # the members are matched the same as the files they came from, and are named after the member
+                    self.assertEqual(mock_get_matches.call_count, 3)
+                    for name, call in zip(member_names, mock_get_matches.call_args_list):
+                        prepared = prepare_match(stubdata_dir + '/' + os.path.basename(name))
+                        self.assertEqual(call[0], (prepared['metadata'], prepared['doctype'], prepared['must_match'], prepared['match_doctype']))
+                self.assertEqual(list(MatchJournal(result_filename).get_completed()), member_names)
+
+                os.remove(result_filename)
+                os.remove(result_filename + '.journal')
+
+    def test_prepare_match_to_pub_records(self):
+        """ test that records already parsed are prepared the same as the files they were read from """
+        stubdata_dir = os.path.dirname(__file__) + '/stubdata'
+        filenames = [stubdata_dir + filename for filename in ['/X18-10145.abs', '/X10-50737.abs', '/X11-85081.abs', '/K47-02665.abs']]
+        for filename in filenames:
+            with open(filename, 'rb') as fp:
+                record = get_pub_record(fp.read(), filename)
+            from_record = self.match_metadata.prepare_match_to_pub(filename, record)
+            from_file = self.match_metadata.prepare_match_to_pub(filename)
+            self.assertEqual(from_record, from_file)
+            self.assertEqual(from_record['metadata'].filename, filename)
+
+    def test_prepare_match_to_arXiv_header_only(self):
+        """ test that the file is parsed in full only when journal db says the journal is to be matched """
+        pub_filename = os.path.dirname(__file__) + '/stubdata/K47-02665.abs'
+        with mock.patch('adsdocmatch.match_w_metadata.get_pub_record', wraps=get_pub_record) as mock_get_pub_record:
+            with mock.patch.object(self.match_metadata, 'process_pub_metadata', return_value=0) as mock_process_pub_metadata:
+                prepared = self.match_metadata.prepare_match_to_arXiv(pub_filename)
+                self.assertEqual(prepared['results'], [{'source_bibcode': '2018ApJS..236...24F', 'comment': 'from JournalDB: do not match.'}])
+                self.assertEqual(mock_process_pub_metadata.call_args[0][0].get('bibcode'), '2018ApJS..236...24F')
+            with mock.patch.object(self.match_metadata, 'process_pub_metadata', return_value=-1):
+                prepared = self.match_metadata.prepare_match_to_arXiv(pub_filename)
+                self.assertEqual(prepared['results'][0]['comment'], 'from JournalDB: did not recognize the bibcode.')
+            self.assertEqual(mock_get_pub_record.call_count, 0)
+
+            with mock.patch.object(self.match_metadata, 'process_pub_metadata', return_value=1) as mock_process_pub_metadata:
+                prepared = self.match_metadata.prepare_match_to_arXiv(pub_filename)
+                self.assertEqual(mock_process_pub_metadata.call_count, 1)
+            self.assertEqual(mock_get_pub_record.call_count, 1)
+            with open(pub_filename, 'rb') as fp:
+                self.assertEqual(prepared['metadata'], get_pub_metadata(fp))
+
+    def test_metadata_cache(self):
+        """ test that files read again are not parsed again, and their payloads are the same """
+        stubdata_dir = os.path.dirname(__file__) + '/stubdata'
+        cache_filename = stubdata_dir + '/metadata_cache_test.sqlite'
+        filenames = [stubdata_dir + filename for filename in ['/X18-10145.abs', '/X10-50737.abs', '/K47-02665.abs']]
+        expected = [self.match_metadata.prepare_match_payload(self.match_metadata.prepare_match_to_pub, filename)['payload'] for filename in filenames]
+
+        with mock.patch.dict(match_config, {'DOCMATCHPIPELINE_METADATA_CACHE_FILENAME': cache_filename}):
+            match_metadata = MatchMetadata()
+            for _ in range(2):
+                with mock.patch('adsdocmatch.match_w_metadata.get_pub_record', wraps=get_pub_record) as mock_get_pub_record, \
+                        mock.patch.object(match_metadata.ORACLE_UTIL, 'normalize_author_list', wraps=match_metadata.ORACLE_UTIL.normalize_author_list) as mock_normalize_author_list:
+                    for filename, payload in zip(filenames, expected):
+                        prepared = match_metadata.prepare_match_payload(match_metadata.prepare_match_to_pub, filename)
+                        self.assertEqual(prepared['payload'], payload)
+                        self.assertEqual(prepared['metadata'].filename, filename)
+            # the second time, everything came from the cache
+            self.assertEqual(mock_get_pub_record.call_count, 0)
+            self.assertEqual(mock_normalize_author_list.call_count, 0)
+            self.assertEqual(match_metadata.metadata_cache.get_stats()['hits'], 6)
+
+            # the payload of the other kind of match is cached separately
+            with mock.patch.object(match_metadata, 'process_pub_metadata', return_value=1):
+                prepared = match_metadata.prepare_match_payload(match_metadata.prepare_match_to_arXiv, filenames[2])
+            self.assertEqual(prepared['payload']['doctype'], 'article')
+            self.assertEqual(prepared['payload']['doi'], ['10.3847/1538-4365/aab760'])
+            match_metadata.metadata_cache.close()
+        os.remove(cache_filename)
+
+    def test_batch_match_to_pub_dedup(self):
+        """ test that records listed more than once are sent to oracle once """
+
+        # setup filenames
+        stubdata_dir = os.path.dirname(__file__) + '/stubdata'
+        input_filename = "%s%s" % (stubdata_dir, config['DOCMATCHPIPELINE_INPUT_FILENAME'])
+        result_filename = "%s%s" % (stubdata_dir, config['DOCMATCHPIPELINE_EPRINT_RESULT_FILENAME'])
+        rerun_filename = os.path.abspath(os.path.join(stubdata_dir, config['DOCMATCHPIPELINE_RERUN_FILENAME']))
+        self.remove_at_cleanup(input_filename, result_filename, result_filename + '.journal')
+
+        eprint_filenames = [stubdata_dir + filename for filename in ['/X18-10145.abs', '/X10-50737.abs', '/X18-10145.abs', '/X10-50737.abs', '/X11-85081.abs']]
+        with open(input_filename, "w") as f:
+            for filename in eprint_filenames:
+                f.write("%s\n" % filename)
+            f.close()
+
+        with mock.patch.dict(match_config, {'DOCMATCHPIPELINE_MATCH_DEDUP': 'True'}):
+            with mock.patch.object(self.match_metadata.ORACLE_UTIL, 'get_matches', side_effect=self.get_not_matched) as mock_get_matches:
+                self.match_metadata.batch_match_to_pub(input_filename=input_filename, result_filename=result_filename, rerun_filename=rerun_filename)
+                self.assertEqual(mock_get_matches.call_count, 3)
+
+        # every line of the input gets its results
+        with open(result_filename, "r") as f:
+            lines = f.readlines()[1:]
+            self.assertEqual(len(lines), 5)
+            self.assertEqual(lines[0], lines[2])
+            self.assertEqual(lines[1], lines[3])
+
+    def test_batch_match_to_pub_async(self):
+        """ test that with the asyncio client, results are written in the input order, and duplicates are sent once """
+
+        # setup filenames
+        stubdata_dir = os.path.dirname(__file__) + '/stubdata'
+        input_filename = "%s%s" % (stubdata_dir, config['DOCMATCHPIPELINE_INPUT_FILENAME'])
+        result_filename = "%s%s" % (stubdata_dir, config['DOCMATCHPIPELINE_EPRINT_RESULT_FILENAME'])
+        rerun_filename = os.path.abspath(os.path.join(stubdata_dir, config['DOCMATCHPIPELINE_RERUN_FILENAME']))
+        self.remove_at_cleanup(input_filename, result_filename, result_filename + '.journal')
+
+        eprint_filenames = ['/X18-10145.abs', '/X10-50737.abs', '/X11-85081.abs', '/X18-10145.abs', '/X23-45511.abs', '/X21-91237.abs']
+        with open(input_filename, "w") as f:
+            for filename in eprint_filenames:
+                f.write("%s\n" % (stubdata_dir + filename))
+            f.close()
+
+        expected_bibcodes = []
+        for filename in eprint_filenames:
+            with open(stubdata_dir + filename, 'rb') as arxiv_fp:
+                expected_bibcodes.append(get_pub_metadata(arxiv_fp.read())['bibcode'])
+
+        # the first records listed are answered slowest
+        async def get_matches_async(metadata, doctype, must_match=False, match_doctype=None, payload=None, session=None):
+            bibcode = metadata['bibcode']
+            await asyncio.sleep(0.05 * (len(expected_bibcodes) - expected_bibcodes.index(bibcode)))
+            return self.get_not_matched(metadata, doctype)
+
+        with mock.patch.object(MatchMetadata, 'ORACLE_UTIL', AsyncOracleUtil()), \
+                mock.patch.dict(match_config, {'DOCMATCHPIPELINE_MATCH_WORKERS': '4', 'DOCMATCHPIPELINE_MATCH_RATE_PER_SEC': '0', 'DOCMATCHPIPELINE_MATCH_DEDUP': 'True'}):
+            match_metadata = MatchMetadata()
+            with mock.patch.object(match_metadata.ORACLE_UTIL, 'get_matches_async', side_effect=get_matches_async) as mock_get_matches_async, \
+                    mock.patch.object(match_metadata.ORACLE_UTIL, 'get_matches') as mock_get_matches:
+                match_metadata.batch_match_to_pub(input_filename=input_filename, result_filename=result_filename, rerun_filename=rerun_filename)
+            self.assertEqual(mock_get_matches_async.call_count, 5)
+            mock_get_matches.assert_not_called()
+
+        # make sure output file is written in the order of the input file
+        with open(result_filename, "r") as f:
+            lines = f.readlines()[1:]
+            self.assertEqual(len(lines), len(expected_bibcodes))
+            for bibcode, line in zip(expected_bibcodes, lines):
+                self.assertTrue(line.startswith('"=HYPERLINK(""https://ui.adsabs.harvard.edu/abs/%s/abstract""' % bibcode))
+        with open(result_filename + '.journal', "r") as f:
+            self.assertEqual(len(f.readlines()), len(expected_bibcodes))
+
+    def test_batch_match_to_pub_resume(self):
+        """ test that resuming a batch run skips the records already in the journal """
+
+        # setup filenames
+        stubdata_dir = os.path.dirname(__file__) + '/stubdata'
+        input_filename = "%s%s" % (stubdata_dir, config['DOCMATCHPIPELINE_INPUT_FILENAME'])
+        result_filename = "%s%s" % (stubdata_dir, config['DOCMATCHPIPELINE_EPRINT_RESULT_FILENAME'])
+        rerun_filename = os.path.abspath(os.path.join(stubdata_dir, config['DOCMATCHPIPELINE_RERUN_FILENAME']))
+        self.remove_at_cleanup(input_filename, result_filename, result_filename + '.journal')
+
+        eprint_filenames = [stubdata_dir + filename for filename in ['/X18-10145.abs', '/X10-50737.abs', '/X11-85081.abs']]
+        with open(input_filename, "w") as f:
+            for filename in eprint_filenames:
+                f.write("%s\n" % filename)
+            f.close()
+
+        # the run before was interrupted after the first record
+        with open(result_filename + '.journal', "w") as f:
+            f.write("%s\tmatched\n" % eprint_filenames[0])
+            f.write("%s" % eprint_filenames[1])
+
+        with mock.patch.object(self.match_metadata.ORACLE_UTIL, 'get_matches', side_effect=self.get_not_matched) as mock_get_matches:
+            self.match_metadata.batch_match_to_pub(input_filename=input_filename, result_filename=result_filename, rerun_filename=rerun_filename, resume=True)
+            self.assertEqual(mock_get_matches.call_count, 2)
+
+        with open(result_filename + '.journal', "r") as f:
+            self.assertEqual([line.split('\t')[0] for line in f.readlines()[1:]], eprint_filenames[1:])
+        with open(result_filename, "r") as f:
+            self.assertEqual(len(f.readlines()), 3)
+
+        # resume once more, nothing left to do
+        with mock.patch.object(self.match_metadata.ORACLE_UTIL, 'get_matches', side_effect=self.get_not_matched) as mock_get_matches:
+            self.match_metadata.batch_match_to_pub(input_filename=input_filename, result_filename=result_filename, rerun_filename=rerun_filename, resume=True)
+            self.assertEqual(mock_get_matches.call_count, 0)
+
+        # without resume, all records are processed again and the journal starts over
+        with mock.patch.object(self.match_metadata.ORACLE_UTIL, 'get_matches', side_effect=self.get_not_matched) as mock_get_matches:
+            self.match_metadata.batch_match_to_pub(input_filename=input_filename, result_filename=result_filename, rerun_filename=rerun_filename)
+            self.assertEqual(mock_get_matches.call_count, 3)
+        with open(result_filename + '.journal', "r") as f:
+            self.assertEqual(len(f.readlines()), 3)
 
     def test_output_combine_classic_docmatch_results_eprint(self):
         """ test combining classic matches with docmatching matches for eprint """
@@ -449,6 +778,7 @@ class TestDocMatch(unittest.TestCase):
         # remove temp files
         os.remove(result_filename)
         os.remove("%s%s" % (stubdata_dir, config['DOCMATCHPIPELINE_PUB_RESULT_FILENAME']))
+        os.remove("%s%s%s" % (stubdata_dir, config['DOCMATCHPIPELINE_PUB_RESULT_FILENAME'], '.journal'))
         os.remove(input_filename)
 
     def test_process_match_to_arXiv_with_classic_output(self):
@@ -493,6 +823,7 @@ class TestDocMatch(unittest.TestCase):
         # remove temp files
         os.remove(result_filename)
         os.remove("%s%s" % (stubdata_dir, config['DOCMATCHPIPELINE_PUB_RESULT_FILENAME']))
+        os.remove("%s%s%s" % (stubdata_dir, config['DOCMATCHPIPELINE_PUB_RESULT_FILENAME'], '.journal'))
         os.remove(classic_matched_filename)
         os.remove(input_filename)
 
@@ -535,6 +866,7 @@ class TestDocMatch(unittest.TestCase):
         # remove temp files
         os.remove(result_filename)
         os.remove("%s%s" % (stubdata_dir, config['DOCMATCHPIPELINE_EPRINT_RESULT_FILENAME']))
+        os.remove("%s%s%s" % (stubdata_dir, config['DOCMATCHPIPELINE_EPRINT_RESULT_FILENAME'], '.journal'))
         os.remove(input_filename)
 
     def test_process_match_to_pub_with_classic_output(self):
@@ -585,6 +917,7 @@ class TestDocMatch(unittest.TestCase):
         # remove temp files
         os.remove(result_filename)
         os.remove("%s%s" % (stubdata_dir, config['DOCMATCHPIPELINE_EPRINT_RESULT_FILENAME']))
+        os.remove("%s%s%s" % (stubdata_dir, config['DOCMATCHPIPELINE_EPRINT_RESULT_FILENAME'], '.journal'))
         os.remove(classic_matched_filename)
         os.remove(input_filename)
 
@@ -614,21 +947,23 @@ class TestDocMatch(unittest.TestCase):
             for meta, expected in zip(metadata, expected_results):
                 self.assertEqual(self.match_metadata.process_pub_metadata(meta), expected)
 
-    def test_write_results(self):
+    def test_result_sink_rerun(self):
         """ test writing filenames to rerun files """
         stubdata_dir = os.path.dirname(__file__) + '/stubdata'
         result_filename = "%s%s" % (stubdata_dir, config['DOCMATCHPIPELINE_EPRINT_RESULT_FILENAME'])
         rerun_filename = os.path.abspath(os.path.join(stubdata_dir, config['DOCMATCHPIPELINE_RERUN_FILENAME']))
         eprint_filename = "%s%s"% (stubdata_dir, '/X21-91237.abs')
-        matches = self.match_metadata.process_results([{
+        results = [{
             'source_bibcode': '2023arXiv230503053S',
-            'status_flaw' : "got 502 for the last failed attempt -- shall be added to rerun list."}], '\t')
+            'status_flaw' : "got 502 for the last failed attempt -- shall be added to rerun list."}]
         expected_results = [
             "source bibcode (link),verified bibcode,matched bibcode (link),label,confidence,matched scores,comment",
             "['2023arXiv230503053S  status_flaw=got 502 for the last failed attempt -- shall be added to rerun list.']"
         ]
         expected_rerun = [eprint_filename]
-        self.match_metadata.write_results(result_filename, matches, eprint_filename, rerun_filename)
+        with mock.patch.dict(match_config, {'DOCMATCHPIPELINE_RESULT_FORMAT': 'csv'}):
+            with self.match_metadata.get_result_sink(result_filename, rerun_filename) as result_sink:
+                result_sink.write(eprint_filename, results, self.match_metadata.get_match_outcome(results))
 
         # also generate error for journalDB and see that it does not get logged
         with mock.patch.object(self.match_metadata.ORACLE_UTIL, 'get_matches', return_value=[]):
@@ -640,11 +975,9 @@ class TestDocMatch(unittest.TestCase):
 
         # verify content of files
         with open(result_filename, "r") as f:
-            for expected_line, actual_line in zip(expected_results, f.readlines()):
-                self.assertEqual(expected_line, actual_line[:-1])
+            self.assertEqual([line[:-1] for line in f.readlines()], expected_results)
         with open(rerun_filename, "r") as f:
-            for expected_line, actual_line in zip(expected_rerun, f.readlines()):
-                self.assertEqual(expected_line, actual_line[:-1])
+            self.assertEqual([line[:-1] for line in f.readlines()], expected_rerun)
 
         os.remove(result_filename)
         os.remove(rerun_filename)
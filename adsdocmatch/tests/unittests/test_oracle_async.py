@@ -0,0 +1,210 @@
+import sys, os
+project_home = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../../'))
+if project_home not in sys.path:
+    sys.path.insert(0, project_home)
+
+import unittest
+import asyncio
+import json
+import mock
+
+from adsdocmatch.oracle_async import AsyncOracleUtil, get_oracle_util
+from adsdocmatch.oracle_util import OracleUtil, QueryPageException, config as oracle_config
+
+
+class FakeResponse():
+    """ stands in for aiohttp ClientResponse """
+
+    def __init__(self, status, text):
+        self.status = status
+        self._text = text
+
+    async def text(self):
+        return self._text
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+
+class FakeSession():
+    """ stands in for aiohttp ClientSession, answers with the given responses in order """
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = []
+        self.timeouts = []
+
+    def request(self, method, url, headers=None, data=None, timeout=None):
+        self.calls.append((method, url, data))
+        self.timeouts.append(timeout.total)
+        return self.responses.pop(0)
+
+
+class TestOracleAsync(unittest.TestCase):
+
+    def setUp(self):
+        self.oracle_util = AsyncOracleUtil()
+        self.oracle_util.set_local_config_test()
+        self.metadata = {
+            'bibcode': '2018arXiv180101021F',
+            'title': 'The Unified Astronomy Thesaurus: Semantic Metadata for Astronomy and\n  Astrophysics',
+            'authors': 'Frey, Katie; Accomazzi, Alberto',
+            'pubdate': '2018-01-03',
+            'abstract': 'Several different controlled vocabularies have been developed and used by the\nastronomical community.',
+            'doi': '10.3847/1538-4365/aab760'
+        }
+
+    def tearDown(self):
+        pass
+
+    def test_get_matches_async(self):
+        """ test that the async client agrees with get_matches """
+
+        returned_value = {
+            'match': [{'source_bibcode': '2018arXiv180101021F',
+                       'matched_bibcode': '2018ApJS..236...24F',
+                       'confidence': 0.9957643,
+                       'matched': 1,
+                       'scores': {'abstract': 0.98, 'title': 0.98, 'author': 1, 'year': 1, 'doi': 1}
+            }]
+        }
+        expected_value = [{
+            'source_bibcode': '2018arXiv180101021F',
+            'matched_bibcode': '2018ApJS..236...24F',
+            'label': 'Match',
+            'confidence': 0.9957643,
+            'score': {'abstract': 0.98, 'title': 0.98, 'author': 1, 'year': 1, 'doi': 1},
+            'comment': ''
+        }]
+
+        session = FakeSession([FakeResponse(200, json.dumps(returned_value))])
+        results = asyncio.run(self.oracle_util.get_matches_async(self.metadata, 'eprint', session=session))
+        self.assertEqual(results, expected_value)
+        self.assertTrue(session.calls[0][1].endswith('/docmatch_add'))
+        self.assertEqual(json.loads(session.calls[0][2]), self.oracle_util.make_match_payload(self.metadata, 'eprint'))
+
+        with mock.patch('requests.Session.post') as mock_oracle_util:
+            mock_oracle_util.return_value = mock_response = mock.Mock()
+            mock_response.status_code = 200
+            mock_response.text = json.dumps(returned_value)
+            self.assertEqual(self.oracle_util.get_matches(self.metadata, 'eprint'), results)
+
+        # sent with the timeout of the endpoint, and counted with the calls of the blocking transport
+        transport = self.oracle_util.transport
+        calls = transport.get_counters().get('add', {}).get('calls', 0)
+        session = FakeSession([FakeResponse(200, json.dumps({"status": "updated db with new data successfully"}))])
+        with mock.patch.dict(transport.timeouts, {'add': 600}):
+            asyncio.run(self.oracle_util.add_to_db_async([['2021arXiv210312030S', '2021CSF...15311505S', 1.3]], session=session))
+        self.assertEqual(session.timeouts, [600])
+        self.assertEqual(transport.get_counters()['add']['calls'], calls + 1)
+
+        # when oracle fails
+        session = FakeSession([FakeResponse(502, '')])
+        results = asyncio.run(self.oracle_util.get_matches_async(self.metadata, 'eprint', session=session))
+        self.assertEqual(results, [{'source_bibcode': '2018arXiv180101021F',
+                                    'comment': 'Oracle service failure.',
+                                    'status_flaw': 'got 502 for the last failed attempt -- shall be added to rerun list.'}])
+
+        # when metadata is missing a field, no request is sent
+        session = FakeSession([])
+        results = asyncio.run(self.oracle_util.get_matches_async({'bibcode': '2018arXiv180101021F'}, 'eprint', session=session))
+        self.assertEqual(results[0]['status_flaw'], 'did not send request to oracle service')
+        self.assertEqual(session.calls, [])
+
+    def test_add_to_db_async(self):
+        """ test adding matches to oracle asynchronously """
+
+        session = FakeSession([FakeResponse(200, json.dumps({"status": "updated db with new data successfully"}))])
+        matches = [['2021arXiv210312030S', '2021CSF...15311505S', 1.3], ['2017arXiv171111082H', '2018SAIS..51...46H', 1.3]]
+        status = asyncio.run(self.oracle_util.add_to_db_async(matches, session=session))
+        self.assertEqual(status, 'Added 2 records to database.')
+        self.assertEqual(session.calls[0][0], 'put')
+
+        session = FakeSession([FakeResponse(400, json.dumps({'error': 'no data received'}))])
+        status = asyncio.run(self.oracle_util.add_to_db_async(matches, session=session))
+        self.assertEqual(status, 'Stopped...')
+
+        # one at a time, the one that fails does not stop the others
+        session = FakeSession([FakeResponse(400, ''), FakeResponse(200, json.dumps({"status": "updated db with new data successfully"}))])
+        status = asyncio.run(self.oracle_util.add_each_to_db_async(matches, max_concurrency=1, session=session))
+        self.assertEqual(status, ['Stopped...', 'Added 1 records to database.'])
+        self.assertEqual([json.loads(call[2])[0]['source_bibcode'] for call in session.calls], ['2021arXiv210312030S', '2017arXiv171111082H'])
+
+    def test_get_oracle_util(self):
+        """ test that the asyncio client is used only when turned on in config """
+
+        with mock.patch.dict(oracle_config, {'DOCMATCHPIPELINE_ORACLE_ASYNC': 'False'}):
+            self.assertEqual(type(get_oracle_util()), OracleUtil)
+        with mock.patch.dict(oracle_config, {'DOCMATCHPIPELINE_ORACLE_ASYNC': 'True'}):
+            oracle_util = get_oracle_util()
+            self.assertEqual(type(oracle_util), AsyncOracleUtil)
+
+        # the blocking calls go through the asyncio ones
+        async def add_to_db_async(matches, session=None):
+            return 'Added %d records to database.' % len(matches)
+        async def query_async(output_filename, days=None):
+            return 'Got 0 records from db.'
+        with mock.patch.object(oracle_util, 'add_to_db_async', side_effect=add_to_db_async):
+            self.assertEqual(oracle_util.add_to_db([['a', 'b', 1]]), 'Added 1 records to database.')
+            self.assertEqual(oracle_util.add_each_to_db([['a', 'b', 1], ['c', 'd', 1]]), ['Added 1 records to database.'] * 2)
+        with mock.patch.object(oracle_util, 'query_async', side_effect=query_async) as mock_query_async:
+            self.assertEqual(oracle_util.query('output.txt', 3), 'Got 0 records from db.')
+            mock_query_async.assert_called_once_with('output.txt', 3)
+
+    def test_query_async(self):
+        """ test paging through query asynchronously """
+
+        tmp_output_filename = os.path.dirname(__file__) + '/stubdata/query_async_output.txt'
+        pages = [
+            {"params": {"start": 0, "rows": 2}, "results": [["2015arXiv150504001F", "2015PhRvD..92c3003F", 1.3],
+                                                           ["2019arXiv190610914P", "2020JPCM...32c5601P", 1.3]]},
+            {"params": {"start": 2, "rows": 2}, "results": [["2020arXiv200608648C", "2021JHEP...04..033C", 1.3]]},
+            {"params": {"start": 4, "rows": 0}, "results": []},
+        ]
+        session = FakeSession([FakeResponse(200, json.dumps(page)) for page in pages])
+        status = asyncio.run(self.oracle_util.query_async(tmp_output_filename, session=session))
+        self.assertEqual(status, 'Got 3 records from db.')
+        with open(tmp_output_filename, 'r') as f:
+            self.assertEqual(len(f.readlines()), 3)
+        os.remove(tmp_output_filename)
+
+
+    def test_query_async_retry_and_resume(self):
+        """ test that a page with a non-200 status is attempted again, and that a failed query keeps the previous output and resumes """
+
+        tmp_output_filename = os.path.dirname(__file__) + '/stubdata/query_async_retry_output.txt'
+        with open(tmp_output_filename, 'w') as f:
+            f.write('previous dump\n')
+        pages = [
+            {"params": {"start": 0, "rows": 2}, "results": [["2015arXiv150504001F", "2015PhRvD..92c3003F", 1.3],
+                                                           ["2019arXiv190610914P", "2020JPCM...32c5601P", 1.3]]},
+            {"params": {"start": 2, "rows": 2}, "results": [["2020arXiv200608648C", "2021JHEP...04..033C", 1.3]]},
+            {"params": {"start": 4, "rows": 0}, "results": []},
+        ]
+        with mock.patch.dict(oracle_config, {'DOCMATCHPIPELINE_API_ORACLE_SERVICE_ATTEMPTS': '2'}):
+            # the second page fails on both attempts
+            session = FakeSession([FakeResponse(200, json.dumps(pages[0])), FakeResponse(502, ''), FakeResponse(504, '')])
+            with self.assertRaises(QueryPageException):
+                asyncio.run(self.oracle_util.query_async(tmp_output_filename, session=session))
+            with open(tmp_output_filename, 'r') as f:
+                self.assertEqual(f.read(), 'previous dump\n')
+            self.assertTrue(os.path.exists(tmp_output_filename + '.part'))
+            self.assertTrue(os.path.exists(tmp_output_filename + '.state'))
+
+            # resumes from the second page, which now succeeds on the second attempt
+            session = FakeSession([FakeResponse(502, ''), FakeResponse(200, json.dumps(pages[1])), FakeResponse(200, json.dumps(pages[2]))])
+            status = asyncio.run(self.oracle_util.query_async(tmp_output_filename, session=session))
+        self.assertEqual(status, 'Got 3 records from db.')
+        self.assertEqual([json.loads(call[2])['start'] for call in session.calls], [2, 2, 4])
+        with open(tmp_output_filename, 'r') as f:
+            self.assertEqual(len(f.readlines()), 3)
+        self.assertFalse(os.path.exists(tmp_output_filename + '.part'))
+        self.assertFalse(os.path.exists(tmp_output_filename + '.state'))
+        os.remove(tmp_output_filename)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,10 +7,17 @@ import unittest
 import mock
 import json
 import requests
+import time
+import threading
+from datetime import date
 
 from adsputils import load_config
 from adsdocmatch.match_w_metadata import MatchMetadata
 from adsdocmatch.pub_parser import get_pub_metadata
+from adsdocmatch.batch_util import ConcurrencyController
+from adsdocmatch.cache_util import LRUCache
+from adsdocmatch.oracle_util import OracleUtil, AuthorBudgetExceeded, AuthorListTooLong, QueryPageException, config as oracle_config
+from adsdocmatch.oracle_transport import OracleTransport
 
 config = load_config(proj_home=project_home)
 
@@ -69,6 +76,115 @@ class TestDocMatch(unittest.TestCase):
         for authors_raw, authors_normalized in authors.items():
             self.assertEqual(self.match_metadata.ORACLE_UTIL.normalize_author_list(authors_raw), authors_normalized)
 
+    def test_normalize_author_list_cache(self):
+        """ test that author lists seen before are taken from the cache, with the same result """
+        oracle_util = self.match_metadata.ORACLE_UTIL
+        authors = ['the ALICE Collaboration; Lijiao, Liu', 'K. Frey, A. Accomazzi', 'Proxauf; Tang; Frey']
+        expected = [oracle_util.parse_author_list(author_string) for author_string in authors]
+        with mock.patch.object(OracleUtil, 'author_cache', LRUCache(2)):
+            with mock.patch.object(oracle_util, 'parse_author_list', wraps=oracle_util.parse_author_list) as mock_parse_author_list:
+                for _ in range(3):
+                    self.assertEqual([oracle_util.normalize_author_list(author_string) for author_string in authors[:2]], expected[:2])
+                self.assertEqual(mock_parse_author_list.call_count, 2)
+                # past the size, the least recently used is parsed again
+                self.assertEqual(oracle_util.normalize_author_list(authors[2]), expected[2])
+                self.assertEqual(oracle_util.normalize_author_list(authors[0]), expected[0])
+                self.assertEqual(mock_parse_author_list.call_count, 4)
+            self.assertEqual(OracleUtil.author_cache.get_stats()['hits'], 4)
+
+    def test_get_author_pattern(self):
+        """ test that the pattern is picked from the number of words each pattern matched from the beginning """
+        oracle_util = self.match_metadata.ORACLE_UTIL
+        self.assertEqual(oracle_util.get_author_pattern('Frey, K., Accomazzi, A.'), oracle_util.TRAILING_INIT_PAT)
+        self.assertEqual(oracle_util.get_author_pattern('K. Frey, A. Accomazzi'), oracle_util.LEADING_INIT_PAT)
+        pattern, matches = oracle_util.match_author_pattern('Frey, Katie, Accomazzi, Alberto')
+        self.assertEqual(pattern, oracle_util.TRAILING_FULL_PAT)
+        self.assertEqual([match.group('last') for match in matches], ['Frey', 'Accomazzi'])
+        self.assertEqual(oracle_util.match_author_pattern('Proxauf; Tang; Frey'), (None, None))
+
+        self.assertEqual(oracle_util.pick_author_pattern([0, 0, 0, 0]), None)
+        self.assertEqual(oracle_util.pick_author_pattern([4, 0, 2, 0]), 0)
+        # tie between the two full name patterns, last-first is picked
+        self.assertEqual(oracle_util.pick_author_pattern([0, 0, 4, 4]), 2)
+        # tie with one more pattern matching less, the first one matching is picked
+        self.assertEqual(oracle_util.pick_author_pattern([0, 4, 1, 4]), 1)
+
+    def test_normalize_author_list_budget(self):
+        """ test that author lists the patterns backtrack on are given up on in time, keeping the last names """
+        oracle_util = self.match_metadata.ORACLE_UTIL
+        self.assertEqual(oracle_util.get_authors_last_attempt('Frey, Accomazzi  & Tang'), 'Frey, Accomazzi  & Tang')
+
+        # the patterns taking quadratic time on these are interrupted, on the main thread, and on a thread of a batch run,
+        # where the lists too long to be parsed there are sent to a worker process
+        # and AND_HOOK backtracks exponentially on the last one
+        pathological = ['Smith ' * 3000, ' '.join(['Ab-Cd'] * 3000) + ' collaborationx', 'A-' * 4000, 'Smith ' * 12000,
+                        'A ' + ' '.join(['Smith'] * 30) + ' x & Jones']
+        long_list = '; '.join(['Frey, K. M.', 'Accomazzi, A.'] * 100)
+        # AND_HOOK matches this one, that has more than AND_HOOK_MAX_WORDS words
+        and_list = 'Tang, & Kurtz, A. Frey, van der Berg, A. Smith Smith, Accomazzi A., Smith, A.'
+        with self.assertRaises(AuthorListTooLong):
+            oracle_util.get_authors_last_attempt(and_list, max_words=300)
+        with mock.patch.object(OracleUtil, 'author_cache', LRUCache(0)), mock.patch.object(OracleUtil, 'author_budget_sec', 0.2), \
+                mock.patch.object(OracleUtil, 'author_thread_max_words', 300), mock.patch.object(OracleUtil, '_author_executor', None):
+            for author_string in pathological:
+                start_time = time.monotonic()
+                authors = oracle_util.normalize_author_list(author_string)
+                self.assertLess(time.monotonic() - start_time, 1)
+                self.assertEqual(authors, oracle_util.get_last_names(author_string) or author_string)
+
+            results = []
+            thread = threading.Thread(target=lambda: results.extend(oracle_util.normalize_author_list(author_string) for author_string in pathological + [long_list, and_list]), daemon=True)
+            thread.start()
+            start_time = time.monotonic()
+            thread.join(10)
+            self.assertLess(time.monotonic() - start_time, 5)
+            self.assertEqual(len(results), len(pathological) + 2)
+            for author_string, authors in zip(pathological, results):
+                self.assertEqual(authors, oracle_util.get_last_names(author_string) or author_string)
+            # the lists that are parsed in time get the same result as on the main thread
+            self.assertEqual(results[-2:], [oracle_util.normalize_author_list(long_list), oracle_util.normalize_author_list(and_list)])
+            self.assertEqual(results[-2], '; '.join(['Frey, K', 'Accomazzi, A'] * 100))
+            self.assertEqual(results[-1], 'Tang, & Kurtz')
+
+            # and the author lists that are not are parsed as before
+            self.assertEqual(oracle_util.normalize_author_list('K. Frey, A. Accomazzi'), 'Frey, K; Accomazzi, A')
+            oracle_util.shutdown_author_executor()
+            self.assertIsNone(OracleUtil._author_executor)
+
+        # the budget is also checked between the steps
+        with self.assertRaises(AuthorBudgetExceeded):
+            oracle_util.parse_author_list('K. Frey, A. Accomazzi', deadline=time.monotonic() - 1)
+        self.assertEqual(oracle_util.parse_author_list('K. Frey, A. Accomazzi', deadline=oracle_util.get_author_deadline(1)), 'Frey, K; Accomazzi, A')
+        self.assertIsNone(oracle_util.get_author_deadline(0))
+
+    def test_make_match_payload_max_authors(self):
+        """ test that for large collaborations only the collaboration and the first authors are sent, with the number of authors """
+        oracle_util = self.match_metadata.ORACLE_UTIL
+        authors = '; '.join(['Frey, Katie', 'Accomazzi, Alberto', 'Kurtz, Michael J', 'Tang, Xiaomin', 'the ALICE Collaboration'])
+        metadata = {'title': 'title', 'authors': authors, 'pubdate': '2023-05-00', 'bibcode': '2023arXiv230503053S'}
+
+        self.assertEqual(oracle_util.truncate_author_list(authors, 2), ('Frey, Katie; Accomazzi, Alberto; the ALICE Collaboration', 4))
+        self.assertEqual(oracle_util.truncate_author_list('Frey, Katie;; Tang, Xiaomin;', 2), ('Frey, Katie; Tang, Xiaomin', 2))
+
+        with mock.patch.object(OracleUtil, 'max_authors', 2):
+            payload = oracle_util.make_match_payload(metadata, 'eprint')
+            self.assertEqual(payload['author'], 'the ALICE Collaboration; Frey, K; Accomazzi, A')
+            self.assertEqual(payload['author_count'], 4)
+            # only the authors that are normalized are parsed
+            with mock.patch.object(oracle_util, 'normalize_author_list', wraps=oracle_util.normalize_author_list) as mock_normalize:
+                oracle_util.make_match_payload(metadata, 'eprint')
+                mock_normalize.assert_called_once_with('Frey, Katie; Accomazzi, Alberto; the ALICE Collaboration')
+            # taken as is from the cache
+            self.assertEqual(oracle_util.make_match_payload(metadata, 'eprint', derived={'author': 'Frey, K', 'author_count': 4, 'doi': None}),
+                             dict(payload, author='Frey, K'))
+
+        # with fewer authors, or the mode turned off, all the authors are sent
+        for max_authors in [4, 0]:
+            with mock.patch.object(OracleUtil, 'max_authors', max_authors):
+                payload = oracle_util.make_match_payload(metadata, 'eprint')
+                self.assertEqual(payload['author'], 'the ALICE Collaboration; Frey, K; Accomazzi, A; Kurtz, M; Tang, X')
+                self.assertNotIn('author_count', payload)
+
     def test_extract_doi(self):
         """ """
         eprint_filenames = ['X18-10145.abs', 'X10-50737.abs', 'X11-85081.abs', 'X23-45511.abs']
@@ -126,7 +242,7 @@ class TestDocMatch(unittest.TestCase):
             ['2021arXiv210607251P', '2020PhDT........36P', '-1']
         ]
 
-        with mock.patch('requests.get', side_effect=return_values):
+        with mock.patch('requests.Session.get', side_effect=return_values):
             results = self.match_metadata.ORACLE_UTIL.read_google_sheet(match_w_pub_filename)
             self.assertEqual(results, expected)
 
@@ -144,7 +260,7 @@ class TestDocMatch(unittest.TestCase):
             ['2022arXiv220306611J', '2022Quant...6..669J', '1.3'],
             ['2020arXiv201206687J', '2022Quant...6..669J', '-1']
         ]
-        with mock.patch('requests.get', side_effect=return_values):
+        with mock.patch('requests.Session.get', side_effect=return_values):
             results = self.match_metadata.ORACLE_UTIL.read_google_sheet(match_w_eprint_filename)
             self.assertEqual(results, expected)
 
@@ -188,7 +304,7 @@ class TestDocMatch(unittest.TestCase):
             {'source_bibcode': '2023arXiv230110072K', 'matched_bibcode': '2021OExpr..2923736K', 'confidence': '1.3'},
             {'source_bibcode': '2021arXiv210607251P', 'matched_bibcode': '2020PhDT........36P', 'confidence': '-1'}
         ]
-        with mock.patch('requests.get', side_effect=return_values):
+        with mock.patch('requests.Session.get', side_effect=return_values):
             results = self.match_metadata.ORACLE_UTIL.make_params(self.match_metadata.ORACLE_UTIL.read_google_sheet(match_w_pub_filename))
             self.assertEqual(results, expected)
 
@@ -205,7 +321,7 @@ class TestDocMatch(unittest.TestCase):
             {'source_bibcode': '2022arXiv220306611J', 'matched_bibcode': '2022Quant...6..669J', 'confidence': '1.3'},
             {'source_bibcode': '2020arXiv201206687J', 'matched_bibcode': '2022Quant...6..669J', 'confidence': '-1'}
         ]
-        with mock.patch('requests.get', side_effect=return_values):
+        with mock.patch('requests.Session.get', side_effect=return_values):
             results = self.match_metadata.ORACLE_UTIL.make_params(self.match_metadata.ORACLE_UTIL.read_google_sheet(match_w_eprint_filename))
             self.assertEqual(results, expected)
 
@@ -213,7 +329,7 @@ class TestDocMatch(unittest.TestCase):
         """ test add_to_db function of OracleUtil """
 
         # test when data is added in
-        with mock.patch('requests.put') as oracle_util:
+        with mock.patch('requests.Session.put') as oracle_util:
             oracle_util.return_value = mock_response = mock.Mock()
             mock_response.status_code = 200
             mock_response.text = json.dumps({"status": "updated db with new data successfully"})
@@ -223,7 +339,7 @@ class TestDocMatch(unittest.TestCase):
             self.assertEqual(status, 'Added 28 records to database.')
 
         # test when data is failed to get added in
-        with mock.patch('requests.put') as oracle_util:
+        with mock.patch('requests.Session.put') as oracle_util:
             oracle_util.return_value = mock_response = mock.Mock()
             mock_response.status_code = 400
             mock_response.text = json.dumps({'error': 'no data received'})
@@ -266,7 +382,7 @@ class TestDocMatch(unittest.TestCase):
             'comment': ''
         }]
 
-        with mock.patch('requests.post') as mock_oracle_util:
+        with mock.patch('requests.Session.post') as mock_oracle_util:
             mock_oracle_util.return_value = mock_response = mock.Mock()
             mock_response.status_code = 200
             mock_response.text = json.dumps(returned_value)
@@ -305,7 +421,7 @@ class TestDocMatch(unittest.TestCase):
             'status_flaw': 'got 502 for the last failed attempt -- shall be added to rerun list.'
         }]
 
-        with mock.patch('requests.post') as mock_oracle_util:
+        with mock.patch('requests.Session.post') as mock_oracle_util:
             mock_oracle_util.return_value = mock_response = mock.Mock()
             mock_response.status_code = 502
             mock_response.text = json.dumps(returned_value)
@@ -313,6 +429,84 @@ class TestDocMatch(unittest.TestCase):
             results = self.match_metadata.ORACLE_UTIL.get_matches(metadata, doctype='eprint')
             self.assertEqual(results, expected_value)
 
+    def test_get_matches_concurrency_controller(self):
+        """ test that get_matches reports gateway errors to the shared concurrency controller """
+
+        metadata = {
+            'bibcode': '2018arXiv180101021F',
+            'title': 'The Unified Astronomy Thesaurus: Semantic Metadata for Astronomy and Astrophysics',
+            'authors': 'Frey, Katie; Accomazzi, Alberto',
+            'pubdate': '2018-01-03',
+            'abstract': 'Several different controlled vocabularies have been developed and used by the astronomical community.',
+        }
+
+        controller = ConcurrencyController(initial=4, minimum=1, maximum=4, latency_threshold=10)
+        self.match_metadata.ORACLE_UTIL.concurrency_controller = controller
+        try:
+            with mock.patch('requests.Session.post') as mock_oracle_util:
+                mock_oracle_util.return_value = mock_response = mock.Mock()
+                mock_response.status_code = 502
+                mock_response.text = ''
+
+                results = self.match_metadata.ORACLE_UTIL.get_matches(metadata, doctype='eprint')
+                self.assertEqual(results[0]['comment'], 'Oracle service failure.')
+        finally:
+            self.match_metadata.ORACLE_UTIL.concurrency_controller = None
+
+        self.assertEqual(controller.get_stats(), {'limit': 2, 'responses': 1, 'errors': 1})
+        self.assertEqual(controller.in_flight, 0)
+
+    def test_get_matches_cache(self):
+        """ test that successful oracle responses are cached, and that the cache can be bypassed """
+
+        metadata = {
+            'bibcode': '2018arXiv180101021F',
+            'title': 'The Unified Astronomy Thesaurus: Semantic Metadata for Astronomy and Astrophysics',
+            'authors': 'Frey, Katie; Accomazzi, Alberto',
+            'pubdate': '2018-01-03',
+            'abstract': 'Several different controlled vocabularies have been developed and used by the astronomical community.',
+        }
+        returned_value = {
+            'match': [{'source_bibcode': '2018arXiv180101021F', 'matched_bibcode': '2018ApJS..236...24F', 'confidence': 0.9957643, 'matched': 1,
+                       'scores': {'abstract': 0.98, 'title': 0.98, 'author': 1, 'year': 1}}]
+        }
+        cache_filename = os.path.dirname(__file__) + '/stubdata/oracle_cache_test.sqlite'
+
+        with mock.patch.dict(oracle_config, {'DOCMATCHPIPELINE_ORACLE_CACHE_FILENAME': cache_filename}), \
+                mock.patch.object(OracleUtil, '_match_cache', None):
+            oracle_util = OracleUtil()
+            with mock.patch('requests.Session.post') as mock_oracle_util:
+                mock_oracle_util.return_value = mock_response = mock.Mock()
+                # failures are not cached
+                mock_response.status_code = 502
+                oracle_util.get_matches(metadata, doctype='eprint')
+                mock_response.status_code = 200
+                mock_response.text = json.dumps(returned_value)
+                results = oracle_util.get_matches(metadata, doctype='eprint')
+                self.assertEqual(mock_oracle_util.call_count, 2)
+
+                # the same request again is answered from the cache
+                self.assertEqual(oracle_util.get_matches(metadata, doctype='eprint'), results)
+                self.assertEqual(mock_oracle_util.call_count, 2)
+
+                # a different payload is not
+                oracle_util.get_matches(metadata, doctype='article')
+                self.assertEqual(mock_oracle_util.call_count, 3)
+
+                # when bypassed, the request is sent
+                with mock.patch.object(oracle_util, 'match_cache_bypass', True):
+                    oracle_util.get_matches(metadata, doctype='eprint')
+                self.assertEqual(mock_oracle_util.call_count, 4)
+
+            self.assertEqual(oracle_util.match_cache.get_stats(), {'hits': 1, 'misses': 3, 'writes': 3, 'evictions': 0, 'entries': 2})
+            # the cache is shared by all the instances
+            self.assertIs(OracleUtil().match_cache, oracle_util.match_cache)
+            oracle_util.match_cache.close()
+
+        for extension in ['', '-wal', '-shm']:
+            if os.path.exists(cache_filename + extension):
+                os.remove(cache_filename + extension)
+
     def test_get_matches_3(self):
         """ if got an error from oracle """
 
@@ -343,7 +537,7 @@ class TestDocMatch(unittest.TestCase):
             'comment': 'Oracle service failure.',
             'status_flaw': 'got 400 for the last failed attempt -- shall be added to rerun list.'
         }]
-        with mock.patch('requests.post') as mock_oracle_util:
+        with mock.patch('requests.Session.post') as mock_oracle_util:
             mock_oracle_util.return_value = mock_response = mock.Mock()
             mock_response.status_code = 400
             mock_response.text = json.dumps(returned_value)
@@ -424,7 +618,7 @@ class TestDocMatch(unittest.TestCase):
             }
         ]
 
-        with mock.patch('requests.post') as mock_oracle_util:
+        with mock.patch('requests.Session.post') as mock_oracle_util:
             mock_oracle_util.return_value = mock_response = mock.Mock()
             mock_response.status_code = 200
             mock_response.text = json.dumps(returned_value)
@@ -459,7 +653,7 @@ class TestDocMatch(unittest.TestCase):
             'score': '',
             'comment': 'No matches with Abstract, trying Title. No document was found in solr matching the request.'
         }]
-        with mock.patch('requests.post') as mock_oracle_util:
+        with mock.patch('requests.Session.post') as mock_oracle_util:
             mock_oracle_util.return_value = mock_response = mock.Mock()
             mock_response.status_code = 200
             mock_response.text = json.dumps(returned_value)
@@ -488,7 +682,7 @@ class TestDocMatch(unittest.TestCase):
                 {'source': 'SPIRES', 'confidence': 1.05}
         ]
 
-        with mock.patch('requests.get') as mock_oracle_util:
+        with mock.patch('requests.Session.get') as mock_oracle_util:
             mock_oracle_util.return_value = mock_response = mock.Mock()
             mock_response.status_code = 200
             mock_response.text = json.dumps(returned_value)
@@ -497,7 +691,7 @@ class TestDocMatch(unittest.TestCase):
             self.assertEqual(results, expected_value)
 
         # test when oracle does not return the list
-        with mock.patch('requests.get') as mock_oracle_util:
+        with mock.patch('requests.Session.get') as mock_oracle_util:
             mock_oracle_util.return_value = mock_response = mock.Mock()
             mock_response.status_code = 400
 
@@ -505,7 +699,7 @@ class TestDocMatch(unittest.TestCase):
             self.assertEqual(results, [])
 
         # test when an exception happen while sending request to oracle
-        with mock.patch('requests.get') as mock_oracle_util:
+        with mock.patch('requests.Session.get') as mock_oracle_util:
             mock_oracle_util.side_effect = Exception(mock.Mock(status=404), 'not found')
             results = self.match_metadata.ORACLE_UTIL.get_source_score_list()
             self.assertEqual(results, [])
@@ -513,12 +707,12 @@ class TestDocMatch(unittest.TestCase):
     def test_update_db_sourced_matches(self):
         """ """
         # test when everything goes right
-        with mock.patch('requests.get') as mock_oracle_util_source_score:
+        with mock.patch('requests.Session.get') as mock_oracle_util_source_score:
             mock_oracle_util_source_score.return_value = mock_response = mock.Mock()
             mock_response.status_code = 200
             mock_response.text = json.dumps({'confidence': 1.3})
 
-            with mock.patch('requests.put') as oracle_util_add_to_db:
+            with mock.patch('requests.Session.put') as oracle_util_add_to_db:
                 oracle_util_add_to_db.return_value = mock_response = mock.Mock()
                 mock_response.status_code = 200
                 mock_response.text = json.dumps({"status": "updated db with new data successfully"})
@@ -527,7 +721,7 @@ class TestDocMatch(unittest.TestCase):
                 self.assertEqual(status, 'Added 6 records to database.')
 
         # test when oracle does not return a confidence value
-        with mock.patch('requests.get') as mock_oracle_util:
+        with mock.patch('requests.Session.get') as mock_oracle_util:
             mock_oracle_util.return_value = mock_response = mock.Mock()
             mock_response.status_code = 400
 
@@ -535,7 +729,7 @@ class TestDocMatch(unittest.TestCase):
             self.assertEqual(status, 'Unable to get confidence for source ADS from oracle.')
 
         # test when an exception happen while sending request to oracle
-        with mock.patch('requests.get') as mock_oracle_util:
+        with mock.patch('requests.Session.get') as mock_oracle_util:
             mock_oracle_util.side_effect = Exception(mock.Mock(status=404), 'not found')
             status = self.match_metadata.ORACLE_UTIL.update_db_sourced_matches("a file", "source")
             self.assertEqual(status, 'Unable to get confidence for source source from oracle.')
@@ -565,7 +759,7 @@ class TestDocMatch(unittest.TestCase):
             for match in result.get('results'):
                 expected_lines.append('\t'.join([str(elem) for elem in match]))
 
-        with mock.patch('requests.post', side_effect=return_values):
+        with mock.patch('requests.Session.post', side_effect=return_values):
             status = self.match_metadata.ORACLE_UTIL.query(tmp_output_filename)
             self.assertEqual(status, 'Got 6 records from db.')
             with open(tmp_output_filename, "r") as f:
@@ -577,9 +771,171 @@ class TestDocMatch(unittest.TestCase):
         # remove temp files
         os.remove(tmp_output_filename)
 
+    def test_query_parallel(self):
+        """ test that pages requested at once are written in order, with at most the number of workers in flight """
+        tmp_output_filename = os.path.dirname(__file__) + '/stubdata/query_output.txt'
+        matches = [['%04darXiv' % i, '%04dmatched' % i, 1.3] for i in range(23)]
+        in_flight = []
+        lock = threading.Lock()
+        def post(endpoint, headers, data):
+            start = json.loads(data)['start']
+            with lock:
+                in_flight.append(start)
+                self.assertLessEqual(len(in_flight), 4)
+            time.sleep(0.01 * (start % 3))
+            with lock:
+                in_flight.remove(start)
+            return self.create_response({'params': {'start': start, 'rows': 5}, 'results': matches[start:start + 5]})
+
+        oracle_util = self.match_metadata.ORACLE_UTIL
+        with mock.patch.dict(oracle_config, {'DOCMATCHPIPELINE_ORACLE_QUERY_WORKERS': '4'}), \
+             mock.patch.object(oracle_util.transport, 'post', side_effect=post):
+            self.assertEqual(oracle_util.query(tmp_output_filename, days=1), 'Got 23 records from db.')
+        with open(tmp_output_filename, 'r') as f:
+            self.assertEqual(f.read(), ''.join('%s\t%s\t%s\n' % tuple(match) for match in matches))
+
+        # nothing in db
+        with mock.patch.object(oracle_util.transport, 'post', return_value=self.create_response({'params': {'start': 0, 'rows': 0}, 'results': []})):
+            self.assertEqual(oracle_util.query(tmp_output_filename), 'Got 0 records from db.')
+
+        os.remove(tmp_output_filename)
+
+    def test_query_resume(self):
+        """ test that failed pages are attempted a few times, and a failed query resumes from the last page written """
+        tmp_output_filename = os.path.dirname(__file__) + '/stubdata/query_output.txt'
+        matches = [['%04darXiv' % i, '%04dmatched' % i, 1.3] for i in range(23)]
+        requested = []
+        failing = {10: 3}
+        def post(endpoint, headers, data):
+            start = json.loads(data)['start']
+            requested.append(start)
+            if failing.get(start):
+                failing[start] -= 1
+                if failing[start] % 2:
+                    raise requests.exceptions.ConnectionError('connection reset')
+                response = self.create_response({})
+                response.status_code = 502
+                return response
+            return self.create_response({'params': {'start': start, 'rows': 5}, 'results': matches[start:start + 5]})
+
+        oracle_util = self.match_metadata.ORACLE_UTIL
+        with mock.patch.dict(oracle_config, {'DOCMATCHPIPELINE_API_ORACLE_SERVICE_ATTEMPTS': '2'}), \
+             mock.patch.object(oracle_util.transport, 'post', side_effect=post):
+            # the page at 10 fails twice, the query stops with the first two pages saved
+            with self.assertRaises(QueryPageException):
+                oracle_util.query(tmp_output_filename, days=1)
+            self.assertEqual(requested, [0, 5, 10, 10])
+            self.assertFalse(os.path.exists(tmp_output_filename))
+            # what was written after the last page saved is dropped
+            with open(tmp_output_filename + '.part', 'a') as fp:
+                fp.write('partial\tline')
+
+            # resumes at 10, that now succeeds at the second attempt
+            del requested[:]
+            self.assertEqual(oracle_util.query(tmp_output_filename, days=1), 'Got 23 records from db.')
+            self.assertEqual(requested, [10, 10, 15, 20, 25])
+        with open(tmp_output_filename, 'r') as f:
+            self.assertEqual(f.read(), ''.join('%s\t%s\t%s\n' % tuple(match) for match in matches))
+        self.assertFalse(os.path.exists(tmp_output_filename + '.part'))
+        self.assertFalse(os.path.exists(tmp_output_filename + '.state'))
+
+        # a query with other days, or left from another day, starts over
+        for query_date, days in [(date.today().isoformat(), 2), ('2000-01-01', 1)]:
+            with open(tmp_output_filename + '.part', 'w') as fp:
+                fp.write('\t'.join(['0000arXiv', '0000matched', '1.3']) + '\n')
+            with open(tmp_output_filename + '.state', 'w') as fp:
+                json.dump({'date': query_date, 'days': 1, 'rows': 5, 'start': 5, 'count': 1, 'size': 26}, fp)
+            del requested[:]
+            with mock.patch.object(oracle_util.transport, 'post', side_effect=post):
+                self.assertEqual(oracle_util.query(tmp_output_filename, days=days), 'Got 23 records from db.')
+            self.assertEqual(requested[0], 0)
+
+        os.remove(tmp_output_filename)
+
+    def test_dump_oracledb_incremental(self):
+        """ test that the dump is refreshed in full the first time and on schedule, and merged with the last days otherwise """
+        stubdata_dir = os.path.dirname(__file__) + '/stubdata/'
+        daily_file = stubdata_dir + 'oracle_dump_test.tsv'
+        db = [['2015arXiv150504001F', '2015PhRvD..92c3003F', '1.3'], ['2019arXiv190610914P', '2020JPCM...32c5601P', '1.3']]
+        queried_days = []
+        def query(output_filename, days=None):
+            queried_days.append(days)
+            rows = db if days == 9999 else db[1:]
+            with open(output_filename, 'w') as fp:
+                for row in rows:
+                    fp.write('\t'.join(row) + '\n')
+            return 'Got %d records from db.' % len(rows)
+
+        def read_dump():
+            with open(daily_file, 'r') as fp:
+                return [line[:-1].split('\t') for line in fp.readlines()]
+
+        oracle_util = self.match_metadata.ORACLE_UTIL
+        with mock.patch.dict(oracle_config, {'DOCMATCHPIPELINE_PUBLISHED_DIR': stubdata_dir, 'DOCMATCHPIPELINE_ORACLE_DUMP_FILE': 'oracle_dump_test.tsv',
+                                             'DOCMATCHPIPELINE_ORACLE_DUMP_AGE': 9999, 'DOCMATCHPIPELINE_ORACLE_DUMP_INCREMENTAL_DAYS': '2',
+                                             'DOCMATCHPIPELINE_ORACLE_DUMP_FULL_REFRESH_DAYS': '7'}), \
+             mock.patch.object(oracle_util, 'query', side_effect=query):
+            # no previous dump
+            oracle_util.dump_oracledb()
+            self.assertEqual(read_dump(), db)
+
+            # the confidence of one match changed, and one match was added, in the last days
+            db[1][2] = '-1'
+            db.append(['2020arXiv200608648C', '2021JHEP...04..033C', '1.3'])
+            # the last dump is three days old
+            os.utime(daily_file, (time.time() - 3 * 86400, time.time() - 3 * 86400))
+            oracle_util.dump_oracledb()
+            self.assertEqual(queried_days, [9999, 4])
+            self.assertEqual(read_dump(), db)
+
+            # the match deleted from db is dropped by the next full refresh
+            del db[0]
+            oracle_util.dump_oracledb()
+            self.assertEqual(len(read_dump()), 3)
+            os.utime(daily_file + '.full', (time.time() - 8 * 86400, time.time() - 8 * 86400))
+            oracle_util.dump_oracledb()
+            self.assertEqual(queried_days, [9999, 4, 2, 9999])
+            self.assertEqual(read_dump(), db)
+            self.assertEqual(sorted(filename for filename in os.listdir(stubdata_dir) if filename.startswith('oracle_dump_test')),
+                             ['oracle_dump_test.tsv', 'oracle_dump_test.tsv.full'])
+
+        os.remove(daily_file)
+        os.remove(daily_file + '.full')
+
+    def test_transport(self):
+        """ test that all the calls go through one pooled session with per endpoint timeouts and counters """
+        transport = OracleTransport(base_url='http://oracle', token='token', pool_size=4, timeouts={'cleanup': 300})
+        self.assertEqual(transport.session.headers['Authorization'], 'Bearer token')
+        self.assertEqual(transport.session.get_adapter('http://oracle')._pool_maxsize, 4)
+
+        with mock.patch('requests.Session.post') as mock_post:
+            mock_post.return_value = mock_response = mock.Mock()
+            mock_response.status_code = 200
+            transport.post('docmatch_add', data='{}')
+            transport.post('docmatch_add', data='{}')
+            mock_response.status_code = 502
+            transport.post('docmatch_add', data='{}')
+            mock_post.assert_called_with(url='http://oracle/docmatch_add', timeout=60.0, data='{}')
+
+        with mock.patch('requests.Session.get') as mock_get:
+            mock_get.side_effect = Exception('connection refused')
+            with self.assertRaises(Exception):
+                transport.get('cleanup')
+            mock_get.assert_called_with(url='http://oracle/cleanup', timeout=300.0)
+
+        counters = transport.get_counters()
+        self.assertEqual(counters['docmatch_add']['calls'], 3)
+        self.assertEqual(counters['docmatch_add']['status'], {200: 2, 502: 1})
+        self.assertEqual(counters['cleanup']['exceptions'], 1)
+
+        # oracle util creates one transport, shared by all the instances
+        oracle_util = OracleUtil()
+        self.assertIs(oracle_util.transport, oracle_util.transport)
+        self.assertIs(OracleUtil().transport, oracle_util.transport)
+
     def test_cleanup(self):
         """ """
-        with mock.patch('requests.get') as mock_oracle_util:
+        with mock.patch('requests.Session.get') as mock_oracle_util:
             mock_oracle_util.return_value = mock_response = mock.Mock()
             mock_response.status_code = 200
             mock_response.text = '{"details": "This is one result."}'
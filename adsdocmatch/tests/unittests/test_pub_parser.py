@@ -0,0 +1,175 @@
+import sys, os
+project_home = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../../'))
+if project_home not in sys.path:
+    sys.path.insert(0, project_home)
+
+import unittest
+import mock
+import io
+import shutil
+import tempfile
+
+import pickle
+
+from adsdocmatch.pub_parser.unicode import UnicodeHandler, UnicodeError
+from adsdocmatch.pub_parser import get_pub_metadata, get_pub_bibcode, get_pub_record, strip_lines, PubMetadata, MetadataError, MAX_ABSTRACT_FIELD_LINES
+
+
+class TestPubParser(unittest.TestCase):
+
+    def setUp(self):
+        self.stubdata_dir = os.path.dirname(__file__) + '/stubdata/'
+
+    def tearDown(self):
+        pass
+
+    def test_get_pub_metadata(self):
+        """ test parsing from bytes, str, and a file object """
+        expected = {
+            'authors': 'Tang, Xiaomin',
+            'title': 'Post-Lie algebra structures on the Witt algebra',
+            'abstract': 'In this paper, we characterize the graded post-Lie algebra structures and a class of shifting post-Lie '
+                        'algebra structures on the Witt algebra. We obtain some new Lie algebras and give a class of their modules. '
+                        'As an application, the homogeneous Rota-Baxter operators and a class of non-homogeneous Rota-Baxter '
+                        'operators of weight $1$ on the Witt algebra are studied.',
+            'pub': 'eprint arXiv:1701.00200',
+            'pubdate': '2017/01',
+            'bibcode': '2017arXiv170100200T',
+            'comments': '24 pages',
+            'origin': 'ARXIV'
+        }
+        with open(self.stubdata_dir + 'X10-50737.abs', 'rb') as fp:
+            contents = fp.read()
+        self.assertEqual(get_pub_metadata(contents), expected)
+        self.assertEqual(get_pub_metadata(contents.decode('utf-8')), expected)
+        with open(self.stubdata_dir + 'X10-50737.abs', 'rb') as fp:
+            self.assertEqual(get_pub_metadata(fp), expected)
+
+        # all the stub files agree whichever way they are read
+        for filename in sorted(os.listdir(self.stubdata_dir)):
+            if filename.endswith('.abs'):
+                with open(self.stubdata_dir + filename, 'rb') as fp:
+                    contents = fp.read()
+                self.assertEqual(get_pub_metadata(io.BytesIO(contents)), get_pub_metadata(contents))
+
+    def test_strip_lines(self):
+        """ test that stripping the lines is the same as stripping the whole contents """
+        for contents in ['\n\n  a\n b \n\n c  \n \n', 'a', '', ' \n \n', 'a\n\n\nb']:
+            self.assertEqual(list(strip_lines(iter(contents.split('\n')))), [line for line in contents.strip().split('\n') if contents.strip()])
+
+    def test_multiline_fields(self):
+        """ test long author and abstract blocks, and paragraphs in the abstract """
+        authors = ';\n    '.join(['Author%d, A.' % i for i in range(1000)])
+        contents = ('Title:              A title\nAuthors:            %s\nPublication Date:   01/2017\n'
+                    'Bibliographic Code: 2017arXiv170100200T\n\n                               Abstract\n'
+                    'first paragraph\n\nsecond paragraph &amp; more\n\n\n' % authors)
+        metadata = get_pub_metadata(contents.encode('utf-8'))
+        self.assertEqual(metadata['authors'], '; '.join(['Author%d, A.' % i for i in range(1000)]))
+        self.assertEqual(metadata['abstract'], 'first paragraph <P />second paragraph &amp; more')
+
+    def test_get_pub_bibcode(self):
+        """ test that reading the header gives the same bibcode as the full parse, and None when the full parse fails """
+        for filename in sorted(os.listdir(self.stubdata_dir)):
+            if filename.endswith('.abs'):
+                with open(self.stubdata_dir + filename, 'rb') as fp:
+                    contents = fp.read()
+                self.assertEqual(get_pub_bibcode(io.BytesIO(contents)), get_pub_metadata(contents)['bibcode'])
+
+        header = 'Title:              A title\nPublication Date:   01/2017\n'
+        abstract = '\n                               Abstract\nthe abstract\n'
+        self.assertEqual(get_pub_bibcode(header + 'Bibliographic Code: 2017arXiv170100200T\n' + abstract), '2017arXiv170100200T')
+        # the abstract is left unread
+        fp = iter((header + 'Bibliographic Code: 2017arXiv170100200T\n' + abstract + 'more\n' * 1000).encode('utf-8').splitlines(True))
+        self.assertEqual(get_pub_bibcode(fp), '2017arXiv170100200T')
+        self.assertGreater(len(list(fp)), 990)
+        for contents in [header + abstract,
+                         header + 'Bibliographic Code: 2017arXiv1701\n' + abstract,
+                         header + 'Bibliographic Code: 2017arXiv170100200T\n']:
+            self.assertIsNone(get_pub_bibcode(contents))
+            with self.assertRaises(MetadataError):
+                get_pub_metadata(contents)
+
+    def test_get_pub_record(self):
+        """ test parsing into compact records, the same as the dicts of get_pub_metadata """
+        filenames = [self.stubdata_dir + filename for filename in ['X10-50737.abs', 'K47-02665.abs']]
+        records = []
+        for filename in filenames:
+            with open(filename, 'rb') as fp:
+                records.append(get_pub_record(fp.read(), filename))
+        self.assertEqual([record.filename for record in records], filenames)
+        for record in records:
+            with open(record.filename, 'rb') as fp:
+                self.assertEqual(record.to_dict(), get_pub_metadata(fp))
+        self.assertEqual(pickle.loads(pickle.dumps(records[0])), records[0])
+
+    def test_pub_metadata(self):
+        """ test that the record behaves as the dict it replaces """
+        record = PubMetadata('X10-50737.abs', bibcode='2017arXiv170100200T', title='A title')
+        self.assertEqual(record['bibcode'], '2017arXiv170100200T')
+        self.assertEqual(record.get('doi'), None)
+        self.assertEqual(record.get('class', []), [])
+        self.assertFalse('doi' in record)
+        with self.assertRaises(KeyError):
+            record['authors']
+        with self.assertRaises(KeyError):
+            record['class'] = 'astro-ph'
+        record['doi'] = '10.3847/1538-4365/aab760'
+        self.assertEqual(record.keys(), ['title', 'bibcode', 'doi'])
+        self.assertEqual(record.pop('doi'), '10.3847/1538-4365/aab760')
+        self.assertEqual(record.pop('doi', None), None)
+        self.assertEqual(record, {'bibcode': '2017arXiv170100200T', 'title': 'A title'})
+
+    def test_ent2xml(self):
+        """ test translating named, decimal, and hexadecimal entities, keeping the XML predefined ones """
+        handler = UnicodeHandler()
+        self.assertEqual(handler.ent2xml('&reg;, &lt;, &gt;, &amp;, &cent;, &#33;, &#x22;, &#x3b1;, no entity'),
+                         '®, &lt;, &gt;, &amp;, ¢, !, ", α, no entity')
+        # translated characters that form a new entity are translated again, one kind of entity after another
+        self.assertEqual(handler.ent2xml('&&num;65;'), 'A')
+        self.assertEqual(handler.ent2xml('&#38;#x41;'), 'A')
+        self.assertEqual(handler.ent2xml('&#38;#65;'), '&#65;')
+        self.assertEqual(handler.ent2xml_by_kind('&&num;65; &#38;#x41; &#38;#65;'), 'A A &#65;')
+        with self.assertRaises(UnicodeError):
+            handler.ent2xml('&#65; &bogus;')
+
+    def test_unicode_table_cache(self):
+        """ test that the table is loaded on first use, and cached until the data file changes """
+        directory = tempfile.mkdtemp()
+        try:
+            data_filename = os.path.join(directory, 'unicode.dat')
+            shutil.copyfile(os.path.join(project_home, 'adsdocmatch/pub_parser/unicode.dat'), data_filename)
+            handler = UnicodeHandler(data_filename)
+            self.assertIsNone(handler._data)
+            self.assertFalse(os.path.exists(handler.cache_filename))
+            self.assertEqual(handler['reg'].code, 174)
+            self.assertEqual(handler.str[174].entity, 'reg')
+            self.assertTrue(os.path.exists(handler.cache_filename))
+
+            # from the cache
+            with mock.patch.object(UnicodeHandler, 'parse_data') as mock_parse_data:
+                handler = UnicodeHandler(data_filename)
+                self.assertEqual(handler.ent2xml('&reg;'), '®')
+                self.assertEqual(mock_parse_data.call_count, 0)
+
+            # the data file changed, the cache is rebuilt
+            with open(data_filename, 'a') as fp:
+                fp.write('"9731"\t"sunny"\t"*"\t"*"\n')
+            handler = UnicodeHandler(data_filename)
+            self.assertEqual(handler.ent2xml('&sunny;'), '☃')
+            self.assertEqual(UnicodeHandler(data_filename).read_cache(('bad', 'key')), None)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_errors(self):
+        """ test files that cannot be parsed """
+        with self.assertRaises(MetadataError):
+            get_pub_metadata(b'Title: A title\nPublication Date: 01/2017\n')
+        with self.assertRaises(MetadataError):
+            get_pub_metadata(b'Title: A title\nBibliographic Code: 2017arXiv\n\n                               Abstract\n')
+        contents = 'Title: A title\n' + 'more title\n' * MAX_ABSTRACT_FIELD_LINES
+        with self.assertRaises(MetadataError):
+            get_pub_metadata(io.BytesIO(contents.encode('utf-8')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import sys, os
+project_home = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../../'))
+if project_home not in sys.path:
+    sys.path.insert(0, project_home)
+
+import unittest
+import json
+
+from adsdocmatch.result_sink import ResultSink
+from adsdocmatch.batch_util import MatchJournal
+
+
+class TestResultSink(unittest.TestCase):
+
+    def setUp(self):
+        stubdata_dir = os.path.dirname(__file__) + '/stubdata'
+        self.result_filename = stubdata_dir + '/result_sink_test.out'
+        self.rerun_filename = stubdata_dir + '/result_sink_test.rerun'
+        self.matched = [{'source_bibcode': '2021arXiv210312030S', 'matched_bibcode': '2021CSF...15311505S', 'label': 'Match',
+                         'confidence': 0.9829099, 'score': {'abstract': 0.97, 'title': 0.98}, 'comment': ''}]
+        self.failed = [{'source_bibcode': '2023arXiv230503053S', 'comment': 'Oracle service failure.',
+                        'status_flaw': 'got 502 for the last failed attempt -- shall be added to rerun list.'}]
+
+    def tearDown(self):
+        for filename in [self.result_filename, self.rerun_filename, self.result_filename + '.journal']:
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    def read_lines(self, filename):
+        with open(filename, 'r') as f:
+            return [line[:-1] for line in f.readlines()]
+
+    def test_csv(self):
+        """ test the csv format the curators review, and that failed records are logged to be rerun """
+        with ResultSink(self.result_filename, self.rerun_filename, 'csv') as result_sink:
+            result_sink.write('/a/X01.abs', self.matched)
+            result_sink.write('/a/X02.abs', self.failed)
+        self.assertEqual(self.read_lines(self.result_filename), [
+            'source bibcode (link),verified bibcode,matched bibcode (link),label,confidence,matched scores,comment',
+            '"=HYPERLINK(""https://ui.adsabs.harvard.edu/abs/2021arXiv210312030S/abstract"",""2021arXiv210312030S"")",,'
+            '"=HYPERLINK(""https://ui.adsabs.harvard.edu/abs/2021CSF...15311505S/abstract"",""2021CSF...15311505S"")",'
+            'Match,0.9829099,"{\'abstract\': 0.97, \'title\': 0.98}",""',
+            "['2023arXiv230503053S Oracle service failure. status_flaw=got 502 for the last failed attempt -- shall be added to rerun list.']",
+        ])
+        self.assertEqual(self.read_lines(self.rerun_filename), ['/a/X02.abs'])
+
+        # appending does not repeat the header
+        with ResultSink(self.result_filename, self.rerun_filename, 'csv') as result_sink:
+            result_sink.write('/a/X03.abs', self.matched)
+        self.assertEqual(len(self.read_lines(self.result_filename)), 4)
+
+    def test_tsv_and_jsonl(self):
+        """ test the other two formats """
+        with ResultSink(self.result_filename, self.rerun_filename, 'tsv') as result_sink:
+            result_sink.write('/a/X01.abs', self.matched)
+        self.assertEqual(self.read_lines(self.result_filename),
+                         ["2021arXiv210312030S\t2021CSF...15311505S\tMatch\t0.9829099\t{'abstract': 0.97, 'title': 0.98}\t"])
+        os.remove(self.result_filename)
+
+        with ResultSink(self.result_filename, self.rerun_filename, 'jsonl') as result_sink:
+            result_sink.write('/a/X01.abs', self.matched)
+            result_sink.write('/a/X02.abs', self.failed)
+        lines = [json.loads(line) for line in self.read_lines(self.result_filename)]
+        self.assertEqual(lines, [dict(self.matched[0], metadata_filename='/a/X01.abs'),
+                                 dict(self.failed[0], metadata_filename='/a/X02.abs')])
+
+        with self.assertRaises(ValueError):
+            ResultSink(self.result_filename, self.rerun_filename, 'xml')
+
+    def test_buffering(self):
+        """ test that lines are held until the buffer is full, and the journal follows the results """
+        journal = MatchJournal(self.result_filename)
+        journal.open()
+        result_sink = ResultSink(self.result_filename, self.rerun_filename, 'tsv', buffer_size=300, flush_sec=60, journal=journal).open()
+        result_sink.write('/a/X01.abs', self.matched, 'matched')
+        self.assertEqual(self.read_lines(self.result_filename), [])
+        self.assertEqual(journal.get_completed(), {})
+        self.assertFalse(os.path.exists(self.rerun_filename))
+
+        result_sink.write('/a/X02.abs', self.failed, 'rerun')
+        result_sink.write('/a/X03.abs', self.matched, 'matched')
+        self.assertEqual(len(self.read_lines(self.result_filename)), 3)
+        self.assertEqual(self.read_lines(self.rerun_filename), ['/a/X02.abs'])
+        self.assertEqual(journal.get_completed(), {'/a/X01.abs': 'matched', '/a/X02.abs': 'rerun', '/a/X03.abs': 'matched'})
+
+        result_sink.write('/a/X04.abs', self.matched, 'matched')
+        result_sink.close()
+        journal.close()
+        self.assertEqual(len(self.read_lines(self.result_filename)), 4)
+        self.assertEqual(len(journal.get_completed()), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+"""
+compare OracleUtil.normalize_author_list, scoring the four author patterns as their matches are found
+and keeping the matches of the pattern picked, against the previous version, that ran each pattern over
+the whole string, joined and split the matches again to score them, and ran the pattern picked once more,
+on synthetic author lists of 10 to 5000 names, the time per name should stay flat as the lists grow
+
+    python3 benchmarks/bench_authors.py --number 5
+"""
+import sys, os
+project_home = os.path.abspath(os.path.join(os.path.dirname(__file__), '../'))
+if project_home not in sys.path:
+    sys.path.insert(0, project_home)
+
+import random
+import timeit
+import argparse
+
+from adsdocmatch.oracle_util import OracleUtil
+
+
+class PreviousOracleUtil(OracleUtil):
+    """
+    the previous version of the pattern vote, kept here as the baseline
+    """
+
+    def get_length_matched_authors(self, ref_string, matches):
+        matched_str = ', '.join([' '.join(list(filter(None, author))).strip() for author in matches])
+        count = 0
+        for sub, full in zip(self.WORDS_ONLY.findall(matched_str), self.WORDS_ONLY.findall(ref_string)):
+            if sub != full:
+                break
+            count += 1
+        return count
+
+    def match_author_pattern(self, ref_string, deadline=None):
+        patterns = [self.TRAILING_INIT_PAT, self.LEADING_INIT_PAT, self.TRAILING_FULL_PAT, self.LEADING_FULL_PAT]
+        lengths = [self.get_length_matched_authors(ref_string, pattern.findall(ref_string)) for pattern in patterns]
+        index = self.pick_author_pattern(lengths)
+        if index is None:
+            return None, None
+        return patterns[index], list(patterns[index].finditer(ref_string))
+
+
+LAST_NAMES = ['Smith', 'Jones', 'van der Berg', 'Garcia-Lopez', 'McDonald', "O'Neil", 'Zhang', 'de la Cruz']
+FIRST_NAMES = ['John', 'Maria', 'Wei', 'Anne-Marie']
+
+
+def make_author_list(num_names, style):
+    """
+
+    :param num_names:
+    :param style: trailing or leading initials, or trailing or leading first names
+    :return:
+    """
+    authors = []
+    for _ in range(num_names):
+        last = random.choice(LAST_NAMES)
+        first = random.choice(FIRST_NAMES)
+        if style == 'trailing initials':
+            authors.append('%s, %s. %s.' % (last, first[0], random.choice('ABCD')))
+        elif style == 'leading initials':
+            authors.append('%s. %s' % (first[0], last))
+        elif style == 'trailing names':
+            authors.append('%s, %s' % (last, first))
+        else:
+            authors.append('%s %s' % (first, last))
+    return ('; ' if style.startswith('trailing') else ', ').join(authors)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark OracleUtil.normalize_author_list')
+    parser.add_argument('--number', type=int, default=5, help='number of times each author list is normalized')
+    args = parser.parse_args()
+
+    random.seed(1)
+    # measure the parsing, not the cache
+    OracleUtil.author_cache.maxsize = 0
+    current = OracleUtil()
+    previous = PreviousOracleUtil()
+    print('%18s %6s %18s %18s %8s' % ('style', 'names', 'previous (us/name)', 'current (us/name)', 'speedup'))
+    for style in ['trailing initials', 'leading initials', 'trailing names', 'leading names']:
+        for num_names in [10, 100, 1000, 3000, 5000]:
+            author_list = make_author_list(num_names, style)
+            assert current.normalize_author_list(author_list) == previous.normalize_author_list(author_list)
+            previous_time = min(timeit.repeat(lambda: previous.normalize_author_list(author_list), number=args.number, repeat=3))
+            current_time = min(timeit.repeat(lambda: current.normalize_author_list(author_list), number=args.number, repeat=3))
+            print('%18s %6d %18.1f %18.1f %7.1fx' % (style, num_names, 1e6 * previous_time / args.number / num_names,
+                                                     1e6 * current_time / args.number / num_names, previous_time / current_time))
@@ -0,0 +1,136 @@
+"""
+compare get_pub_metadata against the parser it replaced, that popped the first line of a list
+for every line and grew multi-line fields by string concatenation, on metadata files with
+large author and abstract blocks
+
+    python3 benchmarks/bench_pub_parser.py --lines 1000 5000 20000
+"""
+import sys, os
+project_home = os.path.abspath(os.path.join(os.path.dirname(__file__), '../'))
+if project_home not in sys.path:
+    sys.path.insert(0, project_home)
+
+import io
+import time
+import argparse
+
+from adsdocmatch.pub_parser import get_pub_metadata, as_needed, FIELDPAT, MAX_ABSTRACT_FIELD_LINES, ILLEGALCHARSREGEX, \
+    HTML_ENCODED_FIELDS, UNICODE_HANDLER, MetadataError
+
+
+def get_pub_metadata_quadratic(contents):
+    """
+    the previous implementation of get_pub_metadata, kept here as the baseline
+
+    :param contents:
+    :return:
+    """
+    article = {}
+    article[u'Bibliographic Code'] = ''
+    current_field = ''
+    current_value = ''
+    fields_found_in_file = []
+    num_lines = 0
+
+    if (isinstance(contents, bytes)):
+        contents = contents.decode('utf-8')
+
+    if ILLEGALCHARSREGEX.search(contents):
+        contents = UNICODE_HANDLER.remove_control_chars(contents, strict=True)
+    contents = contents.strip().split('\n')
+
+    while contents:
+        line = contents.pop(0)
+        match = FIELDPAT.match(line)
+        if match:
+            if current_field:
+                article[current_field] = current_value
+            current_field = match.group(1)
+            current_value = match.group(2).strip()
+            fields_found_in_file.append(current_field)
+            num_lines = 1
+        elif line == '                               Abstract':
+            fields_found_in_file.append('Abstract')
+            article[current_field] = current_value
+            break
+        elif line.strip():
+            current_value = current_value + ' ' + line.strip()
+            num_lines += 1
+
+        if num_lines > MAX_ABSTRACT_FIELD_LINES:
+            raise MetadataError('Number of lines for field %s too large (%d).'%(current_field, num_lines))
+
+    abstract = ''.join([l.strip() and l.strip() + ' ' or '<P />' for l in contents])
+    article[u'Abstract'] = abstract.strip().replace(' \n', '\n')
+
+    if 'Bibliographic Code' not in fields_found_in_file:
+        raise MetadataError('No bibcode field found')
+
+    if len(article['Bibliographic Code']) != 19:
+        raise MetadataError('Invalid bibcode')
+
+    if 'Authors' not in fields_found_in_file and 'Review Author' in fields_found_in_file:
+        article['Authors'] = article['Review Author']
+
+    for field in HTML_ENCODED_FIELDS:
+        if field in article:
+            article[field] = UNICODE_HANDLER.ent2xml(article[field])
+
+    switch_date = article['Publication Date'].split('/')
+    article['Publication Date'] = switch_date[1] + '/' + switch_date[0]
+
+    return as_needed(article)
+
+
+def make_metadata(num_lines):
+    """
+    metadata file with num_lines lines of authors, and num_lines lines of abstract
+
+    :param num_lines:
+    :return:
+    """
+    authors = ';\n                    '.join(['Author%d, A. B.' % i for i in range(num_lines)])
+    abstract = '\n'.join(['line %d of the abstract, with an &amp; entity and some words to parse.' % i for i in range(num_lines)])
+    return ('Title:              A benchmark record\n'
+            'Authors:            %s\n'
+            'Journal:            eprint arXiv:1701.00200\n'
+            'Publication Date:   01/2017\n'
+            'Origin:             ARXIV\n'
+            'Bibliographic Code: 2017arXiv170100200T\n'
+            '\n'
+            '                               Abstract\n'
+            '%s\n' % (authors, abstract)).encode('utf-8')
+
+
+def best_time(func, contents, repeat):
+    """
+
+    :param func:
+    :param contents: function returning the argument for func
+    :param repeat:
+    :return:
+    """
+    times = []
+    for _ in range(repeat):
+        argument = contents()
+        start_time = time.perf_counter()
+        func(argument)
+        times.append(time.perf_counter() - start_time)
+    return min(times)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark get_pub_metadata')
+    parser.add_argument('--lines', type=int, nargs='+', default=[1000, 5000, 20000, 45000],
+                        help='number of author lines, and of abstract lines, in the metadata file')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print('%8s %14s %14s %14s %8s' % ('lines', 'previous (s)', 'bytes (s)', 'file (s)', 'speedup'))
+    for num_lines in args.lines:
+        contents = make_metadata(num_lines)
+        assert get_pub_metadata(contents) == get_pub_metadata_quadratic(contents) == get_pub_metadata(io.BytesIO(contents))
+        previous = best_time(get_pub_metadata_quadratic, lambda: contents, args.repeat)
+        current = best_time(get_pub_metadata, lambda: contents, args.repeat)
+        from_file = best_time(get_pub_metadata, lambda: io.BytesIO(contents), args.repeat)
+        print('%8d %14.4f %14.4f %14.4f %7.1fx' % (num_lines, previous, current, from_file, previous / current))
@@ -0,0 +1,95 @@
+"""
+compare memory and time of holding a day of parsed metadata as the dicts of get_pub_metadata,
+and as the compact records of get_pub_record
+
+    python3 benchmarks/bench_pub_record.py --files 20000
+"""
+import sys, os
+project_home = os.path.abspath(os.path.join(os.path.dirname(__file__), '../'))
+if project_home not in sys.path:
+    sys.path.insert(0, project_home)
+
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+
+from adsdocmatch.pub_parser import get_pub_metadata, get_pub_record
+
+
+def write_files(directory, num_files):
+    """
+    copies of the stub metadata files
+
+    :param directory:
+    :param num_files:
+    :return:
+    """
+    stubdata_dir = os.path.join(project_home, 'adsdocmatch/tests/unittests/stubdata')
+    stubs = sorted(os.path.join(stubdata_dir, filename) for filename in os.listdir(stubdata_dir) if filename.endswith('.abs'))
+    filenames = []
+    for i in range(num_files):
+        filename = os.path.join(directory, '%06d.abs' % i)
+        shutil.copyfile(stubs[i % len(stubs)], filename)
+        filenames.append(filename)
+    return filenames
+
+
+def parse_dicts(filenames):
+    """
+
+    :param filenames:
+    :return:
+    """
+    results = []
+    for filename in filenames:
+        with open(filename, 'rb') as fp:
+            results.append(get_pub_metadata(fp.read()))
+    return results
+
+
+def parse_records(filenames):
+    """
+
+    :param filenames:
+    :return:
+    """
+    results = []
+    for filename in filenames:
+        with open(filename, 'rb') as fp:
+            results.append(get_pub_record(fp.read(), filename))
+    return results
+
+
+def measure(func, filenames):
+    """
+
+    :param func:
+    :param filenames:
+    :return: seconds, and bytes still allocated while the results are held
+    """
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    results = func(filenames)
+    seconds = time.perf_counter() - start_time
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del results
+    return seconds, size
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark get_pub_record')
+    parser.add_argument('--files', type=int, default=20000, help='number of metadata files')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        filenames = write_files(directory, args.files)
+        print('%12s %12s %12s' % ('', 'seconds', 'MB held'))
+        for name, func in [('dicts', parse_dicts), ('records', parse_records)]:
+            seconds, size = measure(func, filenames)
+            print('%12s %12.2f %12.1f' % (name, seconds, size / 1e6))
+    finally:
+        shutil.rmtree(directory)
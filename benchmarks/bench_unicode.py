@@ -0,0 +1,84 @@
+"""
+compare UnicodeHandler.ent2xml, translating all the entities in one pass with a table,
+against the previous version, that went over the text once per kind of entity, scanned the
+list of entity names for every named entity, and built each character with eval
+
+    python3 benchmarks/bench_unicode.py --number 200
+"""
+import sys, os
+project_home = os.path.abspath(os.path.join(os.path.dirname(__file__), '../'))
+if project_home not in sys.path:
+    sys.path.insert(0, project_home)
+
+import random
+import timeit
+import argparse
+
+from adsdocmatch.pub_parser.unicode import UnicodeHandler, UnicodeError
+
+
+class PreviousUnicodeHandler(UnicodeHandler):
+    """
+    the previous version of ent2xml, kept here as the baseline
+    """
+
+    def sub_xml_entity(self, match):
+        ent = match.group(1)
+        if ent in self.XML_PREDEFINED_ENTITIES:
+            return "&" + ent + ";"
+        elif ent in list(self.keys()):
+            ret = eval("u'\\u%04x'" % self[ent].code)
+            return ret
+        else:
+            raise UnicodeError('Unknown numeric entity: %s' % match.group(0))
+
+    def ent2xml(self, the_entity):
+        the_xml = self.re_entity.sub(self.sub_xml_entity, the_entity)
+        the_xml = self.re_numentity.sub(self.numeric_entity_to_unicode, the_xml)
+        the_xml = self.re_hexnumentity.sub(self.hexadecimal_entity_to_unicode, the_xml)
+        return the_xml
+
+
+def make_abstract(handler, num_words, density):
+    """
+    abstract with a mix of named, decimal, hexadecimal, and XML predefined entities
+
+    :param handler:
+    :param num_words:
+    :param density: fraction of the words that are entities
+    :return:
+    """
+    names = sorted(name for name in handler.keys() if name not in handler.XML_PREDEFINED_ENTITIES and handler.entity_chars[name] not in handler.CHAINING_CHARS)
+    words = []
+    for i in range(num_words):
+        if random.random() < density:
+            kind = random.randrange(4)
+            if kind == 0:
+                words.append('&%s;' % random.choice(names))
+            elif kind == 1:
+                words.append('&#%d;' % random.randint(160, 8000))
+            elif kind == 2:
+                words.append('&#x%x;' % random.randint(160, 8000))
+            else:
+                words.append('&lt;sub&gt;')
+        else:
+            words.append('word%d' % i)
+    return ' '.join(words)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark UnicodeHandler.ent2xml')
+    parser.add_argument('--number', type=int, default=200, help='number of times each abstract is translated')
+    parser.add_argument('--words', type=int, default=300, help='number of words in each abstract')
+    args = parser.parse_args()
+
+    random.seed(1)
+    handler = UnicodeHandler()
+    previous = PreviousUnicodeHandler()
+    print('%10s %14s %14s %8s' % ('density', 'previous (s)', 'current (s)', 'speedup'))
+    for density in [0, 0.05, 0.2, 0.5]:
+        abstract = make_abstract(handler, args.words, density)
+        assert handler.ent2xml(abstract) == previous.ent2xml(abstract)
+        previous_time = min(timeit.repeat(lambda: previous.ent2xml(abstract), number=args.number, repeat=3))
+        current_time = min(timeit.repeat(lambda: handler.ent2xml(abstract), number=args.number, repeat=3))
+        print('%10.2f %14.4f %14.4f %7.1fx' % (density, previous_time, current_time, previous_time / current_time))
@@ -7,9 +7,23 @@ DOCMATCHPIPELINE_API_JOURNALS_SERVICE_URL = "http://0.0.0.0:5050"
 DOCMATCHPIPELINE_API_MAX_RECORDS_TO_ORACLE = "5000"
 DOCMATCHPIPELINE_API_ORACLE_SERVICE_ATTEMPTS = "10"
 DOCMATCHPIPELINE_API_ORACLE_SERVICE_SLEEP_SEC = "1"
+# pooled connections kept open to oracle, should be at least DOCMATCHPIPELINE_MATCH_WORKERS
+DOCMATCHPIPELINE_API_ORACLE_POOL_SIZE = "10"
+# timeout in seconds for calls to oracle, and per endpoint overrides
+DOCMATCHPIPELINE_API_ORACLE_TIMEOUT_SEC = "60"
+DOCMATCHPIPELINE_API_ORACLE_TIMEOUTS = {"cleanup": 600}
+# pages of /query requested at once when querying or dumping oracle db, should be at most DOCMATCHPIPELINE_API_ORACLE_POOL_SIZE
+DOCMATCHPIPELINE_ORACLE_QUERY_WORKERS = "4"
+# when True, batch matching, querying and dumping oracle db, and adding matches to it go through the asyncio client,
+# on one session, with DOCMATCHPIPELINE_MATCH_WORKERS requests in flight, DOCMATCHPIPELINE_MATCH_ADAPTIVE does not apply to it
+DOCMATCHPIPELINE_ORACLE_ASYNC = "False"
 
 # input filenames
 DOCMATCHPIPELINE_INPUT_FILENAME = "/match_oracle.input"
+# when this JSON Lines file (.jsonl, or gzipped .jsonl.gz) of records is in the day's directory, it is the input instead
+DOCMATCHPIPELINE_INPUT_RECORDS_FILENAME = "/match_oracle.jsonl.gz"
+# otherwise, when this archive (.tar, .tar.gz, .tgz, or .zip) of metadata files is there, its files are read without extracting them
+DOCMATCHPIPELINE_INPUT_ARCHIVE_FILENAME = "/match_oracle.tar.gz"
 
 # classic match of arxiv to published, or vice versa
 DOCMATCHPIPELINE_CLASSIC_MATCHES_FILENAME = "/match.out"
@@ -22,6 +36,59 @@ DOCMATCHPIPELINE_PUB_RESULT_FILENAME = "/matched_pub.output.csv"
 DOCMATCHPIPELINE_EPRINT_COMBINED_FILENAME = "/compare_eprint.csv"
 DOCMATCHPIPELINE_PUB_COMBINED_FILENAME = "/compare_pub.csv"
 
+# batch matching, number of records matched concurrently and the most oracle calls started per second
+DOCMATCHPIPELINE_MATCH_WORKERS = "1"
+DOCMATCHPIPELINE_MATCH_RATE_PER_SEC = "1"
+# when adaptive, the oracle requests in flight start at MIN_WORKERS and grow up to MATCH_WORKERS
+# while responses are faster than LATENCY_SEC, and are halved when oracle returns 502/504
+DOCMATCHPIPELINE_MATCH_ADAPTIVE = "False"
+DOCMATCHPIPELINE_MATCH_MIN_WORKERS = "1"
+DOCMATCHPIPELINE_MATCH_LATENCY_SEC = "10"
+# most parsed records waiting to be sent to oracle during a batch run
+DOCMATCHPIPELINE_MATCH_QUEUE_SIZE = "100"
+# metadata files listed in the input read ahead of parsing during a batch run, by this many threads, 0 turns it off,
+# and with READAHEAD the kernel is asked to read the whole file ahead as it is opened
+DOCMATCHPIPELINE_MATCH_PREFETCH = "0"
+DOCMATCHPIPELINE_MATCH_PREFETCH_THREADS = "4"
+DOCMATCHPIPELINE_MATCH_PREFETCH_READAHEAD = "False"
+# processes parsing metadata files and building oracle payloads during a batch run, 0 parses on a single thread
+DOCMATCHPIPELINE_MATCH_PARSE_PROCESSES = "0"
+# send records with the same bibcode and identical payloads to oracle once per batch run,
+# keeping the results of this many distinct requests for the duplicates
+DOCMATCHPIPELINE_MATCH_DEDUP = "False"
+DOCMATCHPIPELINE_MATCH_DEDUP_SIZE = "100000"
+# local sqlite cache of the successful oracle responses to match requests, keyed by the hash of the payload,
+# so that rerunning a day does not send the same requests again, empty filename turns the cache off,
+# entries expire after TTL_SEC, least recently used are evicted past MAX_ENTRIES, and with BYPASS
+# the cache is refreshed but not read (also -b on the command line)
+DOCMATCHPIPELINE_ORACLE_CACHE_FILENAME = ""
+DOCMATCHPIPELINE_ORACLE_CACHE_TTL_SEC = "604800"
+DOCMATCHPIPELINE_ORACLE_CACHE_MAX_ENTRIES = "500000"
+DOCMATCHPIPELINE_ORACLE_CACHE_BYPASS = "False"
+# local sqlite cache of the parsed metadata files, and of the author and doi fields of the payloads built from them,
+# keyed by the hash of the file contents, so that files read again, ie from the rerun list, are not parsed again,
+# empty filename turns the cache off, least recently used are evicted past MAX_ENTRIES
+DOCMATCHPIPELINE_METADATA_CACHE_FILENAME = ""
+DOCMATCHPIPELINE_METADATA_CACHE_MAX_ENTRIES = "200000"
+# number of normalized author lists kept in memory, 0 turns the cache off
+DOCMATCHPIPELINE_AUTHOR_CACHE_SIZE = "1000"
+# author lists with more authors than this (ie, large collaborations) send oracle only the collaborations and
+# the first this many authors, along with the number of authors in author_count, 0 sends all the authors
+DOCMATCHPIPELINE_MAX_AUTHORS = "0"
+# seconds allowed to normalize one author list, past that only the last names are kept, 0 means no limit,
+# a pattern still running is interrupted only on the main thread, so on the threads of batch runs,
+# author lists with more words than DOCMATCHPIPELINE_AUTHOR_THREAD_MAX_WORDS are normalized in a worker process
+DOCMATCHPIPELINE_AUTHOR_BUDGET_SEC = "0"
+DOCMATCHPIPELINE_AUTHOR_THREAD_MAX_WORDS = "300"
+# with the budget set, off the main thread, the and pattern, that backtracks exponentially in the number of names,
+# is tried on author lists of at most this many words, longer ones are normalized in the worker process
+DOCMATCHPIPELINE_AND_HOOK_MAX_WORDS = "10"
+# batch results are written as csv (with links, the only format the classic comparison reads), tsv, or jsonl,
+# buffered until this many bytes are pending or this many seconds have passed
+DOCMATCHPIPELINE_RESULT_FORMAT = "csv"
+DOCMATCHPIPELINE_RESULT_BUFFER_SIZE = "65536"
+DOCMATCHPIPELINE_RESULT_FLUSH_SEC = "5"
+
 # filename to log failed metadata filenames
 DOCMATCHPIPELINE_RERUN_FILENAME = "../rerun.input"
 
@@ -50,6 +117,10 @@ DOCMATCHPIPELINE_MATCHES_KILL_FILE="matches.kill"
 DOCMATCHPIPELINE_MATCHES_KILL_FROZEN_FILE="matches.kill.frozen"
 DOCMATCHPIPELINE_ORACLE_DUMP_FILE="oracle_dump.tsv"
 DOCMATCHPIPELINE_ORACLE_DUMP_AGE=9999
+# when set, the daily dump fetches only the matches of the last this many days and merges them into the previous dump,
+# the whole db is still dumped every FULL_REFRESH_DAYS, to drop the matches deleted from db
+DOCMATCHPIPELINE_ORACLE_DUMP_INCREMENTAL_DAYS = "0"
+DOCMATCHPIPELINE_ORACLE_DUMP_FULL_REFRESH_DAYS = "7"
 DOCMATCHPIPELINE_USER_SUBMITTED_FILE="user_submitted.list"
 DOCMATCHPIPELINE_USER_SUBMITTED_FROZEN_FILE="user_submitted_frozen.list"
 
@@ -3,6 +3,7 @@ import os
 
 from adsdocmatch.match_w_metadata import MatchMetadata
 from adsdocmatch.oracle_util import OracleUtil
+from adsdocmatch.oracle_async import get_oracle_util
 from adsputils import load_config, setup_logging
 
 proj_home = os.path.realpath(os.path.join(os.path.dirname(__file__), "./"))
@@ -36,6 +37,20 @@ def get_args():
                         default="./data/",
                         help="Path to top level directory to process.")
 
+    parser.add_argument("-r",
+                        "--resume",
+                        dest="resume",
+                        action="store_true",
+                        default=False,
+                        help="With -mp or -me, continue an interrupted run, skipping records already processed.")
+
+    parser.add_argument("-b",
+                        "--bypass-cache",
+                        dest="bypass_cache",
+                        action="store_true",
+                        default=False,
+                        help="With -mp or -me, send all the records to oracle even if their results are cached, and refresh the cache.")
+
     parser.add_argument("-q",
                         "--query-oracle",
                         dest="query_oracle",
@@ -131,11 +146,13 @@ def main():
             elif args.date:
                 path = config.get("EPRINT_BASE_DIRECTORY", "./") + "/" + args.date
             if path:
+                if args.bypass_cache:
+                    OracleUtil.match_cache_bypass = True
                 try:
                     if args.match_to_pub:
-                        outFile = MatchMetadata().process_match_to_pub(path)
+                        outFile = MatchMetadata().process_match_to_pub(path, resume=args.resume)
                     if args.match_to_eprint:
-                        outFile = MatchMetadata().process_match_to_arXiv(path)
+                        outFile = MatchMetadata().process_match_to_arXiv(path, resume=args.resume)
                 except Exception as err:
                     logger.error("Doc matching failed for path %s: %s" % (path, err))
             else:
@@ -143,7 +160,7 @@ def main():
 
         elif args.query_oracle:
             try:
-                query_results = OracleUtil().query(args.output_filename, args.num_days)
+                query_results = get_oracle_util().query(args.output_filename, args.num_days)
                 logger.info(query_results)
             except Exception as err:
                 logger.error("Error querying oracledb: %s" % err)
@@ -159,7 +176,7 @@ def main():
         elif args.matched_file_to_oracle or args.apply_source:
             if args.matched_file_to_oracle and args.apply_source:
                 try:
-                    status = OracleUtil().update_db_sourced_matches(args.matched_file_to_oracle, args.apply_source)
+                    status = get_oracle_util().update_db_sourced_matches(args.matched_file_to_oracle, args.apply_source)
                     logger.info("Processed file `%s` using source `%s`. %s" % (args.matched_file_to_oracle, args.apply_source, status))
                 except Exception as err:
                     logger.error("Error adding matches from %s with source %s to database: %s" % (args.matched_file_to_oracle, args.apply_source, err))
@@ -179,19 +196,19 @@ def main():
 
         # daily: process and archive user submissions
         elif args.load_curated_file:
-            OracleUtil().load_curated_file()
+            get_oracle_util().load_curated_file()
 
         # daily: process matches.kill without archiving
         elif args.load_matches_kill:
             input_filename = config.get("DOCMATCHPIPELINE_PUBLISHED_DIR", "/tmp/") + config.get("DOCMATCHPIPELINE_MATCHES_KILL_FILE", "matches.kill")
             frozen_filename = config.get("DOCMATCHPIPELINE_PUBLISHED_DIR", "/tmp/") + config.get("DOCMATCHPIPELINE_MATCHES_KILL_FROZEN_FILE", "matches.kill.frozen")
             if input_filename:
-                OracleUtil().load_curated_file(input_filename=input_filename, frozen_filename=frozen_filename, input_score=-1.0, do_backup=False)
+                get_oracle_util().load_curated_file(input_filename=input_filename, frozen_filename=frozen_filename, input_score=-1.0, do_backup=False)
 
         # daily: dump the oracle database to file
         elif args.dump_oracle:
             try:
-                OracleUtil().dump_oracledb()
+                get_oracle_util().dump_oracledb()
             except Exception as err:
                 logger.error("Error dumping oracle db to file: %s" % err)
         else: